@@ -0,0 +1,186 @@
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_guild import FakeCDN, FakeGuild, FakeLogChannel
+from benchmarks.fake_s3 import FakeS3
+
+BUCKET = "bench-backups"
+
+class BenchBot:
+    # Just enough of commands.Bot for the cogs to run without a gateway connection
+    def __init__(self):
+        self.cogs = {}
+        self.guild_map = {}
+        self.channel_map = {}
+        self.latency = 0.0
+
+    @property
+    def guilds(self):
+        return list(self.guild_map.values())
+
+    def get_cog(self, name):
+        return self.cogs.get(name)
+
+    def get_guild(self, guild_id):
+        return self.guild_map.get(guild_id)
+
+    def get_channel(self, channel_id):
+        return self.channel_map.get(channel_id)
+
+async def build_bot(s3_url, args):
+    os.environ.update({
+        'R2_ENDPOINT': s3_url,
+        'R2_ACCESS_KEY': 'bench',
+        'R2_SECRET_KEY': 'bench',
+        'R2_BUCKET_NAME': BUCKET,
+        'AWS_DEFAULT_REGION': 'auto',
+        'STATS_SINK': 'none',
+        'INCREMENTAL_BACKUPS': 'true' if args.incremental else 'false',
+        'MAX_CONCURRENT_BACKUPS': str(args.max_backups),
+        'DOWNLOAD_CONCURRENCY': str(args.download_concurrency)
+    })
+    from cogs.database import DatabaseCog
+    from cogs.utils import UtilsCog
+    from cogs.stats import StatsCog
+    from cogs.metrics import MetricsCog
+    from cogs.changes import ChangeTrackerCog
+    from cogs.leases import LeaseCog
+    from cogs.backup import BackupCog
+    from cogs.retention import RetentionCog
+    from cogs.planner import PlannerCog
+
+    bot = BenchBot()
+    for cls in (DatabaseCog, UtilsCog, StatsCog, MetricsCog, ChangeTrackerCog, LeaseCog, BackupCog, RetentionCog, PlannerCog):
+        bot.cogs[cls.__name__] = cls(bot)
+        if hasattr(bot.cogs[cls.__name__], 'cog_load'):
+            await bot.cogs[cls.__name__].cog_load()
+    for cog in bot.cogs.values():
+        await cog.initialize_relationships()
+    # The stand-in servers share this event loop, so blocking S3 calls must go through the executor
+    utils_cog = bot.cogs['UtilsCog']
+    await utils_cog.run_blocking(lambda: utils_cog.s3.create_bucket(Bucket=BUCKET))
+    return bot
+
+def add_guild(bot, guild_id, asset_base, args):
+    guild = FakeGuild(guild_id, asset_base, channels=args.channels, roles=args.roles, emojis=args.emojis, stickers=args.stickers, role_icons=args.role_icons)
+    channel = FakeLogChannel(guild_id + 1)
+    bot.guild_map[guild_id] = guild
+    bot.channel_map[channel.id] = channel
+    bot.cogs['BackupCog'].backup_jobs[guild_id] = {
+        'log_channel_id': channel.id,
+        'job': None,
+        'timezone': 'UTC',
+        'frequency': 'daily',
+        'preferences': {}
+    }
+    return guild
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+async def timed_backup(backup_cog, guild_id, latencies):
+    start = time.perf_counter()
+    # Forced so repeated runs of an unchanged fake guild measure a full backup, not the skip path
+    ok = await backup_cog.save_server_data(guild_id, force=True)
+    latencies.append(time.perf_counter() - start)
+    return ok
+
+async def run(args):
+    cdn, s3 = FakeCDN(asset_size=args.asset_size, rate_limit=args.cdn_rate_limit), FakeS3()
+    asset_base = await cdn.start()
+    s3_url = await s3.start()
+    workdir = tempfile.mkdtemp(prefix="backupbot-bench-")
+    os.chdir(workdir)
+    bot = await build_bot(s3_url, args)
+    backup_cog = bot.cogs['BackupCog']
+    report = {}
+    try:
+        # Single guild, backups one after another
+        guild_id = 1000
+        add_guild(bot, guild_id, asset_base, args)
+        latencies = []
+        start = time.perf_counter()
+        results = [await timed_backup(backup_cog, guild_id, latencies) for _ in range(args.iterations)]
+        report['single_guild'] = summarize(latencies, results, time.perf_counter() - start)
+
+        # Many guilds, all due at once
+        guild_ids = [2000 + i * 10 for i in range(args.guilds)]
+        for gid in guild_ids:
+            add_guild(bot, gid, asset_base, args)
+        latencies = []
+        start = time.perf_counter()
+        results = await asyncio.gather(*(timed_backup(backup_cog, gid, latencies) for gid in guild_ids))
+        report['many_guilds'] = summarize(latencies, results, time.perf_counter() - start)
+    finally:
+        await backup_cog.cog_unload()
+        await cdn.stop()
+        await s3.stop()
+
+    report['bytes'] = {
+        'cdn_served': cdn.bytes_served,
+        'r2_received': s3.bytes_received,
+        'discord_sent': sum(c.bytes_sent for c in bot.channel_map.values())
+    }
+    report['requests'] = {'cdn': cdn.requests, 'cdn_429': cdn.rate_limited, 'r2': s3.requests}
+    report['cdn_budget'] = bot.cogs['UtilsCog'].cdn_budget.snapshot()
+    report['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    report['workdir'] = workdir
+    return report
+
+def summarize(latencies, results, elapsed):
+    return {
+        'backups': len(results),
+        'failed': sum(1 for ok in results if not ok),
+        'seconds': elapsed,
+        'backups_per_sec': len(results) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000
+    }
+
+def print_report(report):
+    for name in ('single_guild', 'many_guilds'):
+        r = report[name]
+        print(f"{name:>12}: {r['backups']} backups ({r['failed']} failed) in {r['seconds']:.2f}s | "
+              f"{r['backups_per_sec']:.2f} backups/s | p50 {r['p50_ms']:.0f} ms | p99 {r['p99_ms']:.0f} ms")
+    b = report['bytes']
+    print(f"       bytes: CDN {b['cdn_served'] / 1024 / 1024:.1f} MiB | R2 {b['r2_received'] / 1024 / 1024:.1f} MiB | Discord {b['discord_sent'] / 1024 / 1024:.1f} MiB")
+    r, budget = report['requests'], report['cdn_budget']
+    rate = f"{budget['rate']:.0f}/s" if budget['rate'] else "uncapped"
+    print(f"    requests: CDN {r['cdn']} ({r['cdn_429']} 429s) | R2 {r['r2']} | CDN budget {rate} after {budget['throttled']} 429s")
+    print(f"    peak RSS: {report['peak_rss_mb']:.1f} MiB")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark for the BackupBot backup pipeline")
+    parser.add_argument('--guilds', type=int, default=20, help="guilds backed up concurrently in the many-guild run")
+    parser.add_argument('--iterations', type=int, default=5, help="sequential backups in the single-guild run")
+    parser.add_argument('--channels', type=int, default=100)
+    parser.add_argument('--roles', type=int, default=100)
+    parser.add_argument('--emojis', type=int, default=250)
+    parser.add_argument('--stickers', type=int, default=60)
+    parser.add_argument('--role-icons', type=int, default=20)
+    parser.add_argument('--asset-size', type=int, default=32 * 1024, help="bytes per emoji/sticker/icon")
+    parser.add_argument('--cdn-rate-limit', type=int, default=0, help="requests per second the fake CDN serves before answering 429 (0: unlimited)")
+    parser.add_argument('--max-backups', type=int, default=8)
+    parser.add_argument('--download-concurrency', type=int, default=16)
+    parser.add_argument('--incremental', action='store_true', help="enable the content-addressed asset store")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    args = parser.parse_args()
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+if __name__ == "__main__":
+    main()
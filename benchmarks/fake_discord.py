@@ -0,0 +1,140 @@
+import asyncio
+import hashlib
+import itertools
+import json
+import time
+from aiohttp import web
+
+class FakeDiscord:
+    # Minimal Discord REST stand-in for restores: roles, channels, emojis and stickers of any guild id. Every
+    # route has its own rate-limit bucket per guild with X-RateLimit-* headers and 429s like Discord's, plus a
+    # global per-second limit. Channels with an unknown parent and overwrites naming unknown roles are rejected.
+    def __init__(self, bucket_limit=5, bucket_window=1.0, global_limit=50, latency=0.02):
+        self.bucket_limit = bucket_limit
+        self.bucket_window = bucket_window
+        self.global_limit = global_limit
+        self.latency = latency
+        self.guilds = {}
+        self.ids = itertools.count(1 << 50)
+        self.buckets = {}
+        self.global_window = [0.0, 0]
+        self.requests = 0
+        self.rate_limited = 0
+        self.runner = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_get('/api/v10/users/@me', self.me)
+        app.router.add_route('*', '/api/v10/guilds/{guild_id}/{kind}', self.handle)
+        app.router.add_route('*', '/api/v10/guilds/{guild_id}/{kind}/{item_id}', self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        return f"http://{host}:{site._server.sockets[0].getsockname()[1]}/api/v10"
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+    def guild(self, guild_id):
+        guild_id = int(guild_id)
+        if guild_id not in self.guilds:
+            everyone = {'id': str(guild_id), 'name': '@everyone', 'permissions': '0', 'position': 0, 'managed': False}
+            self.guilds[guild_id] = {'roles': {guild_id: everyone}, 'channels': {}, 'emojis': {}, 'stickers': {}}
+        return self.guilds[guild_id]
+
+    def limit(self, name):
+        # Returns the rate-limit headers of the request, or a 429 response when its bucket or the global limit is spent.
+        # discord.py only retries 429s that carry a Via header, anything else it takes for a Cloudflare ban.
+        now = time.monotonic()
+        if now - self.global_window[0] >= 1.0:
+            self.global_window = [now, 0]
+        if self.global_window[1] >= self.global_limit:
+            retry = 1.0 - (now - self.global_window[0])
+            self.rate_limited += 1
+            return self.respond(
+                {'message': 'You are being rate limited.', 'retry_after': retry, 'global': True},
+                status=429, headers={'Retry-After': f"{retry:.3f}", 'X-RateLimit-Global': 'true', 'X-RateLimit-Scope': 'global', 'Via': '1.1 google'}
+            )
+        window = self.buckets.get(name)
+        if window is None or now - window[0] >= self.bucket_window:
+            window = self.buckets[name] = [now, 0]
+        reset_after = self.bucket_window - (now - window[0])
+        headers = {
+            'X-RateLimit-Limit': str(self.bucket_limit),
+            'X-RateLimit-Reset-After': f"{reset_after:.3f}",
+            'X-RateLimit-Reset': f"{time.time() + reset_after:.3f}",
+            'X-RateLimit-Bucket': hashlib.md5(name.split(':')[0].encode()).hexdigest()
+        }
+        if window[1] >= self.bucket_limit:
+            self.rate_limited += 1
+            headers.update({'X-RateLimit-Remaining': '0', 'Retry-After': f"{reset_after:.3f}", 'X-RateLimit-Scope': 'user', 'Via': '1.1 google'})
+            return self.respond({'message': 'You are being rate limited.', 'retry_after': reset_after, 'global': False}, status=429, headers=headers)
+        window[1] += 1
+        self.global_window[1] += 1
+        headers['X-RateLimit-Remaining'] = str(self.bucket_limit - window[1])
+        return headers
+
+    async def me(self, request):
+        return self.respond({'id': '1', 'username': 'backupbot', 'discriminator': '0', 'avatar': None, 'global_name': None})
+
+    async def handle(self, request):
+        self.requests += 1
+        guild_id, kind = request.match_info['guild_id'], request.match_info['kind']
+        item_id = request.match_info.get('item_id')
+        route = f"{request.method} /guilds/{{guild_id}}/{kind}{'/{id}' if item_id else ''}"
+        limited = self.limit(f"{route}:{guild_id}")
+        if isinstance(limited, web.Response):
+            return limited
+        await asyncio.sleep(self.latency)
+        if kind not in ('roles', 'channels', 'emojis', 'stickers'):
+            return self.error(404, 'Unknown route', limited)
+        guild = self.guild(guild_id)
+        items = guild[kind]
+        if request.method == 'GET':
+            return self.respond(list(items.values()), headers=limited)
+        if kind == 'stickers':
+            form = await request.post()
+            payload = {'name': form.get('name'), 'description': form.get('description', ''), 'tags': form.get('tags', '')}
+            if 'file' not in form:
+                return self.error(400, 'Missing sticker file', limited)
+        else:
+            payload = await request.json()
+        if request.method == 'PATCH' and kind == 'roles' and item_id is None:
+            for entry in payload:
+                role = items.get(int(entry['id']))
+                if role is None:
+                    return self.error(400, 'Unknown Role', limited)
+                role['position'] = entry['position']
+            return self.respond(sorted(items.values(), key=lambda r: r['position']), headers=limited)
+        if request.method == 'PATCH':
+            item = items.get(int(item_id))
+            if item is None:
+                return self.error(404, 'Unknown Role', limited)
+            item.update(payload)
+            return self.respond(item, headers=limited)
+        if request.method != 'POST':
+            return self.error(405, 'Method Not Allowed', limited)
+        if kind == 'channels':
+            parent = payload.get('parent_id')
+            if parent is not None and guild['channels'].get(int(parent), {}).get('type') != 4:
+                return self.error(400, 'Unknown parent category', limited)
+            for overwrite in payload.get('permission_overwrites', []):
+                if overwrite['type'] == 0 and int(overwrite['id']) not in guild['roles']:
+                    return self.error(400, 'Unknown role in permission overwrites', limited)
+        if kind == 'emojis' and not str(payload.get('image', '')).startswith('data:image/'):
+            return self.error(400, 'Invalid emoji image', limited)
+        item = {key: value for key, value in payload.items() if key not in ('image', 'icon')}
+        item['id'] = str(next(self.ids))
+        item.setdefault('position', len(items))
+        items[int(item['id'])] = item
+        return self.respond(item, status=201 if kind != 'roles' else 200, headers=limited)
+
+    @staticmethod
+    def respond(data, status=200, headers=None):
+        # Exactly "application/json", discord.py treats a content type with a charset as plain text
+        return web.Response(status=status, body=json.dumps(data).encode(), headers={**(headers or {}), 'Content-Type': 'application/json'})
+
+    def error(self, status, message, headers):
+        return self.respond({'message': message, 'code': 0}, status, headers)
@@ -0,0 +1,152 @@
+import random
+import time
+import discord
+from aiohttp import web
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+class FakeAsset:
+    def __init__(self, url, key):
+        self.url = url
+        self.key = key
+
+class FakeRole:
+    def __init__(self, guild, index, icon=None):
+        self.guild = guild
+        self.id = guild.id * 10000 + index
+        self.name = f"role-{index}" if index else "@everyone"
+        self.position = index
+        self.permissions = discord.Permissions(send_messages=True, read_messages=True, manage_messages=index % 5 == 0)
+        self.colour = self.color = discord.Colour(index * 997 % 0xFFFFFF)
+        self.hoist = index % 7 == 0
+        self.mentionable = index % 3 == 0
+        self.managed = False
+        self.icon = icon
+
+    def is_default(self):
+        return self.position == 0
+
+class FakeEmoji:
+    def __init__(self, guild, index, url):
+        self.id = guild.id * 10000 + index
+        self.name = f"emoji_{index}"
+        self.animated = index % 10 == 0
+        self.url = url
+
+class FakeSticker:
+    def __init__(self, guild, index, url):
+        self.id = guild.id * 10000 + index
+        self.name = f"sticker_{index}"
+        self.description = ""
+        self.emoji = "smile"
+        self.url = url
+
+class FakeChannel:
+    def __init__(self, guild, index, name, kind, category=None):
+        self.guild = guild
+        self.id = guild.id * 100000 + index
+        self.name = name
+        self.type = kind
+        self.position = index
+        self.category = category
+        self.category_id = category.id if category else None
+        self.topic = None
+        self.nsfw = False
+        self.slowmode_delay = 0
+        self.bitrate = 64000
+        self.user_limit = 0
+        self.overwrites = {}
+        self.text_channels = []
+        self.voice_channels = []
+        self.channels = []
+
+class FakeLogChannel:
+    # Stands in for the Discord log channel and counts what would be delivered
+    def __init__(self, channel_id):
+        self.id = channel_id
+        self.messages = 0
+        self.bytes_sent = 0
+
+    async def send(self, content=None, file=None, **kwargs):
+        self.messages += 1
+        if file is not None:
+            self.bytes_sent += len(file.fp.read())
+
+class FakeGuild:
+    def __init__(self, guild_id, asset_base, channels=50, roles=50, emojis=100, stickers=20, role_icons=10):
+        self.id = guild_id
+        self.name = f"Bench Guild {guild_id}"
+        self.member_count = 1000
+        self.created_at = "2020-01-01 00:00:00+00:00"
+        self.premium_subscription_count = 0
+        self.premium_tier = 0
+        self.filesize_limit = 10 * 1024 * 1024
+        self.icon = FakeAsset(f"{asset_base}/icons/{guild_id}/icon.png", f"icon{guild_id}")
+        self.banner = FakeAsset(f"{asset_base}/banners/{guild_id}/banner.png", f"banner{guild_id}")
+        self.splash = None
+        self.discovery_splash = None
+        self.roles = [
+            FakeRole(self, i, FakeAsset(f"{asset_base}/role-icons/{guild_id}/{i}.png", f"ri{guild_id}_{i}") if 0 < i <= role_icons else None)
+            for i in range(max(roles, role_icons + 1))
+        ]
+        self.default_role = self.roles[0]
+        self.emojis = [FakeEmoji(self, i, f"{asset_base}/emojis/{guild_id}/{i}.{'gif' if i % 10 == 0 else 'png'}") for i in range(emojis)]
+        self.stickers = [FakeSticker(self, i, f"{asset_base}/stickers/{guild_id}/{i}.png") for i in range(stickers)]
+        self.categories = [FakeChannel(self, i, f"category-{i}", discord.ChannelType.category) for i in range(max(channels // 10, 1))]
+        self.text_channels = []
+        self.voice_channels = []
+        for i in range(channels):
+            category = self.categories[i % len(self.categories)] if i % 4 else None
+            kind = discord.ChannelType.voice if i % 5 == 0 else discord.ChannelType.text
+            channel = FakeChannel(self, 1000 + i, f"channel-{i}", kind, category)
+            (self.voice_channels if kind == discord.ChannelType.voice else self.text_channels).append(channel)
+            if i % 3 == 0:
+                # Private channel: hidden from @everyone, visible to one role
+                channel.overwrites = {
+                    self.default_role: discord.PermissionOverwrite(view_channel=False),
+                    self.roles[1 + i % (len(self.roles) - 1)]: discord.PermissionOverwrite(view_channel=True)
+                } if len(self.roles) > 1 else {}
+            if category:
+                (category.voice_channels if kind == discord.ChannelType.voice else category.text_channels).append(channel)
+                category.channels.append(channel)
+        self.channels = self.categories + self.text_channels + self.voice_channels
+
+class FakeCDN:
+    # Serves deterministic pseudo-random bytes for any asset path so downloads are repeatable. With rate_limit set,
+    # requests beyond that many per second get a 429 with Retry-After, like a CDN pushing back.
+    def __init__(self, asset_size=32 * 1024, rate_limit=0):
+        self.asset_size = asset_size
+        self.rate_limit = rate_limit
+        self.window = [0.0, 0]
+        self.bytes_served = 0
+        self.requests = 0
+        self.rate_limited = 0
+        self.runner = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        app = web.Application()
+        app.router.add_get('/{path:.*}', self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        return f"http://{host}:{site._server.sockets[0].getsockname()[1]}"
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+    async def handle(self, request):
+        self.requests += 1
+        if self.rate_limit:
+            now = time.monotonic()
+            if now - self.window[0] >= 1.0:
+                self.window = [now, 0]
+            if self.window[1] >= self.rate_limit:
+                self.rate_limited += 1
+                return web.Response(status=429, headers={'Retry-After': f"{1.0 - (now - self.window[0]):.3f}"})
+            self.window[1] += 1
+        # Already-compressed media is effectively random bytes behind a PNG signature
+        body = PNG_SIGNATURE + random.Random(request.path).randbytes(max(self.asset_size - len(PNG_SIGNATURE), 0))
+        self.bytes_served += len(body)
+        return web.Response(body=body, content_type='image/png')
@@ -0,0 +1,151 @@
+import hashlib
+import itertools
+import xml.etree.ElementTree as ET
+from aiohttp import web
+from datetime import datetime, timezone
+from xml.sax.saxutils import escape
+
+NS = "http://s3.amazonaws.com/doc/2006-03-01/"
+
+def decode_aws_chunked(body):
+    # boto3 streams uploads as aws-chunked with trailing checksums
+    out = bytearray()
+    pos = 0
+    while True:
+        end = body.index(b"\r\n", pos)
+        size = int(body[pos:end].split(b";")[0], 16)
+        pos = end + 2
+        if size == 0:
+            return bytes(out)
+        out += body[pos:pos + size]
+        pos += size + 2
+
+def xml_response(body, status=200):
+    return web.Response(text=f'<?xml version="1.0" encoding="UTF-8"?>{body}', status=status, content_type='application/xml')
+
+class FakeS3:
+    # Minimal in-memory S3-compatible server: objects, multipart uploads, listing and bulk delete
+    def __init__(self, keep_data=False):
+        self.keep_data = keep_data
+        self.buckets = {}
+        self.uploads = {}
+        self.ids = itertools.count(1)
+        self.bytes_received = 0
+        self.requests = 0
+        self.runner = None
+        self.port = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        app = web.Application(client_max_size=1024 ** 3)
+        app.router.add_route('*', '/{bucket}', self.handle_bucket)
+        app.router.add_route('*', '/{bucket}/{key:.+}', self.handle_object)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{self.port}"
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+    async def read_body(self, request):
+        body = await request.read()
+        if 'aws-chunked' in request.headers.get('Content-Encoding', '') or 'x-amz-decoded-content-length' in request.headers:
+            body = decode_aws_chunked(body)
+        self.bytes_received += len(body)
+        return body
+
+    def store(self, bucket, key, data, size=None):
+        etag = '"' + hashlib.md5(data).hexdigest() + '"'
+        self.buckets.setdefault(bucket, {})[key] = {
+            'data': data if self.keep_data else None,
+            'size': len(data) if size is None else size,
+            'etag': etag,
+            'modified': datetime.now(timezone.utc)
+        }
+        return etag
+
+    async def handle_bucket(self, request):
+        self.requests += 1
+        bucket = request.match_info['bucket']
+        if request.method == 'PUT':
+            self.buckets.setdefault(bucket, {})
+            return web.Response()
+        if request.method == 'POST' and 'delete' in request.query:
+            root = ET.fromstring(await self.read_body(request))
+            deleted = []
+            for obj in root.iter():
+                if obj.tag.endswith('Key'):
+                    self.buckets.get(bucket, {}).pop(obj.text, None)
+                    deleted.append(f"<Deleted><Key>{escape(obj.text)}</Key></Deleted>")
+            return xml_response(f'<DeleteResult xmlns="{NS}">{"".join(deleted)}</DeleteResult>')
+        if request.method == 'GET':
+            prefix = request.query.get('prefix', '')
+            max_keys = int(request.query.get('max-keys', 1000))
+            start_after = request.query.get('continuation-token') or request.query.get('start-after', '')
+            keys = sorted(k for k in self.buckets.get(bucket, {}) if k.startswith(prefix) and k > start_after)
+            page, truncated = keys[:max_keys], len(keys) > max_keys
+            contents = "".join(
+                f"<Contents><Key>{escape(k)}</Key><LastModified>{o['modified'].strftime('%Y-%m-%dT%H:%M:%S.000Z')}</LastModified>"
+                f"<ETag>{escape(o['etag'])}</ETag><Size>{o['size']}</Size><StorageClass>STANDARD</StorageClass></Contents>"
+                for k, o in ((k, self.buckets[bucket][k]) for k in page)
+            )
+            token = f"<NextContinuationToken>{escape(page[-1])}</NextContinuationToken>" if truncated else ""
+            return xml_response(
+                f'<ListBucketResult xmlns="{NS}"><Name>{bucket}</Name><Prefix>{escape(prefix)}</Prefix>'
+                f'<KeyCount>{len(page)}</KeyCount><MaxKeys>{max_keys}</MaxKeys><IsTruncated>{str(truncated).lower()}</IsTruncated>'
+                f'{token}{contents}</ListBucketResult>'
+            )
+        return web.Response(status=405)
+
+    async def handle_object(self, request):
+        self.requests += 1
+        bucket, key = request.match_info['bucket'], request.match_info['key']
+        query = request.query
+        if request.method == 'POST' and 'uploads' in query:
+            upload_id = str(next(self.ids))
+            self.uploads[upload_id] = {'bucket': bucket, 'key': key, 'parts': {}}
+            return xml_response(f'<InitiateMultipartUploadResult xmlns="{NS}"><Bucket>{bucket}</Bucket><Key>{escape(key)}</Key><UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>')
+        if request.method == 'PUT' and 'uploadId' in query:
+            upload = self.uploads.get(query['uploadId'])
+            if upload is None:
+                return xml_response('<Error><Code>NoSuchUpload</Code></Error>', 404)
+            data = await self.read_body(request)
+            etag = '"' + hashlib.md5(data).hexdigest() + '"'
+            upload['parts'][int(query['partNumber'])] = {'data': data if self.keep_data else b'', 'size': len(data), 'etag': etag}
+            return web.Response(headers={'ETag': etag})
+        if request.method == 'GET' and 'uploadId' in query:
+            upload = self.uploads.get(query['uploadId'])
+            if upload is None:
+                return xml_response('<Error><Code>NoSuchUpload</Code></Error>', 404)
+            parts = "".join(
+                f"<Part><PartNumber>{n}</PartNumber><ETag>{escape(p['etag'])}</ETag><Size>{p['size']}</Size></Part>"
+                for n, p in sorted(upload['parts'].items())
+            )
+            return xml_response(f'<ListPartsResult xmlns="{NS}"><Bucket>{bucket}</Bucket><Key>{escape(key)}</Key><UploadId>{query["uploadId"]}</UploadId><IsTruncated>false</IsTruncated>{parts}</ListPartsResult>')
+        if request.method == 'POST' and 'uploadId' in query:
+            upload = self.uploads.pop(query['uploadId'], None)
+            if upload is None:
+                return xml_response('<Error><Code>NoSuchUpload</Code></Error>', 404)
+            await self.read_body(request)
+            parts = [upload['parts'][n] for n in sorted(upload['parts'])]
+            etag = self.store(bucket, key, b"".join(p['data'] for p in parts), size=sum(p['size'] for p in parts))
+            return xml_response(f'<CompleteMultipartUploadResult xmlns="{NS}"><Bucket>{bucket}</Bucket><Key>{escape(key)}</Key><ETag>{escape(etag)}</ETag></CompleteMultipartUploadResult>')
+        if request.method == 'DELETE' and 'uploadId' in query:
+            self.uploads.pop(query['uploadId'], None)
+            return web.Response(status=204)
+        if request.method == 'PUT':
+            data = await self.read_body(request)
+            return web.Response(headers={'ETag': self.store(bucket, key, data)})
+        obj = self.buckets.get(bucket, {}).get(key)
+        if request.method == 'DELETE':
+            self.buckets.get(bucket, {}).pop(key, None)
+            return web.Response(status=204)
+        if obj is None:
+            return xml_response('<Error><Code>NoSuchKey</Code></Error>', 404)
+        headers = {'ETag': obj['etag'], 'Content-Length': str(obj['size'])}
+        if request.method == 'HEAD':
+            return web.Response(headers=headers)
+        return web.Response(body=obj['data'] or b"", headers={'ETag': obj['etag']})
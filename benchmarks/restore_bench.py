@@ -0,0 +1,101 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import zipfile
+
+import discord
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_discord import FakeDiscord
+from benchmarks.fake_guild import PNG_SIGNATURE, FakeGuild
+from cogs.backup import guild_snapshot
+from cogs.restore import RestoreEngine, RestorePlan, RestoreSource, fetch_existing
+
+SOURCE_GUILD = 1000
+TARGET_GUILD = 2000
+
+def build_backup(path, args):
+    # A zip like the ones BackupCog writes: backup.json plus one entry per emoji and sticker
+    guild = FakeGuild(SOURCE_GUILD, "http://assets.invalid", channels=args.channels, roles=args.roles, emojis=args.emojis, stickers=args.stickers, role_icons=0)
+    files = {f"emoji:{e.id}": f"emojis/{e.name}.png" for e in guild.emojis}
+    files.update({f"sticker:{s.id}": f"stickers/{s.name}.png" for s in guild.stickers})
+    with zipfile.ZipFile(path, 'w') as zf:
+        zf.writestr("backup.json", json.dumps(guild_snapshot(guild, {}, files)))
+        for name in files.values():
+            zf.writestr(name, PNG_SIGNATURE + os.urandom(args.asset_size))
+
+async def restore(http, source, args, dry_run=False):
+    start = time.perf_counter()
+    plan = RestorePlan(source.snapshot, await fetch_existing(http, TARGET_GUILD))
+    engine = RestoreEngine(http, TARGET_GUILD, plan, lambda name: asyncio.to_thread(source.read, name), args.concurrency)
+    if not dry_run:
+        await engine.run()
+    return {
+        'seconds': time.perf_counter() - start,
+        'steps': len(plan.steps),
+        'kept': sum(plan.kept.values()),
+        'failed': len(engine.failed),
+        'errors': [error for _, _, error in engine.failed[:3]]
+    }
+
+async def run(args):
+    fake = FakeDiscord(bucket_limit=args.bucket_limit, bucket_window=args.bucket_window, global_limit=args.global_limit, latency=args.latency)
+    discord.http.Route.BASE = await fake.start()
+    workdir = tempfile.mkdtemp(prefix="backupbot-restore-bench-")
+    path = os.path.join(workdir, "backup.zip")
+    build_backup(path, args)
+    source = RestoreSource(path)
+    source.load()
+    http = discord.http.HTTPClient(asyncio.get_running_loop())
+    await http.static_login('bench')
+    report = {}
+    try:
+        for name, dry_run in (('dry_run', True), ('restore', False), ('rerun', False)):
+            requests, limited = fake.requests, fake.rate_limited
+            report[name] = await restore(http, source, args, dry_run)
+            report[name]['requests'] = fake.requests - requests
+            report[name]['rate_limited'] = fake.rate_limited - limited
+    finally:
+        source.close()
+        await http.close()
+        await fake.stop()
+    guild = fake.guilds.get(TARGET_GUILD, {})
+    report['created'] = {kind: len(items) for kind, items in guild.items()}
+    return report
+
+def print_report(report):
+    for name in ('dry_run', 'restore', 'rerun'):
+        r = report[name]
+        print(f"{name:>8}: {r['steps']} steps ({r['kept']} kept, {r['failed']} failed) in {r['seconds']:.2f}s | "
+              f"{r['requests']} requests | {r['rate_limited']} 429s")
+        for error in r['errors']:
+            print(f"          {error}")
+    print(f" created: {', '.join(f'{n} {kind}' for kind, n in report['created'].items())}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark for BackupBot restores against a rate-limited Discord stand-in")
+    parser.add_argument('--channels', type=int, default=500)
+    parser.add_argument('--roles', type=int, default=250)
+    parser.add_argument('--emojis', type=int, default=50)
+    parser.add_argument('--stickers', type=int, default=5)
+    parser.add_argument('--asset-size', type=int, default=4 * 1024, help="bytes per emoji/sticker")
+    parser.add_argument('--concurrency', type=int, default=4, help="restore requests of each kind in flight")
+    parser.add_argument('--bucket-limit', type=int, default=10, help="requests per route bucket and window")
+    parser.add_argument('--bucket-window', type=float, default=1.0, help="seconds per route bucket window")
+    parser.add_argument('--global-limit', type=int, default=50, help="requests per second across all routes")
+    parser.add_argument('--latency', type=float, default=0.1, help="seconds the stand-in takes per request")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    args = parser.parse_args()
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
+import aiohttp
 import discord
 import os
+import time
 from dotenv import load_dotenv
 from discord.ext import commands
 
@@ -7,23 +9,66 @@ from discord.ext import commands
 load_dotenv()
 TOKEN = os.getenv("DISCORD_TOKEN")
 
+# Sharding (optional): SHARD_COUNT total shards, SHARD_IDS the comma-separated subset this process connects
+SHARD_COUNT = int(os.getenv("SHARD_COUNT") or 0) or None
+SHARD_IDS = [int(s) for s in os.getenv("SHARD_IDS", "").split(",") if s.strip()] or None
+
+# Cache profile: "full" keeps discord.py's defaults, "lean" only caches what backups read
+CACHE_PROFILE = os.getenv("CACHE_PROFILE", "full").lower()
+
+# REST API base (optional): points every API request at another host, e.g. benchmarks/fake_discord.py in tests
+DISCORD_API_BASE = os.getenv("DISCORD_API_BASE")
+if DISCORD_API_BASE:
+    discord.http.Route.BASE = DISCORD_API_BASE.rstrip('/')
+
 # Set up bot intents
 intents = discord.Intents.default()
-intents.message_content = True
 intents.guilds = True
-intents.members = True
 intents.emojis_and_stickers = True
-intents.voice_states = True
+if CACHE_PROFILE == "lean":
+    # No member chunking, member, presence, voice or message caches; prefix owner commands still work in DMs
+    intents.members = False
+    intents.presences = False
+    intents.message_content = False
+    intents.voice_states = False
+    intents.typing = False
+    cache_options = {
+        'chunk_guilds_at_startup': False,
+        'member_cache_flags': discord.MemberCacheFlags.none(),
+        'max_messages': None
+    }
+else:
+    intents.message_content = True
+    intents.members = True
+    intents.voice_states = True
+    cache_options = {}
 
-class BackupBot(commands.Bot):
+class BackupBot(commands.AutoShardedBot):
     def __init__(self):
-        super().__init__(command_prefix="/", intents=intents)
+        # Every REST response, 429s that discord.py retries included, is reported to UtilsCog's shared send budget
+        trace = aiohttp.TraceConfig()
+        trace.on_request_end.append(self.trace_response)
+        super().__init__(command_prefix="/", intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS, http_trace=trace, **cache_options)
+        self.started_at = time.perf_counter()
+        self.ready_seconds = None
+        
+    async def trace_response(self, session, ctx, params):
+        utils_cog = self.get_cog("UtilsCog")
+        if utils_cog:
+            utils_cog.observe_response(params.method, params.url.path, params.response.status, params.response.headers)
         
     async def setup_hook(self):
         # Load cogs in order of dependency
         await self.load_extension('cogs.database')
         await self.load_extension('cogs.utils')
+        await self.load_extension('cogs.stats')
+        await self.load_extension('cogs.metrics')
+        await self.load_extension('cogs.changes')
+        await self.load_extension('cogs.leases')
         await self.load_extension('cogs.backup')
+        await self.load_extension('cogs.retention')
+        await self.load_extension('cogs.planner')
+        await self.load_extension('cogs.restore')
         await self.load_extension('cogs.server_management')
         
         # Initialize relationships between cogs after loading all cogs
@@ -35,14 +80,21 @@ class BackupBot(commands.Bot):
         
     async def on_ready(self):
         print(f"Logged in as {self.user}")
+        if self.ready_seconds is None:
+            self.ready_seconds = time.perf_counter() - self.started_at
+            metrics = self.get_cog("MetricsCog")
+            rss = metrics.rss_bytes() / 1024 / 1024 if metrics else 0.0
+            print(f"Ready in {self.ready_seconds:.1f}s with {len(self.guilds)} guilds, RSS {rss:.0f} MiB (cache profile: {CACHE_PROFILE})")
         activity = discord.Activity(
             type=discord.ActivityType.watching,
             name="backupbot.net | /help"
         )
         await self.change_presence(status=discord.Status.online, activity=activity)
         
-        await self.tree.sync()
-        print("Command tree synced")
+        # Commands are global, one process syncing them is enough
+        if not self.shard_ids or 0 in self.shard_ids:
+            await self.tree.sync()
+            print("Command tree synced")
 
 # Run the bot
 if __name__ == "__main__":
@@ -1,54 +1,619 @@
 import discord
 import os
+import io
 import zipfile
+import tarfile
 import shutil
 import json
+import tempfile
+import hashlib
 import aiohttp
-import subprocess
+import asyncio
+import heapq
+import itertools
+import time
+import struct
+from contextlib import asynccontextmanager
 from discord.ext import commands
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from cogs.utils import FileRange
 from datetime import datetime, timedelta
 from urllib.parse import urlparse
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ARCHIVE_FORMATS = ('zip', 'tar.zst')
+
+# Leading bytes of formats that are already compressed; deflating them again only costs CPU
+COMPRESSED_SIGNATURES = (b'\x89PNG', b'GIF8', b'\xff\xd8\xff', b'RIFF', b'\x1f\x8b', b'PK\x03\x04', b'\x28\xb5\x2f\xfd')
+
+class AssetDownloader:
+    def __init__(self, concurrency=16, retries=3, backoff=0.5, timeout=30, budget=None):
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        # Optional RateBudget every request waits on and reports its response to
+        self.budget = budget
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+    async def start(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.concurrency, ttl_dns_cache=300)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+    async def close(self):
+        if self.session and not self.session.closed:
+            await self.session.close()
+
+    async def fetch(self, url, dest) -> int:
+        # Streams the asset into dest, returns the number of bytes written or -1 on failure
+        await self.start()
+        for attempt in range(self.retries + 1):
+            delay = self.backoff * (2 ** attempt)
+            try:
+                async with self.semaphore:
+                    if self.budget:
+                        await self.budget.acquire()
+                    async with self.session.get(url) as resp:
+                        if self.budget:
+                            self.budget.update(resp.status, resp.headers)
+                        if resp.status == 200:
+                            size = 0
+                            dest.seek(0)
+                            dest.truncate()
+                            async for chunk in resp.content.iter_chunked(64 * 1024):
+                                dest.write(chunk)
+                                size += len(chunk)
+                            return size
+                        if resp.status != 429 and resp.status < 500:
+                            return -1
+                        retry_after = resp.headers.get('Retry-After')
+                        if retry_after:
+                            delay = max(delay, float(retry_after))
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                pass
+            if attempt < self.retries:
+                await asyncio.sleep(delay)
+        return -1
+
+    async def download_all(self, items: List[Tuple[str, str, str, str]], archive) -> Dict[str, Dict[str, int]]:
+        # items are (component, url, archive name, asset key); results are tallied per component
+        results = {}
+        for component, _, _, _ in items:
+            results.setdefault(component, {'ok': 0, 'failed': 0, 'bytes': 0, 'seconds': 0.0})
+
+        async def run(component, url, name, key):
+            with archive.spool() as buf:
+                start = time.perf_counter()
+                size = await self.fetch(url, buf)
+                results[component]['seconds'] += time.perf_counter() - start
+                if size < 0:
+                    results[component]['failed'] += 1
+                    return
+                await archive.add_file(name, buf, key)
+            results[component]['ok'] += 1
+            results[component]['bytes'] += size
+
+        # Every download settles before an error is raised, so none writes into a target the caller already closed
+        for outcome in await asyncio.gather(*(run(*item) for item in items), return_exceptions=True):
+            if isinstance(outcome, BaseException):
+                raise outcome
+        return results
+
+class BackupAdmission:
+    def __init__(self, max_backups=8, budgets=None):
+        self.max_backups = max_backups
+        self.limits = budgets or {'network': 6, 'cpu': os.cpu_count() or 2}
+        self.budgets = {k: asyncio.Semaphore(v) for k, v in self.limits.items()}
+        self.in_use = {k: 0 for k in self.limits}
+        self.running = 0
+        self.waiting = []
+        self.seq = itertools.count()
+        self.last_admitted = {}
+        self.stats = {'admitted': 0, 'total_wait': 0.0, 'max_wait': 0.0, 'last_wait': 0.0}
+
+    @asynccontextmanager
+    async def slot(self, guild_id):
+        start = time.monotonic()
+        if self.running < self.max_backups and not self.waiting:
+            self.running += 1
+        else:
+            # Guilds that were admitted least recently are served first
+            fut = asyncio.get_running_loop().create_future()
+            heapq.heappush(self.waiting, (self.last_admitted.get(guild_id, 0.0), next(self.seq), guild_id, fut))
+            try:
+                await fut
+            except asyncio.CancelledError:
+                if fut.done() and not fut.cancelled():
+                    self.release()
+                raise
+        wait = time.monotonic() - start
+        self.last_admitted[guild_id] = time.monotonic()
+        self.stats['admitted'] += 1
+        self.stats['total_wait'] += wait
+        self.stats['last_wait'] = wait
+        self.stats['max_wait'] = max(self.stats['max_wait'], wait)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def release(self):
+        self.running -= 1
+        while self.waiting:
+            fut = heapq.heappop(self.waiting)[3]
+            if fut.cancelled():
+                continue
+            self.running += 1
+            fut.set_result(None)
+            break
+
+    @asynccontextmanager
+    async def resource(self, kind):
+        async with self.budgets[kind]:
+            self.in_use[kind] += 1
+            try:
+                yield
+            finally:
+                self.in_use[kind] -= 1
+
+    def snapshot(self):
+        admitted = self.stats['admitted']
+        return {
+            'running': self.running,
+            'max_backups': self.max_backups,
+            'queued': sum(1 for w in self.waiting if not w[3].cancelled()),
+            'admitted': admitted,
+            'avg_wait': self.stats['total_wait'] / admitted if admitted else 0.0,
+            'max_wait': self.stats['max_wait'],
+            'last_wait': self.stats['last_wait'],
+            'budgets': {k: {'in_use': self.in_use[k], 'limit': self.limits[k]} for k in self.limits}
+        }
+
+class BackupArchive:
+    def __init__(self, path, spool_size=1024 * 1024, admission=None, run_blocking=None, archive_format='zip', zstd_level=3):
+        self.path = path
+        self.spool_size = spool_size
+        self.admission = admission
+        self.run_blocking = run_blocking
+        self.format = archive_format
+        self.seconds = 0.0
+        self.names = set()
+        self.reserved = set()
+        self.lock = asyncio.Lock()
+        if archive_format == 'tar.zst':
+            self.raw = open(path, 'wb')
+            self.stream = zstandard.ZstdCompressor(level=zstd_level).stream_writer(self.raw)
+            self.tar = tarfile.open(fileobj=self.stream, mode='w|')
+        else:
+            self.zf = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+
+    def unique(self, name):
+        # Two assets may sanitize to the same file name, keep both
+        base, ext = os.path.splitext(name)
+        candidate, n = name, 1
+        while candidate in self.names:
+            n += 1
+            candidate = f"{base}_{n}{ext}"
+        self.names.add(candidate)
+        return candidate
+
+    def reserve(self, name):
+        # Settles an entry's final name before it is written, so backup.json can point at it
+        name = self.unique(name)
+        self.reserved.add(name)
+        return name
+
+    def spool(self):
+        # Small assets stay in memory, large ones spill to an anonymous temp file
+        return tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+
+    async def write_text(self, name, text):
+        f = io.BytesIO(text.encode('utf-8'))
+        await self.add_file(name, f)
+
+    async def add_file(self, name, f, key=None):
+        # Entries are written one at a time per archive, in the executor so compression never blocks the loop
+        async with self.lock:
+            if self.admission:
+                async with self.admission.resource('cpu'):
+                    await self.run(self.copy_entry, name, f)
+            else:
+                await self.run(self.copy_entry, name, f)
+
+    async def run(self, func, *args):
+        if self.run_blocking:
+            return await self.run_blocking(func, *args)
+        return func(*args)
+
+    @staticmethod
+    def is_compressed(head):
+        return head.startswith(COMPRESSED_SIGNATURES)
+
+    def copy_entry(self, name, f):
+        start = time.perf_counter()
+        size = f.seek(0, os.SEEK_END)
+        f.seek(0)
+        name = name if name in self.reserved else self.unique(name)
+        if self.format == 'tar.zst':
+            info = tarfile.TarInfo(name)
+            info.size = size
+            info.mtime = int(time.time())
+            self.tar.addfile(info, f)
+        else:
+            # Already-compressed media is stored as-is, only text and unknown content is deflated
+            head = f.read(16)
+            f.seek(0)
+            info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_STORED if self.is_compressed(head) else zipfile.ZIP_DEFLATED
+            info.file_size = size
+            with self.zf.open(info, 'w') as dest:
+                shutil.copyfileobj(f, dest, 64 * 1024)
+        self.seconds += time.perf_counter() - start
+
+    async def close(self):
+        # Waits for the entry being written so the central directory or zstd frame is never cut short
+        async with self.lock:
+            await self.run(self.finish)
+
+    def finish(self):
+        start = time.perf_counter()
+        if self.format == 'tar.zst':
+            self.tar.close()
+            self.stream.close()
+            self.raw.close()
+        else:
+            self.zf.close()
+        self.seconds += time.perf_counter() - start
+
+class AssetCheckpoint:
+    # Finished downloads are appended to a log in the guild's work directory, so a retried backup feeds them into
+    # its new archive instead of downloading them again. Appends run in the executor, one at a time like archive entries.
+    RECORD = struct.Struct('>IQ')
+
+    def __init__(self, archive, work_dir):
+        self.archive = archive
+        self.path = os.path.join(work_dir, "assets.log")
+        self.index = {}
+        self.log = None
+        self.lock = asyncio.Lock()
+        os.makedirs(work_dir, exist_ok=True)
+
+    def load(self):
+        # Blocking; indexes every complete record (key length, data length, key, data) and cuts off one torn by a crash
+        self.log = open(self.path, 'ab+')
+        end = self.log.seek(0, os.SEEK_END)
+        pos = self.log.seek(0)
+        while pos + self.RECORD.size <= end:
+            key_length, size = self.RECORD.unpack(self.log.read(self.RECORD.size))
+            offset = pos + self.RECORD.size + key_length
+            if offset + size > end:
+                break
+            self.index[self.log.read(key_length).decode('utf-8')] = (offset, size)
+            pos = self.log.seek(offset + size)
+        self.log.truncate(pos)
+
+    def spool(self):
+        return self.archive.spool()
+
+    def append(self, key, f):
+        encoded = key.encode('utf-8')
+        self.log.write(self.RECORD.pack(len(encoded), f.seek(0, os.SEEK_END)) + encoded)
+        f.seek(0)
+        shutil.copyfileobj(f, self.log, 64 * 1024)
+
+    async def add_file(self, name, f, key=None):
+        # Logged before it waits for its turn in the archive, a failure elsewhere never loses a finished download
+        async with self.lock:
+            await self.archive.run(self.append, key, f)
+        await self.archive.add_file(name, f, key)
+
+    async def reuse(self, items):
+        # Archives the assets an earlier attempt finished; returns the items still to download and reuse counts per component
+        await self.archive.run(self.load)
+        pending, reused = [], {}
+        for item in items:
+            component, _, name, key = item
+            if key not in self.index:
+                pending.append(item)
+                continue
+            with FileRange(self.path, *self.index[key]) as f:
+                await self.archive.add_file(name, f, key)
+            reused[component] = reused.get(component, 0) + 1
+        return pending, reused
+
+    def close(self):
+        if self.log:
+            self.log.close()
+
+class AssetStore:
+    def __init__(self, guild_id, known, utils_cog, spool_size=1024 * 1024, record=None):
+        self.guild_id = guild_id
+        self.known = known
+        self.utils_cog = utils_cog
+        self.spool_size = spool_size
+        # Called with each new blob as soon as it is stored, so a retried backup references it instead
+        self.record = record
+        self.by_hash = {v['content_hash']: v['storage_key'] for v in known.values()}
+        self.entries = {}
+        self.new_blobs = {}
+
+    def reference(self, component, name, key):
+        # Assets already stored under the same Discord asset key are never fetched again
+        blob = self.known.get(key)
+        if not blob:
+            return False
+        self.entries[name] = {'component': component, 'url': self.utils_cog.blob_url(blob['storage_key']), 'sha256': blob['content_hash'], 'size': blob['size']}
+        return True
+
+    def spool(self):
+        return tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+
+    async def add_file(self, name, f, key=None):
+        f.seek(0)
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+        content_hash = digest.hexdigest()
+        size = f.tell()
+        storage_key = self.by_hash.get(content_hash)
+        if storage_key is None:
+            storage_key = f"blobs/{self.guild_id}/{content_hash}{os.path.splitext(name)[1]}"
+            self.by_hash[content_hash] = storage_key
+            f.seek(0)
+            await self.utils_cog.upload_fileobj(f, storage_key)
+        self.new_blobs[key] = {'content_hash': content_hash, 'storage_key': storage_key, 'size': size}
+        if self.record:
+            self.record({key: self.new_blobs[key]})
+        self.entries[name] = {'component': name.split('/')[0], 'url': self.utils_cog.blob_url(storage_key), 'sha256': content_hash, 'size': size}
+
+def permission_overwrites(channel):
+    overwrites = []
+    for target, overwrite in channel.overwrites.items():
+        allow, deny = overwrite.pair()
+        # Targets that aren't cached come as discord.Object with the kind in .type
+        member = isinstance(target, (discord.Member, discord.User)) or getattr(target, 'type', None) is discord.Member
+        overwrites.append({'id': target.id, 'type': 'member' if member else 'role', 'allow': allow.value, 'deny': deny.value})
+    return overwrites
+
+def guild_snapshot(guild, prefs, files=None):
+    # What /restore rebuilds a server from; files maps asset keys to their archive entry names, without it assets are
+    # referenced by their keys
+    if files is None:
+        files = {}
+        ref = lambda key: key
+    else:
+        ref = files.get
+    snapshot = {'version': 1, 'guild': {'id': guild.id, 'name': guild.name}}
+    if prefs.get('save_roles', True):
+        snapshot['roles'] = [
+            {
+                'id': r.id, 'name': r.name, 'permissions': r.permissions.value, 'color': r.colour.value, 'hoist': r.hoist,
+                'mentionable': r.mentionable, 'position': r.position, 'default': r.is_default(), 'managed': r.managed,
+                'icon': ref(f"role_icon:{r.icon.key}") if r.icon and prefs.get('save_role_icons', True) else None
+            }
+            for r in guild.roles
+        ]
+    if prefs.get('save_channels', True):
+        snapshot['categories'] = [
+            {'id': c.id, 'name': c.name, 'position': c.position, 'overwrites': permission_overwrites(c)}
+            for c in guild.categories
+        ]
+        snapshot['channels'] = [
+            {
+                'id': c.id, 'name': c.name, 'type': 'text', 'position': c.position, 'category': c.category_id,
+                'topic': c.topic, 'nsfw': c.nsfw, 'slowmode_delay': c.slowmode_delay, 'overwrites': permission_overwrites(c)
+            }
+            for c in guild.text_channels
+        ] + [
+            {
+                'id': c.id, 'name': c.name, 'type': 'voice', 'position': c.position, 'category': c.category_id,
+                'bitrate': c.bitrate, 'user_limit': c.user_limit, 'nsfw': c.nsfw, 'overwrites': permission_overwrites(c)
+            }
+            for c in guild.voice_channels
+        ]
+    if prefs.get('save_emojis', True):
+        snapshot['emojis'] = [{'id': e.id, 'name': e.name, 'animated': e.animated, 'file': ref(f"emoji:{e.id}")} for e in guild.emojis]
+    if prefs.get('save_stickers', True):
+        snapshot['stickers'] = [
+            {'id': s.id, 'name': s.name, 'description': s.description, 'emoji': s.emoji, 'file': ref(f"sticker:{s.id}")}
+            for s in guild.stickers
+        ]
+    return snapshot
+
+class ScheduledBackup:
+    __slots__ = ('id', 'guild_id', 'next_run_time', 'anchor', 'cancelled')
+
+    def __init__(self, guild_id, next_run_time, anchor=None):
+        self.id = f"backup_{guild_id}"
+        self.guild_id = guild_id
+        self.next_run_time = next_run_time
+        # The wall-clock slot this run belongs to; the next run is computed from it, not from when the run finished
+        self.anchor = anchor or next_run_time
+        self.cancelled = False
+
+class BackupScheduler:
+    # One heap of due times and one tick task for every guild, instead of a scheduler job per guild
+    def __init__(self, callback, max_sleep=60):
+        self.callback = callback
+        self.max_sleep = max_sleep
+        self.heap = []
+        self.jobs = {}
+        self.seq = itertools.count()
+        self.tasks = set()
+        self.wakeup = asyncio.Event()
+        self.runner = None
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def start(self):
+        if self.runner is None or self.runner.done():
+            self.runner = asyncio.create_task(self.run())
+
+    def shutdown(self):
+        if self.runner:
+            self.runner.cancel()
+
+    def add_job(self, guild_id, run_date, anchor=None):
+        job = ScheduledBackup(guild_id, run_date, anchor)
+        old = self.jobs.get(job.id)
+        if old:
+            old.cancelled = True
+        self.jobs[job.id] = job
+        heapq.heappush(self.heap, (run_date.timestamp(), next(self.seq), job))
+        if self.heap[0][2] is job:
+            self.wakeup.set()
+        self.compact()
+        return job
+
+    def add_jobs(self, items):
+        # Bulk load of (guild_id, run_date, anchor), one heapify instead of a push per guild
+        jobs = []
+        for guild_id, run_date, anchor in items:
+            job = ScheduledBackup(guild_id, run_date, anchor)
+            old = self.jobs.get(job.id)
+            if old:
+                old.cancelled = True
+            self.jobs[job.id] = job
+            self.heap.append((run_date.timestamp(), next(self.seq), job))
+            jobs.append(job)
+        heapq.heapify(self.heap)
+        self.wakeup.set()
+        return jobs
+
+    def get_job(self, job_id):
+        return self.jobs.get(job_id)
+
+    def remove_job(self, job_id):
+        job = self.jobs.pop(job_id, None)
+        if job:
+            job.cancelled = True
+            self.compact()
+
+    def compact(self):
+        # Replaced and removed jobs stay in the heap until popped; rebuild once they outnumber live ones
+        if len(self.heap) > 2 * len(self.jobs) + 64:
+            self.heap = [entry for entry in self.heap if not entry[2].cancelled]
+            heapq.heapify(self.heap)
+
+    async def run(self):
+        while True:
+            now = time.time()
+            while self.heap and self.heap[0][0] <= now:
+                job = heapq.heappop(self.heap)[2]
+                if job.cancelled:
+                    continue
+                del self.jobs[job.id]
+                task = asyncio.create_task(self.callback(job.guild_id))
+                self.tasks.add(task)
+                task.add_done_callback(self.finished)
+            delay = self.heap[0][0] - now if self.heap else self.max_sleep
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=min(max(delay, 0), self.max_sleep))
+            except asyncio.TimeoutError:
+                pass
+
+    def finished(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            print(f"Scheduled backup failed: {task.exception()!r}")
 
 class BackupCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.backup_jobs = {}
         
-        # Initialize scheduler
-        self.scheduler = AsyncIOScheduler(
-            job_defaults={
-                'coalesce': True,
-                'max_instances': 1,
-                'misfire_grace_time': 3600
+        # Shared asset downloader, one connection pool for every backup
+        self.downloader = AssetDownloader(
+            concurrency=int(os.getenv("DOWNLOAD_CONCURRENCY", 16)),
+            retries=int(os.getenv("DOWNLOAD_RETRIES", 3))
+        )
+        
+        # Restored jobs that are overdue get spread over a catch-up window after startup
+        self.CATCHUP_DELAY_MINUTES = int(os.getenv("CATCHUP_DELAY_MINUTES", 5))
+        self.CATCHUP_WINDOW_MINUTES = int(os.getenv("CATCHUP_WINDOW_MINUTES", 60))
+        
+        # Global admission control: total concurrent backups plus network/CPU budgets
+        self.admission = BackupAdmission(
+            max_backups=int(os.getenv("MAX_CONCURRENT_BACKUPS", 8)),
+            budgets={
+                'network': int(os.getenv("NETWORK_BUDGET", 6)),
+                'cpu': int(os.getenv("CPU_BUDGET", os.cpu_count() or 2))
             }
         )
         
-        # GitHub settings for stat updates
-        self.GITHUB_REPO_PATH = os.getenv("GITHUB_REPO_PATH")
-        self.GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
+        # Post a short notice in the log channel when a backup is skipped because nothing changed
+        self.NOTIFY_UNCHANGED_BACKUPS = os.getenv("NOTIFY_UNCHANGED_BACKUPS", "false").lower() in ("1", "true", "yes")
+        
+        # Incremental backups keep assets as content-addressed blobs and only archive a manifest
+        self.INCREMENTAL_BACKUPS = os.getenv("INCREMENTAL_BACKUPS", "false").lower() in ("1", "true", "yes")
+        self.ZSTD_LEVEL = int(os.getenv("ZSTD_LEVEL", 3))
+        
+        # Without the members intent the cached member count goes stale, fetch it when a backup needs it
+        self.LEAN_CACHE = os.getenv("CACHE_PROFILE", "full").lower() == "lean"
+        
+        # Failed or interrupted backups keep their downloaded assets, archive and upload progress for the retry
+        self.BACKUP_WORK_DIR = os.getenv("BACKUP_WORK_DIR", "backup_work")
+        self.CHECKPOINT_MAX_AGE_HOURS = float(os.getenv("CHECKPOINT_MAX_AGE_HOURS", 24))
+        
+        # Initialize scheduler
+        self.scheduler = BackupScheduler(self.backup_wrapper)
+        
+        # One backup per guild at a time; a second one would pick up the running one's checkpoint
+        self.guild_locks = {}
+        
+        # Position in the database's config change log up to which other processes' writes have been adopted
+        self.config_seq = 0
+        
+        # Fire-and-forget tasks are kept here until they finish so they can't be garbage collected mid-run
+        self.background = set()
 
     async def initialize_relationships(self):
         # Get references to other cogs
         self.db_cog = self.bot.get_cog("DatabaseCog")
         self.utils_cog = self.bot.get_cog("UtilsCog")
+        self.stats_cog = self.bot.get_cog("StatsCog")
+        self.metrics = self.bot.get_cog("MetricsCog")
+        self.changes = self.bot.get_cog("ChangeTrackerCog")
+        self.retention = self.bot.get_cog("RetentionCog")
+        self.leases = self.bot.get_cog("LeaseCog")
+        self.downloader.budget = self.utils_cog.cdn_budget
+        self.register_gauges()
         
-        # Start scheduler
+        # Start scheduler and downloader
         self.scheduler.start()
+        await self.downloader.start()
         
         # Load configurations
         await self.initialize_from_db()
     
+    def load_configs(self):
+        # Blocking; every stored config along with the guilds an interrupted backup left a checkpoint for. The change
+        # sequence is read first, so a config written while this runs is picked up again by sync_config_changes.
+        self.config_seq, _ = self.db_cog.get_config_changes(None, self.leases.INSTANCE_ID)
+        return list(self.db_cog.iter_server_configs()), self.db_cog.get_checkpointed_guilds()
+
     async def initialize_from_db(self):
-        # Load server configurations from database
-        config = self.db_cog.load_server_config()
-        now = datetime.now()
+        # Load server configurations from database, then schedule every guild in one bulk insert
+        now = datetime.now().astimezone()
+        scheduled = []
+        overdue = []
+        # Backups interrupted by the restart are resumed in the catch-up window rather than at their next slot
+        configs, checkpointed = await self.utils_cog.run_blocking(self.load_configs)
         
-        for gid_str, cfg in config.items():
-            gid = int(gid_str)
+        for gid, cfg in configs:
             if gid in self.backup_jobs and self.backup_jobs[gid].get('job'):
                 continue
+            # Guilds on shards leased by another process are scheduled there
+            if not self.leases.owns(gid):
+                continue
                 
             self.backup_jobs[gid] = {
                 'log_channel_id': cfg['log_channel_id'],
@@ -58,218 +623,499 @@ class BackupCog(commands.Cog):
                 'preferences': cfg.get('preferences', {})
             }
             
-            nbr = cfg.get('next_backup')
-            if nbr:
-                try:
-                    nb = datetime.fromisoformat(nbr)
-                    next_run = nb if nb > now else now + timedelta(minutes=5)
-                except:
-                    next_run = now + timedelta(minutes=30)
+            nb = self.parse_time(cfg.get('next_backup'))
+            anchor = self.parse_time(cfg.get('schedule_anchor')) or nb
+            if nb and nb > now and gid not in checkpointed:
+                scheduled.append((gid, nb, anchor))
             else:
-                next_run = now + timedelta(minutes=5)
-                
-            job = self.scheduler.add_job(
-                self.backup_wrapper,
-                "date",
-                run_date=next_run,
-                args=[gid],
-                id=f"backup_{gid}",
-                replace_existing=True
-            )
-            self.backup_jobs[gid]['job'] = job
+                overdue.append((nb or now, gid, anchor))
+        
+        # Spread overdue guilds over the catch-up window, most overdue first; they keep their slot as anchor
+        overdue.sort(key=lambda o: o[0])
+        start = now + timedelta(minutes=self.CATCHUP_DELAY_MINUTES)
+        spacing = timedelta(minutes=self.CATCHUP_WINDOW_MINUTES) / max(len(overdue), 1)
+        for i, (nb, gid, anchor) in enumerate(overdue):
+            scheduled.append((gid, start + spacing * i, anchor))
+        
+        for job in self.scheduler.add_jobs(scheduled):
+            self.backup_jobs[job.guild_id]['job'] = job
             
         self.update_servers_count()
     
+    @staticmethod
+    def parse_time(value):
+        try:
+            parsed = datetime.fromisoformat(value) if value else None
+        except ValueError:
+            return None
+        return parsed.astimezone() if parsed and parsed.tzinfo is None else parsed
+    
+    def plan_next_runs(self, schedules):
+        # Blocking; the next anchored slot of every (guild, timezone, frequency, anchor) snapshot in one pass
+        return [(gid, self.utils_cog.calculate_next_run(tz, freq, anchor), anchor) for gid, tz, freq, anchor in schedules]
+    
+    async def reschedule(self, guild_ids=None, anchors=None):
+        # Recomputes next runs off the event loop and loads them with one heapify; guilds not given keep their jobs.
+        # Schedules are snapshotted here, guilds removed or deactivated meanwhile are left out when the plan comes back.
+        anchors, jobs = anchors or {}, self.backup_jobs
+        guild_ids = [gid for gid in (guild_ids or jobs) if jobs.get(gid, {}).get('job')]
+        schedules = [
+            (gid, jobs[gid].get('timezone', 'UTC'), jobs[gid].get('frequency', 'daily'), anchors.get(gid) or jobs[gid]['job'].anchor)
+            for gid in guild_ids
+        ]
+        plan = await self.utils_cog.run_blocking(self.plan_next_runs, schedules)
+        plan = [item for item in plan if jobs.get(item[0], {}).get('job')]
+        guild_ids = [gid for gid, _, _ in plan]
+        for job in self.scheduler.add_jobs(plan):
+            self.backup_jobs[job.guild_id]['job'] = job
+        # Rows are plain dict work and are built here, next to the code that changes backup_jobs; only the writes leave the loop
+        await asyncio.wrap_future(self.db_cog.save_server_config(self.backup_jobs, *guild_ids))
+        return len(plan)
+    
+    async def sync_config_changes(self):
+        # Config commands may be answered by a process that doesn't own the guild; the owner adopts what it wrote
+        seq, changed = await self.utils_cog.run_blocking(self.db_cog.get_config_changes, self.config_seq, self.leases.INSTANCE_ID)
+        self.config_seq = seq
+        changed = [gid for gid in changed if self.leases.owns(gid)]
+        if not changed:
+            return 0
+        configs = dict(await self.utils_cog.run_blocking(lambda: list(self.db_cog.iter_server_configs(changed))))
+        for gid in changed:
+            self.adopt_config(gid, configs.get(gid))
+        self.update_servers_count()
+        return len(changed)
+    
+    def adopt_config(self, gid, cfg):
+        # Nothing is written back, the database already holds this config
+        if cfg is None:
+            self.release_guilds(lambda g: g == gid)
+            return
+        data = self.backup_jobs.setdefault(gid, {'job': None})
+        job = data.get('job')
+        moved = data.get('timezone') != cfg['timezone'] or data.get('frequency') != cfg['frequency']
+        data.update(log_channel_id=cfg['log_channel_id'], timezone=cfg['timezone'], frequency=cfg['frequency'], preferences=cfg['preferences'])
+        if not cfg['active']:
+            if job:
+                self.scheduler.remove_job(job.id)
+                data['job'] = None
+            return
+        if job and not moved:
+            return
+        nb = self.parse_time(cfg['next_backup'])
+        anchor = self.parse_time(cfg['schedule_anchor']) or nb
+        if not nb or nb <= datetime.now().astimezone():
+            nb = self.utils_cog.calculate_next_run(cfg['timezone'], cfg['frequency'], anchor)
+        if job:
+            self.scheduler.remove_job(job.id)
+        self.schedule_backup(gid, nb, anchor)
+    
+    def release_guilds(self, predicate):
+        # Drops jobs for guilds whose shard lease moved to another process; their config stays in the database
+        for gid in [gid for gid in self.backup_jobs if predicate(gid)]:
+            job = self.backup_jobs.pop(gid).get('job')
+            if job and self.scheduler.get_job(job.id):
+                self.scheduler.remove_job(job.id)
+    
+    def register_gauges(self):
+        self.metrics.gauge('backups_running', lambda: self.admission.snapshot()['running'])
+        self.metrics.gauge('backups_queued', lambda: self.admission.snapshot()['queued'])
+        self.metrics.gauge('admission_wait_avg_seconds', lambda: self.admission.snapshot()['avg_wait'])
+        self.metrics.gauge('admission_wait_max_seconds', lambda: self.admission.snapshot()['max_wait'])
+        self.metrics.gauge('budget_in_use', lambda: [({'budget': k}, v['in_use']) for k, v in self.admission.snapshot()['budgets'].items()])
+        self.metrics.gauge('scheduled_guilds', lambda: len(self.scheduler))
+        self.metrics.gauge('upload_avg_mbps', lambda: self.utils_cog.get_upload_stats()['avg_mbps'])
+        self.metrics.gauge('dirty_guilds', self.changes.dirty_guilds)
+        budgets = {'cdn': self.utils_cog.cdn_budget, 'send': self.utils_cog.send_budget}
+        self.metrics.gauge('rate_budget_per_second', lambda: [({'budget': k}, b.snapshot()['rate']) for k, b in budgets.items()])
+        self.metrics.gauge('rate_budget_throttled', lambda: [({'budget': k}, b.stats['throttled']) for k, b in budgets.items()])
+        self.metrics.gauge('rate_budget_delayed', lambda: [({'budget': k}, b.stats['delayed']) for k, b in budgets.items()])
+        self.metrics.gauge('rate_budget_wait_seconds', lambda: [({'budget': k}, b.stats['wait_seconds']) for k, b in budgets.items()])
+        self.metrics.gauge('rate_budget_paused_seconds', lambda: [({'budget': k}, b.stats['paused_seconds']) for k, b in budgets.items()])
+    
+    def schedule_backup(self, guild_id, run_date, anchor=None):
+        job = self.scheduler.add_job(guild_id, run_date, anchor)
+        self.backup_jobs[guild_id]['job'] = job
+        return job
+    
     async def backup_wrapper(self, guild_id: int):
+        if not await self.leases.confirm(guild_id):
+            self.metrics.inc('backups_total', outcome='not_owner')
+            return
+        job = self.backup_jobs[guild_id].get('job')
+        if job:
+            lag = (datetime.now().astimezone() - job.next_run_time.astimezone()).total_seconds()
+            self.metrics.observe('scheduler_lag_seconds', max(lag, 0.0))
         success = await self.save_server_data(guild_id)
+        self.metrics.inc('backups_total', outcome='success' if success else 'failed')
+        if guild_id not in self.backup_jobs:
+            # Released to another process while the backup ran, the new owner schedules it
+            return
+        freq = self.backup_jobs[guild_id].get('frequency', 'daily')
+        tz = self.backup_jobs[guild_id].get('timezone', 'UTC')
+        anchor = job.anchor if job else None
         if success:
-            self.db_cog.update_stat('backups_created', inc=1)
-            freq = self.backup_jobs[guild_id].get('frequency', 'daily')
-            tz = self.backup_jobs[guild_id].get('timezone', 'UTC')
-            next_run = self.utils_cog.calculate_next_run(tz, freq)
+            # Next slot on the guild's wall-clock grid, so late or slow runs never push the schedule back. The anchor
+            # itself stays put: a slot moved by a DST gap or a short month must not become the new grid.
+            next_run = self.utils_cog.calculate_next_run(tz, freq, anchor)
         else:
-            next_run = datetime.now() + timedelta(hours=1)
+            next_run = datetime.now().astimezone() + timedelta(hours=1)
             
-        job = self.scheduler.add_job(
-            self.backup_wrapper, "date",
-            run_date=next_run,
-            args=[guild_id],
-            id=f"backup_{guild_id}",
-            replace_existing=True
-        )
-        self.backup_jobs[guild_id]['job'] = job
-        self.db_cog.save_server_config(self.backup_jobs)
-        if success:
-            self.export_stats_to_json()
+        self.schedule_backup(guild_id, next_run, anchor)
+        self.db_cog.save_server_config(self.backup_jobs, guild_id)
     
-    async def save_server_data(self, guild_id: int):
+    async def save_server_data(self, guild_id: int, force: bool = False):
+        async with self.guild_locks.setdefault(guild_id, asyncio.Lock()), self.admission.slot(guild_id):
+            # Changes that arrive while the backup runs set fresh bits; a failed run puts these back
+            mask = self.changes.take(guild_id)
+            ok = False
+            started = time.time()
+            try:
+                with self.metrics.timer('total'):
+                    ok = await self.run_backup(guild_id, force, mask)
+                return ok
+            except Exception as e:
+                print(f"Backup of {guild_id} failed: {e!r}")
+                self.db_cog.record_backup_completion(guild_id, status='failed', started=started, duration=time.time() - started, error=repr(e)[:500])
+                return False
+            finally:
+                if not ok:
+                    self.changes.restore(guild_id, mask)
+    
+    async def member_count(self, guild):
+        if not self.LEAN_CACHE:
+            return guild.member_count
+        try:
+            fetched = await self.bot.fetch_guild(guild.id, with_counts=True)
+            return fetched.approximate_member_count
+        except discord.HTTPException:
+            return guild.member_count
+    
+    def archive_format(self, prefs):
+        archive_format = prefs.get('archive_format', 'zip')
+        if archive_format == 'tar.zst' and zstandard is None:
+            print("zstandard is not installed, falling back to zip")
+            return 'zip'
+        return archive_format
+
+    def guild_fingerprint(self, guild, prefs):
+        # Canonical, cheap summary of everything the configured components would capture
+        state = {'preferences': sorted(prefs.items()), 'incremental': self.INCREMENTAL_BACKUPS}
+        if prefs.get('save_server_assets', True):
+            state['server_assets'] = [guild.name] + [getattr(getattr(guild, attr, None), 'key', None) for attr in ('icon', 'banner', 'splash', 'discovery_splash')]
+        # Roles, channels, emojis and stickers exactly as backup.json would store them, asset keys included
+        state['snapshot'] = guild_snapshot(guild, prefs)
+        if prefs.get('save_role_icons', True):
+            state['role_icons'] = [[r.name, r.icon.key] for r in guild.roles if r.icon]
+        return hashlib.sha256(json.dumps(state, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    
+    def work_dir(self, guild_id):
+        return os.path.join(self.BACKUP_WORK_DIR, str(guild_id))
+    
+    def remove_work(self, guild_id, path=None):
+        # Blocking; the archive and downloaded assets of a checkpoint
+        if path and os.path.exists(path):
+            os.remove(path)
+        shutil.rmtree(self.work_dir(guild_id), ignore_errors=True)
+    
+    async def resume_checkpoint(self, guild_id, baseline):
+        # The checkpoint of a failed or interrupted attempt is resumed while it is recent and was made with the same settings
+        checkpoint = await self.utils_cog.run_blocking(self.db_cog.get_backup_checkpoint, guild_id)
+        if checkpoint is None:
+            return None
+        if (
+            checkpoint['baseline'] == baseline
+            and time.time() - checkpoint['started_at'] < self.CHECKPOINT_MAX_AGE_HOURS * 3600
+            and (checkpoint['stage'] == 'assets' or os.path.exists(checkpoint['path']))
+        ):
+            return checkpoint
+        await self.discard_checkpoint(checkpoint)
+        return None
+    
+    async def discard_checkpoint(self, checkpoint):
+        if checkpoint['upload_id']:
+            await self.utils_cog.run_blocking(self.utils_cog.abort_upload, checkpoint['storage_key'], checkpoint['upload_id'])
+        await self.utils_cog.run_blocking(self.remove_work, checkpoint['guild_id'], checkpoint['path'])
+        await asyncio.wrap_future(self.db_cog.delete_backup_checkpoint(checkpoint['guild_id']))
+    
+    async def discard_guild_checkpoint(self, guild_id):
+        # A guild that leaves the backup list takes its unfinished attempt with it
+        checkpoint = await self.utils_cog.run_blocking(self.db_cog.get_backup_checkpoint, guild_id)
+        if checkpoint:
+            await self.discard_checkpoint(checkpoint)
+    
+    async def run_backup(self, guild_id: int, force: bool = False, changed: int = 0):
+        started = time.time()
         guild = self.bot.get_guild(guild_id)
         if not guild:
+            self.db_cog.record_backup_completion(guild_id, status='failed', started=started, error="Server not available")
             return False
             
         log_channel = self.bot.get_channel(self.backup_jobs[guild_id]['log_channel_id'])
         if not log_channel:
+            self.db_cog.record_backup_completion(guild_id, status='failed', started=started, error="Log channel not found")
             return False
             
         prefs = self.backup_jobs[guild_id].get('preferences', {})
         name = guild.name
-        folder = self.utils_cog.sanitize_filename(f"backup_{name}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}")
-        os.makedirs(folder, exist_ok=True)
+        baseline = json.dumps([sorted(prefs.items()), self.INCREMENTAL_BACKUPS])
+        
+        # An attempt that failed or was interrupted is finished first, never skipped as unchanged
+        checkpoint = await self.resume_checkpoint(guild_id, baseline)
+        if checkpoint:
+            self.metrics.inc('backups_resumed_total', stage=checkpoint['stage'])
+        
+        # Skip everything when nothing changed since the last successful backup: gateway events
+        # answer that for free, the fingerprint covers guilds the tracker can't vouch for yet
+        if not checkpoint and not force and self.changes.is_idle(guild_id, changed, prefs, baseline):
+            self.db_cog.record_backup_completion(guild_id, status='unchanged', started=started, duration=time.time() - started)
+            self.metrics.inc('backups_unchanged_total', detected_by='events')
+            if self.NOTIFY_UNCHANGED_BACKUPS:
+                await self.utils_cog.send_message(log_channel, f"No changes in {name} since the last backup, skipped.")
+            return True
+        fingerprint = self.guild_fingerprint(guild, prefs)
+        if not checkpoint and not force and fingerprint == await self.utils_cog.run_blocking(self.db_cog.get_last_fingerprint, guild_id):
+            self.db_cog.record_backup_completion(guild_id, fingerprint, status='unchanged', started=started, duration=time.time() - started)
+            self.metrics.inc('backups_unchanged_total', detected_by='fingerprint')
+            self.changes.mark_clean(guild_id, baseline)
+            if self.NOTIFY_UNCHANGED_BACKUPS:
+                await self.utils_cog.send_message(log_channel, f"No changes in {name} since the last backup, skipped.")
+            return True
+        for component in self.changes.changed_components(changed):
+            self.metrics.inc('backup_changed_components_total', component=component)
+        
+        if checkpoint and checkpoint['stage'] != 'assets':
+            # The archive was finished before, its contents are what the checkpoint describes
+            zip_name, size, counts, fingerprint = checkpoint['path'], checkpoint['size'], checkpoint['components'], checkpoint['fingerprint']
+            failed = checkpoint['failed'] or ""
+        else:
+            if checkpoint:
+                zip_name = checkpoint['path']
+            else:
+                base = self.utils_cog.sanitize_filename(f"backup_{name}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}")
+                os.makedirs(self.BACKUP_WORK_DIR, exist_ok=True)
+                zip_name = os.path.join(self.BACKUP_WORK_DIR, f"{base}.{self.archive_format(prefs)}")
+                await asyncio.wrap_future(self.db_cog.start_backup_checkpoint(guild_id, started, zip_name, baseline))
+            counts, failed = await self.build_archive(guild, prefs, zip_name)
+            size = os.path.getsize(zip_name)
+            await asyncio.wrap_future(self.db_cog.update_backup_checkpoint(guild_id, stage='archived', size=size, fingerprint=fingerprint, components=counts, failed=failed))
+            # Everything is in the archive now
+            await self.utils_cog.run_blocking(self.remove_work, guild_id)
+            self.metrics.inc('backup_bytes_total', size, stage='archive')
+        
+        # Upload and send
+        if checkpoint and checkpoint['stage'] == 'uploaded':
+            storage_key = checkpoint['storage_key']
+        else:
+            resumed = checkpoint if checkpoint and checkpoint['stage'] == 'archived' else {}
+            storage_key = resumed.get('storage_key') or self.utils_cog.backup_storage_key(zip_name, guild_id)
+            # The upload id is stored before any part is sent, a retry continues after the parts R2 acknowledged
+            on_start = lambda upload_id, part_size: asyncio.wrap_future(
+                self.db_cog.update_backup_checkpoint(guild_id, storage_key=storage_key, upload_id=upload_id, part_size=part_size)
+            )
+            async with self.admission.resource('network'):
+                with self.metrics.timer('upload'):
+                    await self.utils_cog.upload_resumable(zip_name, storage_key, resumed.get('upload_id'), resumed.get('part_size'), on_start)
+            self.metrics.inc('backup_bytes_total', size, stage='upload')
+            with self.metrics.timer('db'):
+                self.retention.record_upload(guild_id, storage_key, size)
+                await asyncio.wrap_future(self.db_cog.update_backup_checkpoint(guild_id, stage='uploaded', storage_key=storage_key, upload_id=None))
+        url = self.utils_cog.blob_url(storage_key)
+        
+        note = f"\nSome assets could not be downloaded: {failed}" if failed else ""
+        limit = self.utils_cog.upload_limit(guild)
+        delivery_start = time.perf_counter()
+        try:
+            if guild.premium_tier >= 2 and size < limit:
+                with open(zip_name, 'rb') as f:
+                    await self.utils_cog.send_message(log_channel, f"Server backup for {name} (Boost Level {guild.premium_tier}):\nCDN Link: {url}{note}", file=discord.File(f, filename=os.path.basename(zip_name)))
+            elif size < self.utils_cog.MAX_DISCORD_FILE_SIZE:
+                with open(zip_name, 'rb') as f:
+                    await self.utils_cog.send_message(log_channel, f"Server backup for {name}:\nCDN Link: {url}{note}", file=discord.File(f, filename=os.path.basename(zip_name)))
+            else:
+                await self.utils_cog.send_message(log_channel, f"Server backup for {name}:\n{url}{note}")
+        except discord.HTTPException:
+            await self.utils_cog.send_message(log_channel, f"Backup available at: {url}")
+            await self.utils_cog.send_chunked_backup(log_channel, name, zip_name, limit)
+        self.metrics.observe('backup_stage_seconds', time.perf_counter() - delivery_start, stage='delivery')
+        
+        # Cleanup
+        os.remove(zip_name)
+        self.db_cog.delete_backup_checkpoint(guild_id)
+        
+        # Update stats
+        self.stats_cog.increment('backups_created')
+        self.stats_cog.increment('data_saved_bytes', size)
+        # A backup with missing assets must not be treated as a baseline for skipping
+        self.db_cog.record_backup_completion(
+            guild_id, None if failed else fingerprint, started=started, duration=time.time() - started, size=size,
+            storage_key=storage_key, components=counts, error=f"Failed asset downloads: {failed}" if failed else None
+        )
+        if not failed:
+            self.changes.mark_clean(guild_id, baseline)
+        return True
+    
+    async def build_archive(self, guild, prefs, zip_name):
+        # Streams every configured component into zip_name; returns assets per component and a note on failed downloads
+        guild_id = guild.id
+        name = guild.name
+        archive_format = 'tar.zst' if zip_name.endswith('.tar.zst') else 'zip'
+        archive = BackupArchive(zip_name, admission=self.admission, run_blocking=self.utils_cog.run_blocking, archive_format=archive_format, zstd_level=self.ZSTD_LEVEL)
+        metadata_start = time.perf_counter()
         
         # Write server info
-        with open(os.path.join(folder, "server_info.txt"), 'w', encoding='utf-8') as f:
-            f.write(f"Server Name: {name}\nMember Count: {guild.member_count}\nCreated At: {guild.created_at}\nBoosts: {guild.premium_subscription_count}\nBoost Level: {guild.premium_tier}\n")
+        member_count = await self.member_count(guild)
+        await archive.write_text("server_info.txt", f"Server Name: {name}\nMember Count: {member_count}\nCreated At: {guild.created_at}\nBoosts: {guild.premium_subscription_count}\nBoost Level: {guild.premium_tier}\n")
+        
+        downloads = []
+        counts = {}
         
         # Server assets
         if prefs.get('save_server_assets', True):
-            assets = os.path.join(folder, "server_assets")
-            os.makedirs(assets, exist_ok=True)
-            async with aiohttp.ClientSession() as session:
-                for attr, fname in [('icon', 'server_icon.png'), ('banner', 'server_banner.png'), ('splash', 'server_splash.png'), ('discovery_splash', 'server_discovery_splash.png')]:
-                    url = getattr(guild, attr, None)
-                    if url:
-                        u = str(url.url)
-                        async with session.get(u) as resp:
-                            if resp.status == 200:
-                                with open(os.path.join(assets, fname), 'wb') as f2:
-                                    f2.write(await resp.read())
+            for attr, fname in [('icon', 'server_icon.png'), ('banner', 'server_banner.png'), ('splash', 'server_splash.png'), ('discovery_splash', 'server_discovery_splash.png')]:
+                url = getattr(guild, attr, None)
+                if url:
+                    downloads.append(('server_assets', str(url.url), archive.reserve(f"server_assets/{fname}"), f"{attr}:{url.key}"))
         
         # Channels
         if prefs.get('save_channels', True):
-            with open(os.path.join(folder, "channels.txt"), 'w', encoding='utf-8') as f:
-                for cat in guild.categories:
-                    f.write(f"[Category] {cat.name}\n")
-                    for tc in cat.text_channels:
-                        f.write(f"  - {tc.name} (Text)\n")
-                    for vc in cat.voice_channels:
-                        f.write(f"  - {vc.name} (Voice)\n")
-                for tc in guild.text_channels:
-                    if tc.category is None:
-                        f.write(f"{tc.name} (Text)\n")
-                for vc in guild.voice_channels:
-                    if vc.category is None:
-                        f.write(f"{vc.name} (Voice)\n")
+            lines = []
+            for cat in guild.categories:
+                lines.append(f"[Category] {cat.name}\n")
+                for tc in cat.text_channels:
+                    lines.append(f"  - {tc.name} (Text)\n")
+                for vc in cat.voice_channels:
+                    lines.append(f"  - {vc.name} (Voice)\n")
+            for tc in guild.text_channels:
+                if tc.category is None:
+                    lines.append(f"{tc.name} (Text)\n")
+            for vc in guild.voice_channels:
+                if vc.category is None:
+                    lines.append(f"{vc.name} (Voice)\n")
+            await archive.write_text("channels.txt", "".join(lines))
+            counts['channels'] = len(guild.categories) + len(guild.text_channels) + len(guild.voice_channels)
         
         # Roles
         if prefs.get('save_roles', True):
-            with open(os.path.join(folder, "roles.txt"), 'w', encoding='utf-8') as f:
-                for role in guild.roles:
-                    perms = [p for p, v in role.permissions if v]
-                    f.write(f"{role.name}: {', '.join(perms)}\n")
+            lines = []
+            for role in guild.roles:
+                perms = [p for p, v in role.permissions if v]
+                lines.append(f"{role.name}: {', '.join(perms)}\n")
+            await archive.write_text("roles.txt", "".join(lines))
+            counts['roles'] = len(guild.roles)
         
         # Role icons
         if prefs.get('save_role_icons', True):
-            icons = [r for r in guild.roles if r.icon]
-            if icons:
-                ric = os.path.join(folder, "role_icons")
-                os.makedirs(ric, exist_ok=True)
-                async with aiohttp.ClientSession() as session:
-                    for r in icons:
-                        u = str(r.icon.url)
-                        async with session.get(u) as resp:
-                            if resp.status == 200:
-                                ext = os.path.splitext(urlparse(u).path)[1] or ".png"
-                                with open(os.path.join(ric, self.utils_cog.sanitize_filename(r.name) + ext), 'wb') as f2:
-                                    f2.write(await resp.read())
+            for r in guild.roles:
+                if r.icon:
+                    u = str(r.icon.url)
+                    ext = os.path.splitext(urlparse(u).path)[1] or ".png"
+                    downloads.append(('role_icons', u, archive.reserve(f"role_icons/{self.utils_cog.sanitize_filename(r.name)}{ext}"), f"role_icon:{r.icon.key}"))
         
         # Emojis
         if prefs.get('save_emojis', True):
-            emo = os.path.join(folder, "emojis")
-            os.makedirs(emo, exist_ok=True)
-            async with aiohttp.ClientSession() as session:
-                for e in guild.emojis:
-                    async with session.get(str(e.url)) as resp:
-                        if resp.status == 200:
-                            ext = "gif" if e.animated else "png"
-                            with open(os.path.join(emo, self.utils_cog.sanitize_filename(e.name) + "." + ext), 'wb') as f2:
-                                f2.write(await resp.read())
+            for e in guild.emojis:
+                ext = "gif" if e.animated else "png"
+                downloads.append(('emojis', str(e.url), archive.reserve(f"emojis/{self.utils_cog.sanitize_filename(e.name)}.{ext}"), f"emoji:{e.id}"))
         
         # Stickers
         if prefs.get('save_stickers', True):
-            stc = os.path.join(folder, "stickers")
-            os.makedirs(stc, exist_ok=True)
-            async with aiohttp.ClientSession() as session:
-                for s in guild.stickers:
-                    u = str(s.url)
-                    async with session.get(u) as resp:
-                        if resp.status == 200:
-                            ext = os.path.splitext(urlparse(u).path)[1] or ".png"
-                            with open(os.path.join(stc, self.utils_cog.sanitize_filename(s.name) + ext), 'wb') as f2:
-                                f2.write(await resp.read())
-        
-        # Create ZIP
-        zip_name = f"{folder}.zip"
-        with zipfile.ZipFile(zip_name, 'w', zipfile.ZIP_DEFLATED) as zf:
-            for root, _, files in os.walk(folder):
-                for file in files:
-                    path = os.path.join(root, file)
-                    zf.write(path, os.path.relpath(path, folder))
-        
-        # Upload and send
-        size = os.path.getsize(zip_name)
-        url = await self.utils_cog.upload_to_cdn(zip_name, guild_id)
+            for s in guild.stickers:
+                u = str(s.url)
+                ext = os.path.splitext(urlparse(u).path)[1] or ".png"
+                downloads.append(('stickers', u, archive.reserve(f"stickers/{self.utils_cog.sanitize_filename(s.name)}{ext}"), f"sticker:{s.id}"))
         
-        try:
-            if guild.premium_tier >= 2 and size < ((50 if guild.premium_tier < 3 else 100) * 1024 * 1024):
-                with open(zip_name, 'rb') as f:
-                    await log_channel.send(f"Server backup for {name} (Boost Level {guild.premium_tier}):\nCDN Link: {url}", file=discord.File(f))
-            elif size < self.utils_cog.MAX_DISCORD_FILE_SIZE:
-                with open(zip_name, 'rb') as f:
-                    await log_channel.send(f"Server backup for {name}:\nCDN Link: {url}", file=discord.File(f))
-            else:
-                await log_channel.send(f"Server backup for {name}:\n{url}")
-        except discord.HTTPException:
-            await log_channel.send(f"Backup available at: {url}")
-            await self.utils_cog.send_chunked_backup(log_channel, name, zip_name)
+        # Structured copy of the same data for /restore, pointing at the asset entries by name
+        snapshot = guild_snapshot(guild, prefs, {key: name for _, _, name, key in downloads})
+        await archive.write_text("backup.json", json.dumps(snapshot, indent=2))
         
-        # Cleanup
-        shutil.rmtree(folder)
-        os.remove(zip_name)
+        self.metrics.observe('backup_stage_seconds', time.perf_counter() - metadata_start, stage='metadata')
         
-        # Update stats
-        self.db_cog.update_stat('data_saved_bytes', inc=size)
-        self.db_cog.record_backup_completion(guild_id)
-        return True
+        # Download every asset of every component concurrently, straight into the archive
+        reused = {}
+        try:
+            async with self.admission.resource('network'):
+                with self.metrics.timer('download'):
+                    if self.INCREMENTAL_BACKUPS:
+                        known = await self.utils_cog.run_blocking(self.db_cog.get_asset_manifest, guild_id)
+                        store = AssetStore(guild_id, known, self.utils_cog, record=lambda blobs: self.db_cog.save_asset_blobs(guild_id, blobs, []))
+                        pending = [d for d in downloads if not store.reference(d[0], d[2], d[3])]
+                        results = await self.downloader.download_all(pending, store)
+                    else:
+                        checkpoint = AssetCheckpoint(archive, self.work_dir(guild_id))
+                        try:
+                            pending, reused = await checkpoint.reuse(downloads)
+                            results = await self.downloader.download_all(pending, checkpoint)
+                        finally:
+                            checkpoint.close()
+            if self.INCREMENTAL_BACKUPS:
+                with self.metrics.timer('db'):
+                    # Awaited so the next incremental backup of this guild sees the new blobs
+                    await asyncio.wrap_future(self.db_cog.save_asset_blobs(guild_id, store.new_blobs, [d[3] for d in downloads]))
+                await archive.write_text("manifest.json", json.dumps(store.entries, indent=2, sort_keys=True))
+        finally:
+            await archive.close()
+        for c, r in results.items():
+            self.metrics.observe('backup_stage_seconds', r['seconds'], stage='download', component=c)
+            self.metrics.inc('backup_bytes_total', r['bytes'], stage='download', component=c)
+            self.metrics.inc('assets_total', r['ok'], component=c, outcome='ok')
+            self.metrics.inc('assets_total', r['failed'], component=c, outcome='failed')
+        for c, n in reused.items():
+            self.metrics.inc('assets_total', n, component=c, outcome='reused')
+        # Assets per component in the backup, including unchanged ones an incremental backup only references
+        for component, *_ in downloads:
+            counts[component] = counts.get(component, 0) + 1
+        for c, r in results.items():
+            counts[c] -= r['failed']
+        self.metrics.observe('backup_stage_seconds', archive.seconds, stage='archive')
+        failed = ", ".join(f"{c} {r['failed']}/{r['ok'] + r['failed']}" for c, r in results.items() if r['failed'])
+        if failed:
+            print(f"Backup of {guild_id}: failed asset downloads ({failed})")
+        return counts, failed
     
     def update_servers_count(self):
-        active = sum(1 for d in self.backup_jobs.values() if d.get('job'))
-        self.db_cog.update_stat('servers_protected', val=active)
-        self.export_stats_to_json()
-    
-    def export_stats_to_json(self):
-        stats = self.db_cog.get_stats()
-        with open('stats.json', 'w') as f:
-            json.dump({
-                'servers_protected': int(stats.get('servers_protected', 0)),
-                'backups_created': int(stats.get('backups_created', 0)),
-                'data_saved_bytes': int(stats.get('data_saved_bytes', 0))
-            }, f)
-        self.push_stats_to_github('stats.json')
+        task = asyncio.create_task(self.count_servers())
+        self.background.add(task)
+        task.add_done_callback(self.background.discard)
     
-    def push_stats_to_github(self, path):
-        if not self.GITHUB_REPO_PATH or not self.GITHUB_TOKEN:
-            return
+    async def count_servers(self):
+        # Counted from the database so every process reports the same total, once our queued config writes are in
         try:
-            repo_dir = os.path.expanduser(self.GITHUB_REPO_PATH)
-            if not os.path.exists(repo_dir):
-                subprocess.run([
-                    'git', 'clone',
-                    f'https://{self.GITHUB_TOKEN}@github.com/{self.GITHUB_REPO_PATH.split("/")[-2]}/{self.GITHUB_REPO_PATH.split("/")[-1]}.git',
-                    repo_dir
-                ], check=True)
-            else:
-                subprocess.run(['git', 'checkout', '-f', 'main'], cwd=repo_dir, check=True)
-                subprocess.run(['git', 'fetch', '--all'], cwd=repo_dir, check=True)
-                subprocess.run(['git', 'reset', '--hard', 'origin/main'], cwd=repo_dir, check=True)
-            target = os.path.join(repo_dir, 'stats.json')
-            shutil.copy(path, target)
-            subprocess.run(['git', 'config', 'user.name', 'BackupBot'], cwd=repo_dir, check=True)
-            subprocess.run(['git', 'config', 'user.email', 'backupbot@example.com'], cwd=repo_dir, check=True)
-            subprocess.run(['git', 'add', 'stats.json'], cwd=repo_dir, check=True)
-            subprocess.run(['git', 'commit', '-m', f'Update stats - {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}'], cwd=repo_dir, check=True)
-            subprocess.run(['git', 'push', 'origin', 'main'], cwd=repo_dir, check=True)
-        except:
-            pass
+            await asyncio.wrap_future(self.db_cog.writer.flush())
+            count = await self.utils_cog.run_blocking(self.db_cog.count_active_servers)
+        except Exception as e:
+            print(f"Failed to count active servers: {e}")
+            return
+        self.stats_cog.set('servers_protected', count)
+    
+    async def cog_unload(self):
+        self.scheduler.shutdown()
+        await self.downloader.close()
+    
+    @commands.command(name="queue", hidden=True)
+    @commands.is_owner()
+    async def queue(self, ctx):
+        snap = self.admission.snapshot()
+        budgets = ", ".join(f"{k} {v['in_use']}/{v['limit']}" for k, v in snap['budgets'].items())
+        await ctx.send(
+            f"Running: {snap['running']}/{snap['max_backups']} | Queued: {snap['queued']}\n"
+            f"Wait avg {snap['avg_wait']:.1f}s, max {snap['max_wait']:.1f}s over {snap['admitted']} backups\n"
+            f"Budgets: {budgets}\n"
+            + "\n".join(self.describe_rate_budget(k, b) for k, b in (('CDN', self.utils_cog.cdn_budget), ('Sends', self.utils_cog.send_budget)))
+        )
+    
+    @staticmethod
+    def describe_rate_budget(label, budget):
+        snap = budget.snapshot()
+        rate = f"{snap['rate']:.1f}/s" if snap['rate'] else "uncapped"
+        paused = f", paused {snap['paused_for']:.1f}s" if snap['paused_for'] else ""
+        return (f"{label}: {rate}{paused}, {snap['observed_rate']:.1f}/s observed | {snap['throttled']} 429s, "
+                f"{snap['delayed']}/{snap['acquired']} requests delayed, avg wait {snap['avg_wait'] * 1000:.0f} ms")
+    
+    @commands.command(name="reschedule", hidden=True)
+    @commands.is_owner()
+    async def reschedule_cmd(self, ctx):
+        count = await self.reschedule()
+        await ctx.send(f"Recomputed the next anchored backup for {count} servers.")
     
     @commands.Cog.listener()
     async def on_guild_remove(self, guild):
@@ -279,7 +1125,10 @@ class BackupCog(commands.Cog):
             if job:
                 self.scheduler.remove_job(job.id)
             del self.backup_jobs[gid]
-            self.db_cog.save_server_config(self.backup_jobs)
+            self.guild_locks.pop(gid, None)
+            self.db_cog.save_server_config(self.backup_jobs, gid)
+            await self.discard_guild_checkpoint(gid)
+            self.changes.forget(gid)
             self.update_servers_count()
 
 async def setup(bot):
@@ -0,0 +1,155 @@
+import asyncio
+import os
+import time
+from discord.ext import commands, tasks
+
+# One dirty bit per backup component
+COMPONENT_BITS = {
+    'server_assets': 1,
+    'channels': 2,
+    'roles': 4,
+    'role_icons': 8,
+    'emojis': 16,
+    'stickers': 32
+}
+
+class ChangeTrackerCog(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.CHANGES_FLUSH_INTERVAL = int(os.getenv("CHANGES_FLUSH_INTERVAL", 60))
+        self.dirty = {}
+        self.counts = {}
+        self.baselines = {}
+        self.unsaved = set()
+
+    async def initialize_relationships(self):
+        self.db_cog = self.bot.get_cog("DatabaseCog")
+        self.utils_cog = self.bot.get_cog("UtilsCog")
+        for guild_id, mask, count in await self.utils_cog.run_blocking(self.db_cog.load_guild_changes):
+            self.dirty[guild_id] = mask
+            self.counts[guild_id] = count
+        self.flush_loop.change_interval(seconds=self.CHANGES_FLUSH_INTERVAL)
+        self.flush_loop.start()
+
+    async def cog_unload(self):
+        self.flush_loop.cancel()
+        await self.flush()
+
+    def mark(self, guild_id, *components):
+        mask = 0
+        for component in components:
+            mask |= COMPONENT_BITS[component]
+        self.restore(guild_id, mask)
+        self.counts[guild_id] = self.counts.get(guild_id, 0) + 1
+
+    def restore(self, guild_id, mask):
+        if mask:
+            self.dirty[guild_id] = self.dirty.get(guild_id, 0) | mask
+            self.unsaved.add(guild_id)
+
+    def take(self, guild_id):
+        # Clears the guild's dirty bits; callers put them back with restore() if the backup fails
+        mask = self.dirty.pop(guild_id, 0)
+        if mask:
+            self.unsaved.add(guild_id)
+        return mask
+
+    def mark_clean(self, guild_id, baseline):
+        # baseline identifies the preferences the clean backup was taken with
+        self.baselines[guild_id] = (baseline, time.time())
+
+    def enabled_mask(self, prefs):
+        return sum(bit for name, bit in COMPONENT_BITS.items() if prefs.get(f'save_{name}', True))
+
+    def is_idle(self, guild_id, mask, prefs, baseline):
+        # Events are only conclusive once this process has seen a clean backup with the same preferences;
+        # anything that happened while the bot was offline is invisible here
+        known = self.baselines.get(guild_id)
+        return known is not None and known[0] == baseline and not mask & self.enabled_mask(prefs)
+
+    def changed_components(self, mask):
+        return [name for name, bit in COMPONENT_BITS.items() if mask & bit]
+
+    def dirty_guilds(self):
+        return sum(1 for mask in self.dirty.values() if mask)
+
+    def forget(self, guild_id):
+        self.dirty.pop(guild_id, None)
+        self.counts.pop(guild_id, None)
+        self.baselines.pop(guild_id, None)
+        self.unsaved.add(guild_id)
+
+    async def flush(self):
+        if not self.unsaved:
+            return
+        guild_ids, self.unsaved = self.unsaved, set()
+        rows = [(gid, self.dirty.get(gid, 0), self.counts.get(gid, 0)) for gid in guild_ids]
+        try:
+            await asyncio.wrap_future(self.db_cog.save_guild_changes(rows))
+        except Exception as e:
+            self.unsaved |= guild_ids
+            print(f"Failed to save change tracking: {e}")
+
+    @tasks.loop(seconds=60)
+    async def flush_loop(self):
+        await self.flush()
+
+    @commands.Cog.listener()
+    async def on_guild_update(self, before, after):
+        if (before.name, before.icon, before.banner, before.splash, before.discovery_splash) != (after.name, after.icon, after.banner, after.splash, after.discovery_splash):
+            self.mark(after.id, 'server_assets')
+
+    @commands.Cog.listener()
+    async def on_guild_channel_create(self, channel):
+        self.mark(channel.guild.id, 'channels')
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel):
+        self.mark(channel.guild.id, 'channels')
+
+    @staticmethod
+    def channel_state(channel):
+        # Every channel field backup.json stores; text and voice channels each lack some of them
+        return (
+            channel.name, channel.category_id, channel.position, channel.type, channel.overwrites,
+            getattr(channel, 'topic', None), getattr(channel, 'nsfw', None), getattr(channel, 'slowmode_delay', None),
+            getattr(channel, 'bitrate', None), getattr(channel, 'user_limit', None)
+        )
+
+    @staticmethod
+    def role_state(role):
+        return (role.name, role.permissions, role.position, role.colour, role.hoist, role.mentionable, role.managed)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_update(self, before, after):
+        if self.channel_state(before) != self.channel_state(after):
+            self.mark(after.guild.id, 'channels')
+
+    @commands.Cog.listener()
+    async def on_guild_role_create(self, role):
+        self.mark(role.guild.id, 'roles', *(['role_icons'] if role.icon else []))
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role):
+        self.mark(role.guild.id, 'roles', *(['role_icons'] if role.icon else []))
+
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before, after):
+        components = []
+        if self.role_state(before) != self.role_state(after):
+            components.append('roles')
+        if before.icon != after.icon:
+            components.append('role_icons')
+        if components:
+            self.mark(after.guild.id, *components)
+
+    @commands.Cog.listener()
+    async def on_guild_emojis_update(self, guild, before, after):
+        self.mark(guild.id, 'emojis')
+
+    @commands.Cog.listener()
+    async def on_guild_stickers_update(self, guild, before, after):
+        self.mark(guild.id, 'stickers')
+
+async def setup(bot):
+    await bot.add_cog(ChangeTrackerCog(bot))
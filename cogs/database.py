@@ -1,25 +1,175 @@
+import asyncio
+import atexit
 import discord
+import functools
 import os
+import queue
 import sqlite3
 import json
 import pytz
+import threading
+import time
+from concurrent.futures import Future
 from typing import Dict, Any
 from discord.ext import commands
 from datetime import datetime
 
+class DatabaseWriter:
+    # The only connection that writes. Writes queued within `window` seconds of each other share one transaction,
+    # each in its own savepoint so a failing statement only rolls back its own write
+    def __init__(self, path, window=0.005, max_batch=500):
+        self.path = path
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = queue.SimpleQueue()
+        self.commits = 0
+        self.writes = 0
+        # Time spent committing, including the statements of every write in the batch
+        self.seconds = 0.0
+        self.slowest = 0.0
+        self.thread = threading.Thread(target=self.run, name="db-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, name, func, *args):
+        # func gets the writer's cursor first; the returned Future resolves once the transaction has committed
+        future = Future()
+        self.queue.put((future, name, func, args))
+        return future
+
+    @staticmethod
+    def done(result=None):
+        future = Future()
+        future.set_result(result)
+        return future
+
+    def flush(self):
+        return self.submit('flush', lambda cursor: None)
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def run(self):
+        conn = sqlite3.connect(self.path, isolation_level=None)
+        conn.execute("PRAGMA busy_timeout = 5000")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        stopping = False
+        while not stopping:
+            item = self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    item = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self.commit(conn, batch)
+        conn.close()
+
+    def commit(self, conn, batch):
+        # A caller that stopped waiting (a cancelled task) still gets its write, just not the result
+        waiting = {id(future) for future, _, _, _ in batch if future.set_running_or_notify_cancel()}
+        outcomes = []
+        start = time.perf_counter()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            for future, name, func, args in batch:
+                cursor.execute("SAVEPOINT write")
+                try:
+                    outcomes.append((future, name, func(cursor, *args), None))
+                    cursor.execute("RELEASE write")
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO write")
+                    cursor.execute("RELEASE write")
+                    outcomes.append((future, name, None, e))
+            cursor.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            outcomes = [(future, name, None, e) for future, name, _, _ in batch]
+        elapsed = time.perf_counter() - start
+        self.seconds += elapsed
+        self.slowest = max(self.slowest, elapsed)
+        self.commits += 1
+        self.writes += len(batch)
+        for future, name, result, error in outcomes:
+            if error is not None:
+                print(f"Database write {name} failed: {error!r}")
+            if id(future) not in waiting:
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+def writes(method):
+    # The method runs on the writer thread with its cursor; callers get a Future and may ignore it
+    @functools.wraps(method)
+    def submit(self, *args, **kwargs):
+        return self.writer.submit(method.__name__, lambda cursor: method(self, cursor, *args, **kwargs))
+    return submit
+
+def reads(method):
+    # The method gets a cursor on the calling thread's pooled connection
+    @functools.wraps(method)
+    def query(self, *args, **kwargs):
+        return method(self, self.reader().cursor(), *args, **kwargs)
+    return query
+
 class DatabaseCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.CONFIG_FILE = "server_config.json"
         self.DB_FILE = "backup_config.db"
+        self.DB_COMMIT_WINDOW_MS = float(os.getenv("DB_COMMIT_WINDOW_MS", 5))
+        self.dirty_guilds = set()
+        self.local = threading.local()
         self.setup_database()
+        self.writer = DatabaseWriter(self.DB_FILE, window=self.DB_COMMIT_WINDOW_MS / 1000)
+        # Writes still queued when the process exits are committed before it does
+        atexit.register(self.writer.close)
         
     async def initialize_relationships(self):
-        # This cog doesn't need references to others
-        pass
+        self.metrics = self.bot.get_cog("MetricsCog")
+        self.leases = self.bot.get_cog("LeaseCog")
+        self.metrics.gauge('db_write_queue', self.writer.queue.qsize)
+        self.metrics.gauge('db_writes_per_commit', lambda: self.writer.writes / self.writer.commits if self.writer.commits else 0.0)
+        self.metrics.gauge('db_commit_seconds_avg', lambda: self.writer.seconds / self.writer.commits if self.writer.commits else 0.0)
+        self.metrics.gauge('db_commit_seconds_max', lambda: self.writer.slowest)
+    
+    async def cog_unload(self):
+        # Other cogs may still write while they unload, so the writer keeps running until exit
+        await asyncio.wrap_future(self.writer.flush())
+        
+    @staticmethod
+    def on_loop(future, callback):
+        # Writer futures settle on the writer thread; callback gets the settled future on the event loop instead
+        loop = asyncio.get_running_loop()
+        def settled(f):
+            # Writes committed while the process exits have no loop left to report back to
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(callback, f)
+        future.add_done_callback(settled)
+        
+    def reader(self):
+        # One long-lived connection per thread; in WAL mode readers never wait for the writer
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = sqlite3.connect(self.DB_FILE)
+            conn.execute("PRAGMA busy_timeout = 5000")
+        return conn
         
     def setup_database(self):
         conn = sqlite3.connect(self.DB_FILE)
+        conn.execute("PRAGMA journal_mode = WAL")
         cursor = conn.cursor()
         cursor.execute('''CREATE TABLE IF NOT EXISTS server_configs (
             guild_id INTEGER PRIMARY KEY,
@@ -44,17 +194,107 @@ class DatabaseCog(commands.Cog):
             stat_name TEXT PRIMARY KEY,
             stat_value REAL NOT NULL
         )''')
+        # The first history schema was keyed on (guild_id, ISO text time); its rows are copied over below
+        old_history = {r[1] for r in cursor.execute("PRAGMA table_info(backup_history)")}
+        if old_history and 'id' not in old_history:
+            cursor.execute("ALTER TABLE backup_history RENAME TO backup_history_old")
         cursor.execute('''CREATE TABLE IF NOT EXISTS backup_history (
-            guild_id INTEGER,
-            backup_time TEXT,
-            PRIMARY KEY (guild_id, backup_time)
+            id INTEGER PRIMARY KEY,
+            guild_id INTEGER NOT NULL,
+            backup_time INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'success',
+            size INTEGER,
+            duration REAL,
+            fingerprint TEXT,
+            storage_key TEXT,
+            components TEXT,
+            error TEXT
+        )''')
+        # Covering indexes: per-guild pages and trends, the last successful fingerprint, and time-window operator queries
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_backup_history_guild ON backup_history (guild_id, backup_time, status, size, duration)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_backup_history_success ON backup_history (guild_id, status, backup_time, fingerprint)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_backup_history_time ON backup_history (backup_time, status, guild_id, size, duration)")
+        if old_history and 'id' not in old_history:
+            self.migrate_backup_history(cursor, old_history)
+        cursor.execute('''CREATE TABLE IF NOT EXISTS asset_blobs (
+            guild_id INTEGER NOT NULL,
+            asset_key TEXT NOT NULL,
+            content_hash TEXT NOT NULL,
+            storage_key TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            last_seen TEXT,
+            PRIMARY KEY (guild_id, asset_key)
+        )''')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS backup_objects (
+            storage_key TEXT PRIMARY KEY,
+            guild_id INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            size INTEGER NOT NULL DEFAULT 0,
+            deleted_at TEXT
+        )''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_backup_objects_live ON backup_objects (guild_id, deleted_at)")
+        cursor.execute('''CREATE TABLE IF NOT EXISTS retention_policies (
+            guild_id INTEGER PRIMARY KEY,
+            keep_last INTEGER NOT NULL DEFAULT 0,
+            keep_hourly INTEGER NOT NULL DEFAULT 0,
+            keep_daily INTEGER NOT NULL DEFAULT 0,
+            keep_weekly INTEGER NOT NULL DEFAULT 0,
+            keep_monthly INTEGER NOT NULL DEFAULT 0,
+            listed_at TEXT
+        )''')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS shard_leases (
+            shard_id INTEGER PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )''')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS guild_changes (
+            guild_id INTEGER PRIMARY KEY,
+            dirty_mask INTEGER NOT NULL DEFAULT 0,
+            change_count INTEGER NOT NULL DEFAULT 0
+        )''')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS backup_checkpoints (
+            guild_id INTEGER PRIMARY KEY,
+            started_at REAL NOT NULL,
+            stage TEXT NOT NULL,
+            path TEXT NOT NULL,
+            baseline TEXT,
+            fingerprint TEXT,
+            size INTEGER,
+            components TEXT,
+            failed TEXT,
+            storage_key TEXT,
+            upload_id TEXT,
+            part_size INTEGER,
+            updated_at REAL NOT NULL
+        )''')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS config_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id INTEGER NOT NULL UNIQUE,
+            instance TEXT
         )''')
+        # Columns added after the first release
+        config_columns = {r[1] for r in cursor.execute("PRAGMA table_info(server_configs)")}
+        if 'schedule_anchor' not in config_columns:
+            cursor.execute("ALTER TABLE server_configs ADD COLUMN schedule_anchor TEXT")
+        preference_columns = {r[1] for r in cursor.execute("PRAGMA table_info(backup_preferences)")}
+        if 'archive_format' not in preference_columns:
+            cursor.execute("ALTER TABLE backup_preferences ADD COLUMN archive_format TEXT NOT NULL DEFAULT 'zip'")
         cursor.execute("INSERT OR IGNORE INTO bot_stats VALUES ('servers_protected',0)")
         cursor.execute("INSERT OR IGNORE INTO bot_stats VALUES ('backups_created',0)")
         cursor.execute("INSERT OR IGNORE INTO bot_stats VALUES ('data_saved_bytes',0)")
         conn.commit()
         conn.close()
     
+    def migrate_backup_history(self, cursor, columns):
+        status = 'status' if 'status' in columns else "'success'"
+        fingerprint = 'fingerprint' if 'fingerprint' in columns else 'NULL'
+        rows = cursor.execute(f"SELECT guild_id, backup_time, {status}, {fingerprint} FROM backup_history_old").fetchall()
+        cursor.executemany(
+            "INSERT INTO backup_history (guild_id, backup_time, status, fingerprint) VALUES (?, ?, ?, ?)",
+            [(gid, int(datetime.fromisoformat(t).timestamp()), st, fp) for gid, t, st, fp in rows if t]
+        )
+        cursor.execute("DROP TABLE backup_history_old")
+    
     def migrate_json_to_sqlite(self):
         if os.path.exists(self.CONFIG_FILE):
             with open(self.CONFIG_FILE) as f:
@@ -83,103 +323,388 @@ class DatabaseCog(commands.Cog):
         conn.commit()
         conn.close()
     
-    def update_stat(self, name, inc=None, val=None):
-        conn = sqlite3.connect(self.DB_FILE)
-        cursor = conn.cursor()
-        if inc is not None:
-            cursor.execute("UPDATE bot_stats SET stat_value=stat_value+? WHERE stat_name=?", (inc, name))
-        elif val is not None:
-            cursor.execute("UPDATE bot_stats SET stat_value=? WHERE stat_name=?", (val, name))
-        conn.commit()
-        conn.close()
+    @writes
+    def apply_stats(self, cursor, increments, values):
+        # Pending counter increments and set values of StatsCog, applied in one write
+        cursor.executemany("UPDATE bot_stats SET stat_value=stat_value+? WHERE stat_name=?", [(inc, name) for name, inc in increments.items()])
+        cursor.executemany("UPDATE bot_stats SET stat_value=? WHERE stat_name=?", [(val, name) for name, val in values.items()])
     
-    def get_stats(self):
-        conn = sqlite3.connect(self.DB_FILE)
-        cursor = conn.cursor()
+    @reads
+    def get_stats(self, cursor):
         cursor.execute("SELECT stat_name,stat_value FROM bot_stats")
-        stats = {r[0]:r[1] for r in cursor.fetchall()}
-        conn.close()
-        return stats
+        return {r[0]:r[1] for r in cursor.fetchall()}
     
-    def save_server_config(self, backup_jobs):
-        conn = sqlite3.connect(self.DB_FILE)
-        cursor = conn.cursor()
-        for guild_id, job_data in backup_jobs.items():
-            next_run = job_data['job'].next_run_time.isoformat() if job_data.get('job') and job_data['job'].next_run_time else None
-            cursor.execute(
-                "INSERT OR REPLACE INTO server_configs VALUES (?,?,?,?,?,?)",
-                (guild_id, job_data['log_channel_id'], next_run, bool(job_data.get('job')), job_data.get('timezone','UTC'), job_data.get('frequency','daily'))
-            )
-            prefs = job_data.get('preferences', {})
-            cursor.execute(
-                "INSERT OR REPLACE INTO backup_preferences VALUES (?,?,?,?,?,?,?,?)",
-                (
-                    guild_id,
-                    prefs.get('save_server_assets', True),
-                    prefs.get('save_channels', True),
-                    prefs.get('save_roles', True),
-                    prefs.get('save_role_icons', True),
-                    prefs.get('save_emojis', True),
-                    prefs.get('save_stickers', True),
-                    prefs.get('separate_component_files', False)
-                )
+    def mark_dirty(self, *guild_ids):
+        self.dirty_guilds.update(guild_ids)
+    
+    def guild_config_rows(self, guild_id, job_data):
+        # Taken on the caller's thread, the writer never touches the live backup_jobs dict
+        job = job_data.get('job')
+        next_run = job.next_run_time.isoformat() if job and job.next_run_time else None
+        anchor = job.anchor.isoformat() if job and getattr(job, 'anchor', None) else None
+        prefs = job_data.get('preferences', {})
+        return (
+            (guild_id, job_data['log_channel_id'], next_run, bool(job), job_data.get('timezone','UTC'), job_data.get('frequency','daily'), anchor),
+            (
+                guild_id,
+                prefs.get('save_server_assets', True),
+                prefs.get('save_channels', True),
+                prefs.get('save_roles', True),
+                prefs.get('save_role_icons', True),
+                prefs.get('save_emojis', True),
+                prefs.get('save_stickers', True),
+                prefs.get('separate_component_files', False),
+                prefs.get('archive_format', 'zip')
             )
-        conn.commit()
-        conn.close()
+        )
     
-    def load_server_config(self):
-        self.setup_database()
+    def write_guild_configs(self, cursor, rows, deleted):
+        cursor.executemany(
+            "INSERT OR REPLACE INTO server_configs (guild_id, log_channel_id, next_backup, active, timezone, frequency, schedule_anchor) VALUES (?,?,?,?,?,?,?)",
+            [config for config, _ in rows]
+        )
+        cursor.executemany(
+            "INSERT OR REPLACE INTO backup_preferences (guild_id, save_server_assets, save_channels, save_roles, save_role_icons, save_emojis, save_stickers, separate_component_files, archive_format) VALUES (?,?,?,?,?,?,?,?,?)",
+            [prefs for _, prefs in rows]
+        )
+        cursor.executemany("DELETE FROM backup_preferences WHERE guild_id = ?", [(gid,) for gid in deleted])
+        cursor.executemany("DELETE FROM server_configs WHERE guild_id = ?", [(gid,) for gid in deleted])
+    
+    def log_config_changes(self, cursor, guild_ids, instance):
+        # One row per guild with its latest change; other processes follow the sequence to pick up what we wrote
+        cursor.executemany("INSERT OR REPLACE INTO config_changes (guild_id, instance) VALUES (?, ?)", [(gid, instance) for gid in guild_ids])
+    
+    @reads
+    def get_config_changes(self, cursor, since, instance):
+        # Guilds whose config another process wrote after `since`, and the sequence to continue from; no guilds when
+        # since is None, only where the sequence stands
+        cursor.execute("SELECT COALESCE(MAX(seq), 0) FROM config_changes")
+        last = cursor.fetchone()[0]
+        if since is None:
+            return last, []
+        cursor.execute("SELECT guild_id FROM config_changes WHERE seq > ? AND seq <= ? AND instance IS NOT ?", (since, last, instance))
+        return last, [r[0] for r in cursor.fetchall()]
+    
+    def save_server_config(self, backup_jobs, *guild_ids):
+        # Only guilds marked dirty are written; removed guilds are deleted
+        self.mark_dirty(*guild_ids)
+        if not self.dirty_guilds:
+            return self.writer.done()
+        dirty, self.dirty_guilds = self.dirty_guilds, set()
+        rows = [self.guild_config_rows(gid, backup_jobs[gid]) for gid in dirty if gid in backup_jobs]
+        deleted = [gid for gid in dirty if gid not in backup_jobs]
+        def write(cursor):
+            self.write_guild_configs(cursor, rows, deleted)
+            self.log_config_changes(cursor, dirty, self.leases.INSTANCE_ID)
+        future = self.writer.submit('save_server_config', write)
+        # Failed writes put their guilds back, on the loop where dirty_guilds is used
+        self.on_loop(future, lambda f: (f.cancelled() or f.exception()) and self.dirty_guilds.update(dirty))
+        return future
+    
+    def compact_server_config(self, backup_jobs):
+        # Full rewrite of every guild, drops orphaned rows; the future resolves to (written, removed). backup_jobs only
+        # holds the guilds on shards this process leases, rows of every other shard belong to another process.
+        rows = [self.guild_config_rows(gid, job_data) for gid, job_data in backup_jobs.items()]
+        owned = set(self.leases.owned)
+        def rewrite(cursor):
+            stored = {r[0] for r in cursor.execute("SELECT guild_id FROM server_configs UNION SELECT guild_id FROM backup_preferences")}
+            orphaned = {gid for gid in stored if self.leases.shard_for(gid) in owned} - {config[0] for config, _ in rows}
+            self.write_guild_configs(cursor, rows, orphaned)
+            return len(rows), len(orphaned)
+        self.dirty_guilds.clear()
+        return self.writer.submit('compact_server_config', rewrite)
+    
+    def vacuum(self):
+        # VACUUM can't run inside the writer's transactions, it gets a connection of its own
         conn = sqlite3.connect(self.DB_FILE)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM server_configs")
-        config = {}
-        for row in cursor.fetchall():
-            gid = row['guild_id']
-            config[str(gid)] = {
+        conn.execute("PRAGMA busy_timeout = 5000")
+        conn.execute("VACUUM")
+        conn.close()
+    
+    @reads
+    def iter_server_configs(self, cursor, guild_ids=None):
+        # One joined query, rows are streamed from the cursor instead of fetched all at once; guild_ids narrows it
+        # down in batches that stay under SQLite's parameter limit
+        cursor.row_factory = sqlite3.Row
+        query = '''SELECT c.guild_id, c.log_channel_id, c.next_backup, c.active, c.timezone, c.frequency, c.schedule_anchor,
+            p.guild_id AS pref_guild_id, p.save_server_assets, p.save_channels, p.save_roles,
+            p.save_role_icons, p.save_emojis, p.save_stickers, p.separate_component_files, p.archive_format
+            FROM server_configs c LEFT JOIN backup_preferences p ON p.guild_id = c.guild_id'''
+        if guild_ids is None:
+            batches = [cursor.execute(query)]
+        else:
+            guild_ids = list(guild_ids)
+            batches = (
+                cursor.execute(f"{query} WHERE c.guild_id IN ({','.join('?' * len(batch))})", batch)
+                for batch in (guild_ids[i:i + 500] for i in range(0, len(guild_ids), 500))
+            )
+        for row in (row for rows in batches for row in rows):
+            yield row['guild_id'], {
                 'log_channel_id': row['log_channel_id'],
                 'next_backup': row['next_backup'],
+                'schedule_anchor': row['schedule_anchor'],
                 'active': bool(row['active']),
                 'timezone': row['timezone'],
-                'frequency': row['frequency']
-            }
-            pref = conn.execute("SELECT * FROM backup_preferences WHERE guild_id=?", (gid,)).fetchone()
-            config[str(gid)]['preferences'] = {
-                'save_server_assets': bool(pref['save_server_assets']),
-                'save_channels': bool(pref['save_channels']),
-                'save_roles': bool(pref['save_roles']),
-                'save_role_icons': bool(pref['save_role_icons']),
-                'save_emojis': bool(pref['save_emojis']),
-                'save_stickers': bool(pref['save_stickers']),
-                'separate_component_files': bool(pref['separate_component_files'])
-            } if pref else {
-                'save_server_assets': True,
-                'save_channels': True,
-                'save_roles': True,
-                'save_role_icons': True,
-                'save_emojis': True,
-                'save_stickers': True,
-                'separate_component_files': False
+                'frequency': row['frequency'],
+                'preferences': {
+                    'save_server_assets': bool(row['save_server_assets']),
+                    'save_channels': bool(row['save_channels']),
+                    'save_roles': bool(row['save_roles']),
+                    'save_role_icons': bool(row['save_role_icons']),
+                    'save_emojis': bool(row['save_emojis']),
+                    'save_stickers': bool(row['save_stickers']),
+                    'separate_component_files': bool(row['separate_component_files']),
+                    'archive_format': row['archive_format']
+                } if row['pref_guild_id'] is not None else {
+                    'save_server_assets': True,
+                    'save_channels': True,
+                    'save_roles': True,
+                    'save_role_icons': True,
+                    'save_emojis': True,
+                    'save_stickers': True,
+                    'separate_component_files': False,
+                    'archive_format': 'zip'
+                }
             }
-        conn.close()
-        return config
     
-    def record_backup_completion(self, guild_id):
-        conn = sqlite3.connect(self.DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO backup_history VALUES (?, ?)", (guild_id, datetime.now().isoformat()))
-        conn.commit()
-        conn.close()
+    @writes
+    def record_backup_completion(self, cursor, guild_id, fingerprint=None, status='success', started=None, duration=None,
+                                 size=None, storage_key=None, components=None, error=None):
+        cursor.execute(
+            "INSERT INTO backup_history (guild_id, backup_time, status, size, duration, fingerprint, storage_key, components, error) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (guild_id, int(started or time.time()), status, size, duration, fingerprint, storage_key,
+             json.dumps(components, separators=(',', ':')) if components else None, error)
+        )
     
-    def get_last_backup_time(self, guild_id):
-        conn = sqlite3.connect(self.DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute("SELECT MAX(backup_time) FROM backup_history WHERE guild_id = ?", (guild_id,))
+    @reads
+    def get_last_fingerprint(self, cursor, guild_id):
+        cursor.execute(
+            "SELECT fingerprint FROM backup_history WHERE guild_id = ? AND status = 'success' ORDER BY backup_time DESC LIMIT 1",
+            (guild_id,)
+        )
         result = cursor.fetchone()
-        conn.close()
-        if result and result[0]:
-            return datetime.fromisoformat(result[0])
-        return None
+        return result[0] if result else None
+    
+    @reads
+    def get_backup_history(self, cursor, guild_id, limit=10, offset=0):
+        # Newest first; the page is found in idx_backup_history_guild and only its rows are read from the table
+        cursor.execute(
+            "SELECT backup_time, status, size, duration, storage_key, components, error FROM backup_history "
+            "WHERE id IN (SELECT id FROM backup_history WHERE guild_id = ? ORDER BY backup_time DESC LIMIT ? OFFSET ?) "
+            "ORDER BY backup_time DESC",
+            (guild_id, limit, offset)
+        )
+        return [{
+            'time': datetime.fromtimestamp(r[0], pytz.utc), 'status': r[1], 'size': r[2], 'duration': r[3],
+            'storage_key': r[4], 'components': json.loads(r[5]) if r[5] else {}, 'error': r[6]
+        } for r in cursor.fetchall()]
+    
+    @reads
+    def get_backup_trend(self, cursor, guild_id, limit=30):
+        # Totals over the guild's last `limit` runs, answered from the covering index alone
+        cursor.execute(
+            "SELECT COUNT(*), SUM(status = 'success'), SUM(status = 'unchanged'), SUM(status = 'failed'), "
+            "AVG(CASE WHEN status = 'success' THEN size END), AVG(CASE WHEN status = 'success' THEN duration END), "
+            "MAX(CASE WHEN status = 'success' THEN backup_time END) "
+            "FROM (SELECT status, size, duration, backup_time FROM backup_history WHERE guild_id = ? ORDER BY backup_time DESC LIMIT ?)",
+            (guild_id, limit)
+        )
+        r = cursor.fetchone()
+        return {
+            'runs': r[0], 'success': r[1] or 0, 'unchanged': r[2] or 0, 'failed': r[3] or 0, 'avg_size': r[4], 'avg_duration': r[5],
+            'last_success': datetime.fromtimestamp(r[6], pytz.utc) if r[6] else None
+        }
+    
+    @reads
+    def count_backup_history(self, cursor, guild_id):
+        cursor.execute("SELECT COUNT(*) FROM backup_history WHERE guild_id = ?", (guild_id,))
+        return cursor.fetchone()[0]
+    
+    @reads
+    def get_history_summary(self, cursor, since):
+        # Operator view of every run since an epoch time, by status, from idx_backup_history_time
+        cursor.execute(
+            "SELECT status, COUNT(*), COALESCE(SUM(size), 0), AVG(duration), MAX(duration) FROM backup_history "
+            "WHERE backup_time >= ? GROUP BY status",
+            (int(since),)
+        )
+        return {r[0]: {'runs': r[1], 'bytes': r[2], 'avg_duration': r[3], 'max_duration': r[4]} for r in cursor.fetchall()}
+    
+    @reads
+    def get_slowest_guilds(self, cursor, since, limit=5):
+        # Without the hint SQLite walks the whole per-guild index to avoid sorting the groups
+        cursor.execute(
+            "SELECT guild_id, COUNT(*), AVG(duration), AVG(size) FROM backup_history INDEXED BY idx_backup_history_time "
+            "WHERE backup_time >= ? AND status = 'success' GROUP BY guild_id ORDER BY AVG(duration) DESC LIMIT ?",
+            (int(since), limit)
+        )
+        return [{'guild_id': r[0], 'runs': r[1], 'avg_duration': r[2], 'avg_size': r[3]} for r in cursor.fetchall()]
+    
+    @reads
+    def get_asset_manifest(self, cursor, guild_id):
+        cursor.execute("SELECT asset_key, content_hash, storage_key, size FROM asset_blobs WHERE guild_id = ?", (guild_id,))
+        return {r[0]: {'content_hash': r[1], 'storage_key': r[2], 'size': r[3]} for r in cursor.fetchall()}
+    
+    @writes
+    def save_asset_blobs(self, cursor, guild_id, new_blobs, seen_keys):
+        now = datetime.now().isoformat()
+        cursor.executemany(
+            "INSERT OR REPLACE INTO asset_blobs VALUES (?,?,?,?,?,?)",
+            [(guild_id, key, b['content_hash'], b['storage_key'], b['size'], now) for key, b in new_blobs.items()]
+        )
+        cursor.executemany("UPDATE asset_blobs SET last_seen = ? WHERE guild_id = ? AND asset_key = ?", [(now, guild_id, key) for key in seen_keys])
+    
+    @reads
+    def get_backup_checkpoint(self, cursor, guild_id):
+        cursor.row_factory = sqlite3.Row
+        row = cursor.execute("SELECT * FROM backup_checkpoints WHERE guild_id = ?", (guild_id,)).fetchone()
+        if row is None:
+            return None
+        checkpoint = dict(row)
+        checkpoint['components'] = json.loads(checkpoint['components']) if checkpoint['components'] else {}
+        return checkpoint
+    
+    @reads
+    def get_checkpointed_guilds(self, cursor):
+        return {r[0] for r in cursor.execute("SELECT guild_id FROM backup_checkpoints")}
+    
+    @writes
+    def start_backup_checkpoint(self, cursor, guild_id, started_at, path, baseline):
+        now = time.time()
+        cursor.execute(
+            "INSERT OR REPLACE INTO backup_checkpoints (guild_id, started_at, stage, path, baseline, updated_at) VALUES (?,?,?,?,?,?)",
+            (guild_id, started_at, 'assets', path, baseline, now)
+        )
+    
+    @writes
+    def update_backup_checkpoint(self, cursor, guild_id, **fields):
+        fields['updated_at'] = time.time()
+        if 'components' in fields:
+            fields['components'] = json.dumps(fields['components'])
+        cursor.execute(
+            f"UPDATE backup_checkpoints SET {', '.join(f'{c} = ?' for c in fields)} WHERE guild_id = ?",
+            (*fields.values(), guild_id)
+        )
+    
+    @writes
+    def delete_backup_checkpoint(self, cursor, guild_id):
+        cursor.execute("DELETE FROM backup_checkpoints WHERE guild_id = ?", (guild_id,))
+    
+    @reads
+    def load_guild_changes(self, cursor):
+        cursor.execute("SELECT guild_id, dirty_mask, change_count FROM guild_changes")
+        return cursor.fetchall()
+    
+    @writes
+    def save_guild_changes(self, cursor, rows):
+        cursor.executemany("INSERT OR REPLACE INTO guild_changes VALUES (?,?,?)", [r for r in rows if r[1] or r[2]])
+        cursor.executemany("DELETE FROM guild_changes WHERE guild_id = ?", [(r[0],) for r in rows if not (r[1] or r[2])])
+    
+    @writes
+    def record_backup_objects(self, cursor, rows):
+        # rows are (storage_key, guild_id, created_at, size); objects already tracked are left alone
+        cursor.executemany("INSERT OR IGNORE INTO backup_objects (storage_key, guild_id, created_at, size) VALUES (?,?,?,?)", rows)
+    
+    @reads
+    def get_live_backup_objects(self, cursor, guild_id):
+        cursor.execute("SELECT storage_key, created_at, size FROM backup_objects WHERE guild_id = ? AND deleted_at IS NULL", (guild_id,))
+        return [{'key': r[0], 'created_at': datetime.fromisoformat(r[1]), 'size': r[2]} for r in cursor.fetchall()]
+    
+    @reads
+    def get_latest_backup_key(self, cursor, guild_id):
+        # Newest archive of the guild that retention hasn't deleted
+        cursor.execute("SELECT storage_key FROM backup_objects WHERE guild_id = ? AND deleted_at IS NULL ORDER BY created_at DESC LIMIT 1", (guild_id,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+    
+    @reads
+    def get_backup_costs(self, cursor):
+        # Upload count and total size per guild over every upload we know of, deleted ones included
+        cursor.execute("SELECT guild_id, COUNT(*), SUM(size) FROM backup_objects GROUP BY guild_id")
+        return {r[0]: [r[1], r[2] or 0] for r in cursor.fetchall()}
+    
+    @writes
+    def mark_backup_objects_deleted(self, cursor, storage_keys):
+        now = datetime.now().isoformat()
+        cursor.executemany("UPDATE backup_objects SET deleted_at = ? WHERE storage_key = ?", [(now, key) for key in storage_keys])
+    
+    @reads
+    def get_retention_policies(self, cursor):
+        cursor.row_factory = sqlite3.Row
+        return {r['guild_id']: dict(r) for r in cursor.execute("SELECT * FROM retention_policies")}
+    
+    @reads
+    def get_retention_policy(self, cursor, guild_id):
+        cursor.row_factory = sqlite3.Row
+        row = cursor.execute("SELECT * FROM retention_policies WHERE guild_id = ?", (guild_id,)).fetchone()
+        return dict(row) if row else None
+    
+    @writes
+    def set_retention_policy(self, cursor, guild_id, policy):
+        cursor.execute("INSERT OR IGNORE INTO retention_policies (guild_id) VALUES (?)", (guild_id,))
+        cursor.execute(
+            "UPDATE retention_policies SET keep_last = ?, keep_hourly = ?, keep_daily = ?, keep_weekly = ?, keep_monthly = ? WHERE guild_id = ?",
+            (policy['keep_last'], policy['keep_hourly'], policy['keep_daily'], policy['keep_weekly'], policy['keep_monthly'], guild_id)
+        )
+    
+    @writes
+    def mark_guild_listed(self, cursor, guild_id):
+        cursor.execute("UPDATE retention_policies SET listed_at = ? WHERE guild_id = ?", (datetime.now().isoformat(), guild_id))
+    
+    @writes
+    def acquire_shard_leases(self, cursor, shard_ids, owner, ttl):
+        # Takes free or expired leases and renews our own in one transaction, resolves to the shards we hold
+        now = time.time()
+        cursor.executemany(
+            '''INSERT INTO shard_leases (shard_id, owner, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(shard_id) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+            WHERE shard_leases.owner = excluded.owner OR shard_leases.expires_at < ?''',
+            [(shard_id, owner, now + ttl, now) for shard_id in shard_ids]
+        )
+        held = {r[0] for r in cursor.execute("SELECT shard_id FROM shard_leases WHERE owner = ? AND expires_at > ?", (owner, now))}
+        return held & set(shard_ids)
+    
+    @writes
+    def release_shard_leases(self, cursor, owner):
+        cursor.execute("UPDATE shard_leases SET expires_at = 0 WHERE owner = ?", (owner,))
+    
+    @reads
+    def holds_shard_lease(self, cursor, shard_id, owner):
+        cursor.execute("SELECT 1 FROM shard_leases WHERE shard_id = ? AND owner = ? AND expires_at > ?", (shard_id, owner, time.time()))
+        return cursor.fetchone() is not None
+    
+    @reads
+    def count_active_servers(self, cursor):
+        cursor.execute("SELECT COUNT(*) FROM server_configs WHERE active = 1")
+        return cursor.fetchone()[0]
+    
+    @commands.command(name="compactdb", hidden=True)
+    @commands.is_owner()
+    async def compactdb(self, ctx):
+        backup_cog = self.bot.get_cog("BackupCog")
+        utils_cog = self.bot.get_cog("UtilsCog")
+        written, removed = await asyncio.wrap_future(self.compact_server_config(backup_cog.backup_jobs))
+        await utils_cog.run_blocking(self.vacuum)
+        await ctx.send(f"Rewrote {written} server configs and removed {removed} orphaned rows.")
+
+    @commands.command(name="backupstats", hidden=True)
+    @commands.is_owner()
+    async def backupstats(self, ctx, hours: int = 24):
+        utils_cog = self.bot.get_cog("UtilsCog")
+        since = time.time() - hours * 3600
+        summary = await utils_cog.run_blocking(self.get_history_summary, since)
+        slowest = await utils_cog.run_blocking(self.get_slowest_guilds, since)
+        if not summary:
+            await ctx.send(f"No backups in the last {hours}h.")
+            return
+        lines = [f"Backups in the last {hours}h:"]
+        for status, s in sorted(summary.items()):
+            lines.append(f"{status}: {s['runs']} runs, {s['bytes'] / 1024 / 1024:.1f} MiB, avg {s['avg_duration'] or 0:.1f}s, max {s['max_duration'] or 0:.1f}s")
+        if slowest:
+            lines.append("Slowest servers:")
+            lines += [f"{g['guild_id']}: avg {g['avg_duration'] or 0:.1f}s, {(g['avg_size'] or 0) / 1024 / 1024:.1f} MiB over {g['runs']} runs" for g in slowest]
+        await ctx.send("\n".join(lines))
 
 async def setup(bot):
     await bot.add_cog(DatabaseCog(bot))
\ No newline at end of file
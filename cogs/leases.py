@@ -0,0 +1,74 @@
+import asyncio
+import os
+import socket
+from discord.ext import commands, tasks
+
+class LeaseCog(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        # Every process sharing the database must agree on SHARD_COUNT; a single process needs no setup
+        self.SHARD_COUNT = int(os.getenv("SHARD_COUNT") or 0) or 1
+        self.LEASE_TTL = int(os.getenv("LEASE_TTL") or 90)
+        self.INSTANCE_ID = os.getenv("INSTANCE_ID") or f"{socket.gethostname()}-{os.getpid()}"
+        self.owned = set()
+
+    async def initialize_relationships(self):
+        self.db_cog = self.bot.get_cog("DatabaseCog")
+        self.utils_cog = self.bot.get_cog("UtilsCog")
+        self.backup_cog = self.bot.get_cog("BackupCog")
+        self.metrics = self.bot.get_cog("MetricsCog")
+        # Claim leases before BackupCog loads its jobs so it only schedules guilds we own
+        self.owned = await asyncio.wrap_future(self.db_cog.acquire_shard_leases(self.candidates(), self.INSTANCE_ID, self.LEASE_TTL))
+        self.metrics.gauge('owned_shards', lambda: len(self.owned))
+        self.renew_loop.change_interval(seconds=max(self.LEASE_TTL // 3, 1))
+        self.renew_loop.start()
+
+    async def cog_unload(self):
+        self.renew_loop.cancel()
+        # Hand our guilds to the other processes right away instead of after the lease expires
+        await asyncio.wrap_future(self.db_cog.release_shard_leases(self.INSTANCE_ID))
+        self.owned = set()
+
+    def candidates(self):
+        # Shards this process connects to; other processes may list the same shards as standbys
+        shard_ids = getattr(self.bot, 'shard_ids', None)
+        return sorted(s for s in shard_ids if s < self.SHARD_COUNT) if shard_ids else list(range(self.SHARD_COUNT))
+
+    def shard_for(self, guild_id):
+        return (guild_id >> 22) % self.SHARD_COUNT
+
+    def owns(self, guild_id):
+        return self.shard_for(guild_id) in self.owned
+
+    async def confirm(self, guild_id):
+        # Checked right before a backup runs so a lease lost since the last renewal never causes a double backup
+        owned = await self.utils_cog.run_blocking(self.db_cog.holds_shard_lease, self.shard_for(guild_id), self.INSTANCE_ID)
+        if not owned:
+            # Dropped like a lease lost at renewal, so the guild is loaded afresh if the shard comes back
+            shard = self.shard_for(guild_id)
+            self.owned.discard(shard)
+            self.backup_cog.release_guilds(lambda gid: self.shard_for(gid) == shard)
+        return owned
+
+    @tasks.loop(seconds=30)
+    async def renew_loop(self):
+        try:
+            held = await asyncio.wrap_future(self.db_cog.acquire_shard_leases(self.candidates(), self.INSTANCE_ID, self.LEASE_TTL))
+        except Exception as e:
+            print(f"Failed to renew shard leases: {e}")
+            return
+        gained, lost = held - self.owned, self.owned - held
+        self.owned = held
+        if lost:
+            print(f"Lost shard leases: {sorted(lost)}")
+            self.backup_cog.release_guilds(lambda gid: self.shard_for(gid) in lost)
+        if gained:
+            print(f"Acquired shard leases: {sorted(gained)}")
+            await self.backup_cog.initialize_from_db()
+        try:
+            await self.backup_cog.sync_config_changes()
+        except Exception as e:
+            print(f"Failed to sync config changes: {e}")
+
+async def setup(bot):
+    await bot.add_cog(LeaseCog(bot))
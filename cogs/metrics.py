@@ -0,0 +1,116 @@
+import os
+import resource
+import time
+from aiohttp import web
+from collections import defaultdict
+from contextlib import contextmanager
+from discord.ext import commands, tasks
+
+class MetricsCog(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+        self.METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+        self.METRICS_FILE = os.getenv("METRICS_FILE")
+        self.METRICS_INTERVAL = int(os.getenv("METRICS_INTERVAL", 60))
+        self.counters = defaultdict(float)
+        self.summaries = {}
+        self.gauges = {}
+        self.runner = None
+
+    async def initialize_relationships(self):
+        self.utils_cog = self.bot.get_cog("UtilsCog")
+        self.gauge('process_rss_bytes', self.rss_bytes)
+        self.gauge('ready_seconds', lambda: getattr(self.bot, 'ready_seconds', None) or 0)
+        self.gauge('guilds_cached', lambda: len(self.bot.guilds))
+        if self.METRICS_PORT:
+            app = web.Application()
+            app.router.add_get('/metrics', self.handle_metrics)
+            self.runner = web.AppRunner(app)
+            await self.runner.setup()
+            await web.TCPSite(self.runner, self.METRICS_HOST, self.METRICS_PORT).start()
+        if self.METRICS_FILE:
+            self.write_loop.change_interval(seconds=self.METRICS_INTERVAL)
+            self.write_loop.start()
+
+    async def cog_unload(self):
+        if self.write_loop.is_running():
+            self.write_loop.cancel()
+        if self.runner:
+            await self.runner.cleanup()
+
+    @staticmethod
+    def rss_bytes():
+        # Current resident set size on Linux, peak RSS elsewhere
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError):
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    @staticmethod
+    def key(name, labels):
+        return (name, tuple(sorted(labels.items())))
+
+    def inc(self, name, value=1, **labels):
+        self.counters[self.key(name, labels)] += value
+
+    def observe(self, name, value, **labels):
+        summary = self.summaries.setdefault(self.key(name, labels), [0, 0.0, 0.0])
+        summary[0] += 1
+        summary[1] += value
+        summary[2] = max(summary[2], value)
+
+    def gauge(self, name, func):
+        # func returns a number or a list of (labels, value) pairs
+        self.gauges[name] = func
+
+    @contextmanager
+    def timer(self, stage, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('backup_stage_seconds', time.perf_counter() - start, stage=stage, **labels)
+
+    @staticmethod
+    def format_labels(labels):
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+    def render(self):
+        lines = []
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append(f"backupbot_{name}{self.format_labels(labels)} {value}")
+        for (name, labels), (count, total, peak) in sorted(self.summaries.items()):
+            lines.append(f"backupbot_{name}_count{self.format_labels(labels)} {count}")
+            lines.append(f"backupbot_{name}_sum{self.format_labels(labels)} {total}")
+            lines.append(f"backupbot_{name}_max{self.format_labels(labels)} {peak}")
+        for name, func in sorted(self.gauges.items()):
+            try:
+                value = func()
+            except Exception:
+                continue
+            for labels, v in (value if isinstance(value, list) else [({}, value)]):
+                lines.append(f"backupbot_{name}{self.format_labels(tuple(sorted(labels.items())))} {v}")
+        return "\n".join(lines) + "\n"
+
+    async def handle_metrics(self, request):
+        return web.Response(text=self.render(), content_type='text/plain')
+
+    def write_file(self, text):
+        tmp = f"{self.METRICS_FILE}.tmp"
+        with open(tmp, 'w') as f:
+            f.write(text)
+        os.replace(tmp, self.METRICS_FILE)
+
+    @tasks.loop(seconds=60)
+    async def write_loop(self):
+        try:
+            await self.utils_cog.run_blocking(self.write_file, self.render())
+        except Exception as e:
+            print(f"Failed to write metrics file: {e}")
+
+async def setup(bot):
+    await bot.add_cog(MetricsCog(bot))
@@ -0,0 +1,191 @@
+import hashlib
+import heapq
+import os
+import pytz
+from datetime import datetime, timedelta, timezone
+from discord.ext import commands
+
+DAY_SECONDS = 86400
+
+# Expected runs per day; the load curve covers one UTC day and hourly guilds occupy one slot in every hour
+RUNS_PER_DAY = {'hourly': 24, 'daily': 1, 'weekly': 1 / 7, 'monthly': 12 / 365, 'yearly': 1 / 365}
+
+def hash_slot(guild_id, slots):
+    # Stable across restarts and processes, unlike hash()
+    digest = hashlib.blake2b(str(guild_id).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % slots
+
+def slot_count(freq, slot_seconds):
+    return (3600 if freq == 'hourly' else DAY_SECONDS) // slot_seconds
+
+def slot_buckets(freq, slot, slot_seconds):
+    # Buckets of the UTC day a slot occupies
+    if freq == 'hourly':
+        return range(slot, DAY_SECONDS // slot_seconds, 3600 // slot_seconds)
+    return (slot,)
+
+def slot_weight(freq, cost):
+    # Expected cost a guild adds to each bucket it occupies
+    return cost if freq == 'hourly' else cost * RUNS_PER_DAY.get(freq, 1)
+
+def load_curve(guilds, slots, costs, slot_seconds):
+    curve = [0.0] * (DAY_SECONDS // slot_seconds)
+    for gid, freq in guilds.items():
+        for b in slot_buckets(freq, slots[gid], slot_seconds):
+            curve[b] += slot_weight(freq, costs[gid])
+    return curve
+
+def plan_slots(guilds, costs, slot_seconds=300, tolerance=0.1, current=None, base=None):
+    # guilds maps guild id -> frequency, base is load already placed. Heaviest guilds go first; each keeps its current
+    # slot, or else its hash slot, while that stays within tolerance of the mean load, otherwise it takes the emptiest slot
+    current = current or {}
+    curve = list(base) if base else [0.0] * (DAY_SECONDS // slot_seconds)
+    total = sum(curve) + sum(slot_weight(f, costs[g]) * len(slot_buckets(f, 0, slot_seconds)) for g, f in guilds.items())
+    limit = total / len(curve) * (1 + tolerance)
+    # Loads only grow, so heap entries older than the bucket's current load are skipped
+    heap = [(load, b) for b, load in enumerate(curve)]
+    heapq.heapify(heap)
+    slots = {}
+    for gid in sorted(guilds, key=lambda g: (guilds[g] != 'hourly', -slot_weight(guilds[g], costs[g]), g)):
+        freq = guilds[gid]
+        weight = slot_weight(freq, costs[gid])
+        count = slot_count(freq, slot_seconds)
+        peak = lambda slot: max(curve[b] for b in slot_buckets(freq, slot, slot_seconds)) + weight
+        preferred = [s for s in (current.get(gid), hash_slot(gid, count)) if s is not None and s < count]
+        choice = next((s for s in preferred if peak(s) <= limit), None)
+        if choice is None and freq == 'hourly':
+            choice = min(range(count), key=peak)
+        elif choice is None:
+            while heap[0][0] != curve[heap[0][1]]:
+                heapq.heappop(heap)
+            choice = heap[0][1]
+        for b in slot_buckets(freq, choice, slot_seconds):
+            curve[b] += weight
+            heapq.heappush(heap, (curve[b], b))
+        slots[gid] = choice
+    return slots
+
+class PlannerCog(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.SLOT_MINUTES = int(os.getenv("SLOT_MINUTES", 5))
+        self.PLANNER_TOLERANCE = float(os.getenv("PLANNER_TOLERANCE", 0.1))
+        self.slot_seconds = self.SLOT_MINUTES * 60
+        self.sizes = None
+        self.default_cost = 1
+
+    async def initialize_relationships(self):
+        self.db_cog = self.bot.get_cog("DatabaseCog")
+        self.utils_cog = self.bot.get_cog("UtilsCog")
+        self.backup_cog = self.bot.get_cog("BackupCog")
+
+    def load_costs(self):
+        # Blocking; reads the per-guild upload totals once, record_cost keeps them current afterwards
+        sizes = self.db_cog.get_backup_costs()
+        stats = self.db_cog.get_stats()
+        default = stats.get('data_saved_bytes', 0) / stats['backups_created'] if stats.get('backups_created') else 0
+        averages = [total / count for count, total in sizes.values() if count]
+        self.default_cost = default or (sum(averages) / len(averages) if averages else 1)
+        self.sizes = sizes
+
+    async def ensure_costs(self):
+        if self.sizes is None:
+            await self.utils_cog.run_blocking(self.load_costs)
+
+    def record_cost(self, guild_id, size):
+        if self.sizes is not None:
+            entry = self.sizes.setdefault(guild_id, [0, 0])
+            entry[0] += 1
+            entry[1] += size
+
+    def forget_costs(self):
+        # Bulk imports land in backup_objects directly; the next planning pass reloads the totals
+        self.sizes = None
+
+    def costs(self, guild_ids):
+        # Average archive size per guild; guilds without uploads yet count as an average backup
+        known = {gid: self.sizes.get(gid) for gid in guild_ids}
+        return {gid: entry[1] / entry[0] if entry and entry[0] else self.default_cost for gid, entry in known.items()}
+
+    def scheduled_guilds(self):
+        return {gid: data.get('frequency', 'daily') for gid, data in self.backup_cog.backup_jobs.items() if data.get('job')}
+
+    def anchor_slot(self, anchor, freq):
+        utc = anchor.astimezone(timezone.utc)
+        seconds = utc.hour * 3600 + utc.minute * 60 + utc.second
+        return (seconds % 3600 if freq == 'hourly' else seconds) // self.slot_seconds
+
+    def slot_anchor(self, guild_id, slot, freq, tz_str, anchor=None):
+        # Moves the anchor onto the slot's UTC time of day (minute of the hour for hourly guilds) and keeps its local date,
+        # so weekly and monthly guilds stay on their day. The hash spreads guilds sharing a slot across its seconds.
+        offset = timedelta(seconds=slot * self.slot_seconds + hash_slot(guild_id, self.slot_seconds))
+        base = (anchor or datetime.now(timezone.utc)).astimezone(timezone.utc)
+        if freq == 'hourly':
+            return base.replace(minute=0, second=0, microsecond=0) + offset
+        tz = pytz.timezone(tz_str)
+        local_time = (base.replace(hour=0, minute=0, second=0, microsecond=0) + offset).astimezone(tz).time()
+        return self.utils_cog.localize(tz, datetime.combine(base.astimezone(tz).date(), local_time))
+
+    def snapshot(self, exclude=None):
+        # Taken on the loop: scheduled guilds, their costs and current slots, so the executor never walks live dicts
+        guilds = {gid: f for gid, f in self.scheduled_guilds().items() if gid != exclude}
+        current = {gid: self.anchor_slot(self.backup_cog.backup_jobs[gid]['job'].anchor, f) for gid, f in guilds.items()}
+        return guilds, self.costs([*guilds, *([exclude] if exclude else [])]), current
+
+    def plan(self, guilds, costs, current):
+        # Blocking; rebalanced slots of every guild in a snapshot
+        return plan_slots(guilds, costs, self.slot_seconds, self.PLANNER_TOLERANCE, current)
+
+    def pick_slot(self, guild_id, freq, guilds, current, costs):
+        # Blocking; the least crowded slot the guild fits, around everyone already scheduled
+        base = load_curve(guilds, current, costs, self.slot_seconds)
+        return plan_slots({guild_id: freq}, costs, self.slot_seconds, self.PLANNER_TOLERANCE, base=base)[guild_id]
+
+    async def first_run(self, guild_id, tz_str, freq):
+        # Places a newly scheduled guild; the job anchors are read on the loop, the curve is built off it
+        await self.ensure_costs()
+        guilds, costs, current = self.snapshot(exclude=guild_id)
+        slot = await self.utils_cog.run_blocking(self.pick_slot, guild_id, freq, guilds, current, costs)
+        return self.utils_cog.calculate_next_run(tz_str, freq, self.slot_anchor(guild_id, slot, freq, tz_str))
+
+    def render(self, before, after, width=14):
+        # Hourly totals of both curves as text bars, scaled to the busier one
+        per_hour = len(before) // 24
+        hours = [(sum(before[h * per_hour:(h + 1) * per_hour]), sum(after[h * per_hour:(h + 1) * per_hour])) for h in range(24)]
+        top = max(max(pair) for pair in hours) or 1
+        bar = lambda value: ('█' * round(value / top * width)).ljust(width)
+        lines = [f"UTC   {'before'.ljust(width)} {'after'.ljust(width)}"]
+        lines += [f"{h:02d}:00 {bar(b)} {bar(a)} {a / 1024 / 1024:.0f} MiB" for h, (b, a) in enumerate(hours)]
+        return "\n".join(lines)
+
+    @staticmethod
+    def peak_ratio(curve):
+        mean = sum(curve) / len(curve)
+        return max(curve) / mean if mean else 0.0
+
+    @commands.command(name="rebalance", hidden=True)
+    @commands.is_owner()
+    async def rebalance(self, ctx, mode: str = "preview"):
+        await self.ensure_costs()
+        guilds, costs, current = self.snapshot()
+        planned = await self.utils_cog.run_blocking(self.plan, guilds, costs, current)
+        if not guilds:
+            await ctx.send("No scheduled servers to balance.")
+            return
+        before = load_curve(guilds, current, costs, self.slot_seconds)
+        after = load_curve(guilds, planned, costs, self.slot_seconds)
+        moved = [gid for gid in guilds if planned[gid] != current[gid]]
+        summary = (
+            f"{len(moved)} of {len(guilds)} servers {'moved' if mode == 'apply' else 'would move'}, "
+            f"peak/mean load {self.peak_ratio(before):.2f} -> {self.peak_ratio(after):.2f} ({self.SLOT_MINUTES} minute slots)."
+        )
+        if mode == "apply" and moved:
+            jobs = self.backup_cog.backup_jobs
+            anchors = {gid: self.slot_anchor(gid, planned[gid], guilds[gid], jobs[gid].get('timezone', 'UTC'), jobs[gid]['job'].anchor) for gid in moved}
+            await self.backup_cog.reschedule(moved, anchors)
+        elif mode != "apply":
+            summary += " Run `rebalance apply` to move them."
+        await ctx.send(f"{summary}\n```\n{self.render(before, after)}\n```")
+
+async def setup(bot):
+    await bot.add_cog(PlannerCog(bot))
@@ -0,0 +1,498 @@
+import asyncio
+import base64
+import discord
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import zipfile
+from discord import app_commands
+from botocore.exceptions import ClientError
+from discord.ext import commands
+from typing import Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CHANNEL_TYPES = {'text': 0, 'voice': 2, 'category': 4}
+
+ZIP_MAGIC = (b'PK\x03\x04', b'PK\x05\x06')
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# Step kinds in the order progress is reported
+RESTORE_KINDS = ('roles', 'categories', 'channels', 'emojis', 'stickers')
+
+class RestoreError(Exception):
+    pass
+
+def data_uri(data):
+    if data.startswith(b'GIF8'):
+        mime = 'image/gif'
+    elif data.startswith(b'\xff\xd8\xff'):
+        mime = 'image/jpeg'
+    elif data[8:12] == b'WEBP':
+        mime = 'image/webp'
+    else:
+        mime = 'image/png'
+    return f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+
+class RestoreSource:
+    # A downloaded backup: backup.json and the asset entries it names. Incremental backups keep their assets in the
+    # blob store, those are fetched from the URLs in manifest.json.
+    def __init__(self, path, max_size=4 * 1024 ** 3, max_files=20000):
+        self.path = path
+        # Caps on what an archive may unpack to, so a crafted upload can't fill the disk or exhaust file handles
+        self.max_size = max_size
+        self.max_files = max_files
+        self.zip = None
+        self.entries = {}
+        self.snapshot = None
+        self.manifest = {}
+
+    def load(self):
+        # Blocking; zip entries are read on demand, a tar.zst stream is spooled once
+        with open(self.path, 'rb') as f:
+            magic = f.read(4)
+        if magic.startswith(ZIP_MAGIC):
+            try:
+                self.zip = zipfile.ZipFile(self.path)
+            except zipfile.BadZipFile as e:
+                raise RestoreError("This file is not a BackupBot archive.") from e
+            infos = self.zip.infolist()
+            self.check_limits(len(infos), sum(info.file_size for info in infos))
+        elif magic != ZSTD_MAGIC:
+            raise RestoreError("This file is not a BackupBot archive.")
+        elif zstandard is None:
+            raise RestoreError("This backup is a tar.zst archive and the zstandard package is not installed.")
+        else:
+            try:
+                with open(self.path, 'rb') as raw, zstandard.ZstdDecompressor().stream_reader(raw) as stream:
+                    with tarfile.open(fileobj=stream, mode='r|') as tar:
+                        files = size = 0
+                        for member in tar:
+                            files += 1
+                            size += member.size if member.isfile() else 0
+                            self.check_limits(files, size)
+                            if member.isfile():
+                                spool = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+                                shutil.copyfileobj(tar.extractfile(member), spool)
+                                self.entries[member.name] = spool
+            except (tarfile.TarError, zstandard.ZstdError) as e:
+                raise RestoreError("This file is not a BackupBot archive.") from e
+        snapshot = self.read("backup.json")
+        if snapshot is None:
+            raise RestoreError("This backup was made before restores were supported, only newer backups can be restored.")
+        self.snapshot = json.loads(snapshot)
+        manifest = self.read("manifest.json")
+        self.manifest = json.loads(manifest) if manifest else {}
+
+    def check_limits(self, files, size):
+        if files > self.max_files:
+            raise RestoreError(f"This backup has more than {self.max_files} files, more than a BackupBot archive ever holds.")
+        if size > self.max_size:
+            raise RestoreError(f"This backup unpacks to more than {self.max_size // 1024 ** 2} MB, the most a restore accepts.")
+
+    def read(self, name):
+        # Blocking; the bytes of an entry, None when the backup doesn't have it
+        if name is None:
+            return None
+        if self.zip:
+            try:
+                return self.zip.read(name)
+            except KeyError:
+                return None
+        spool = self.entries.get(name)
+        if spool is None:
+            return None
+        spool.seek(0)
+        return spool.read()
+
+    def close(self):
+        if self.zip:
+            self.zip.close()
+        for spool in self.entries.values():
+            spool.close()
+
+class RestoreStep:
+    __slots__ = ('key', 'action', 'item', 'deps')
+
+    def __init__(self, key, action, item, deps=()):
+        self.key = key
+        self.action = action
+        self.item = item
+        self.deps = tuple(deps)
+
+class RestorePlan:
+    # Steps keyed by (kind, source id) with the keys they wait for: roles before everything whose overwrites name them,
+    # categories before their channels. Objects that already exist under the same name (and category, for channels)
+    # are mapped instead of created, so running a restore again picks up where an interrupted one stopped.
+    def __init__(self, snapshot, existing, same_guild=False):
+        self.snapshot = snapshot
+        self.same_guild = same_guild
+        self.steps = []
+        self.mapped = {}
+        self.kept = {kind: 0 for kind in RESTORE_KINDS}
+        self.build(existing)
+
+    @staticmethod
+    def by_name(items, key=lambda item: item['name']):
+        index = {}
+        for item in items:
+            index.setdefault(key(item), []).append(item)
+        return index
+
+    @staticmethod
+    def take(index, name):
+        matches = index.get(name)
+        return matches.pop(0) if matches else None
+
+    def build(self, existing):
+        source_guild = self.snapshot['guild']['id']
+        target_guild = existing['guild_id']
+        self.mapped[('roles', source_guild)] = target_guild
+
+        roles = self.by_name(r for r in existing['roles'] if not r.get('managed') and int(r['id']) != target_guild)
+        created_roles = []
+        for role in self.snapshot.get('roles', []):
+            key = ('roles', role['id'])
+            if role['default']:
+                self.mapped[key] = target_guild
+                current = next((r for r in existing['roles'] if int(r['id']) == target_guild), None)
+                if current is None or int(current['permissions']) != role['permissions']:
+                    self.steps.append(RestoreStep(('default_role', role['id']), 'edit_default_role', role))
+                continue
+            if role['managed']:
+                continue
+            match = self.take(roles, role['name'])
+            if match:
+                self.mapped[key] = int(match['id'])
+                self.kept['roles'] += 1
+                continue
+            self.steps.append(RestoreStep(key, 'create_role', role))
+            created_roles.append(role)
+        if created_roles:
+            self.steps.append(RestoreStep(('positions', 0), 'move_roles', created_roles, [('roles', r['id']) for r in created_roles]))
+
+        channels = [c for c in existing['channels'] if c['type'] in CHANNEL_TYPES.values()]
+        categories = self.by_name(c for c in channels if c['type'] == CHANNEL_TYPES['category'])
+        for category in self.snapshot.get('categories', []):
+            key = ('categories', category['id'])
+            match = self.take(categories, category['name'])
+            if match:
+                self.mapped[key] = int(match['id'])
+                self.kept['categories'] += 1
+                continue
+            self.steps.append(RestoreStep(key, 'create_channel', dict(category, type='category'), self.overwrite_deps(category)))
+
+        others = self.by_name(
+            (c for c in channels if c['type'] != CHANNEL_TYPES['category']),
+            key=lambda c: (c['type'], c['name'], int(c['parent_id']) if c.get('parent_id') else None)
+        )
+        for channel in self.snapshot.get('channels', []):
+            key = ('channels', channel['id'])
+            parent = ('categories', channel['category']) if channel['category'] else None
+            deps = self.overwrite_deps(channel)
+            if parent and parent not in self.mapped:
+                deps.append(parent)
+            else:
+                match = self.take(others, (CHANNEL_TYPES[channel['type']], channel['name'], self.mapped.get(parent)))
+                if match:
+                    self.mapped[key] = int(match['id'])
+                    self.kept['channels'] += 1
+                    continue
+            self.steps.append(RestoreStep(key, 'create_channel', channel, deps))
+
+        for kind, action in (('emojis', 'create_emoji'), ('stickers', 'create_sticker')):
+            present = self.by_name(existing[kind])
+            for item in self.snapshot.get(kind, []):
+                if self.take(present, item['name']):
+                    self.kept[kind] += 1
+                    continue
+                self.steps.append(RestoreStep((kind, item['id']), action, item))
+
+    def overwrite_deps(self, channel):
+        # Roles this channel's overwrites need that are still to be created
+        return [('roles', o['id']) for o in channel['overwrites'] if o['type'] == 'role' and ('roles', o['id']) not in self.mapped]
+
+    def counts(self):
+        counts = {kind: 0 for kind in RESTORE_KINDS}
+        for step in self.steps:
+            if step.key[0] in counts:
+                counts[step.key[0]] += 1
+        return counts
+
+class RestoreEngine:
+    # Starts every step as soon as the steps it waits for have finished, with at most `concurrency` requests of each
+    # kind in flight.
+    # discord.py queues requests that share a rate-limit bucket and honours 429s, so steps on different routes
+    # (roles, channels, emojis, stickers) proceed side by side while each route runs at its own bucket's pace.
+    def __init__(self, http, guild_id, plan, fetch_asset, concurrency=4, role_icons=False, bitrate_limit=None, reason="Restored from a BackupBot backup"):
+        self.http = http
+        self.guild_id = guild_id
+        self.plan = plan
+        self.fetch_asset = fetch_asset
+        self.role_icons = role_icons
+        self.bitrate_limit = bitrate_limit
+        self.reason = reason
+        # One limit per kind of request: a request queued behind its spent rate-limit bucket holds a slot, and with a
+        # shared limit a few hundred queued role creations would keep every channel and emoji waiting behind them
+        self.semaphores = {step.action: asyncio.Semaphore(concurrency) for step in plan.steps}
+        self.ids = dict(plan.mapped)
+        self.done = {step.key: asyncio.Event() for step in plan.steps}
+        self.completed = {kind: 0 for kind in RESTORE_KINDS}
+        self.totals = plan.counts()
+        self.failed = []
+        self.requests = 0
+
+    async def run(self):
+        await asyncio.gather(*(self.run_step(step) for step in self.plan.steps))
+
+    async def run_step(self, step):
+        try:
+            for dep in step.deps:
+                await self.done[dep].wait()
+            async with self.semaphores[step.action]:
+                result = await getattr(self, step.action)(step.item)
+            if isinstance(result, dict) and 'id' in result:
+                self.ids[step.key] = int(result['id'])
+            if step.key[0] in self.completed:
+                self.completed[step.key[0]] += 1
+        except (discord.HTTPException, RestoreError) as e:
+            self.failed.append((step.key[0], step.item if isinstance(step.item, dict) else {}, str(e)))
+        finally:
+            self.done[step.key].set()
+
+    async def request(self, call, *args, **kwargs):
+        self.requests += 1
+        return await call(*args, reason=self.reason, **kwargs)
+
+    async def asset(self, name):
+        data = await self.fetch_asset(name)
+        if data is None:
+            raise RestoreError(f"{name or 'asset'} is missing from the backup")
+        return data
+
+    async def create_role(self, role):
+        fields = {'name': role['name'], 'permissions': str(role['permissions']), 'color': role['color'], 'hoist': role['hoist'], 'mentionable': role['mentionable']}
+        if self.role_icons and role.get('icon'):
+            data = await self.fetch_asset(role['icon'])
+            if data:
+                fields['icon'] = data_uri(data)
+        return await self.request(self.http.create_role, self.guild_id, **fields)
+
+    async def edit_default_role(self, role):
+        return await self.request(self.http.edit_role, self.guild_id, self.guild_id, permissions=str(role['permissions']))
+
+    async def move_roles(self, roles):
+        # Created roles start at the bottom, one bulk update puts them back in the backup's order
+        positions = [{'id': self.ids[('roles', r['id'])], 'position': r['position']} for r in roles if ('roles', r['id']) in self.ids]
+        if positions:
+            return await self.request(self.http.move_role_position, self.guild_id, positions)
+
+    def overwrites(self, channel):
+        overwrites = []
+        for o in channel['overwrites']:
+            if o['type'] == 'role':
+                target = self.ids.get(('roles', o['id']))
+                if target is None:
+                    # Managed roles and roles that failed to restore
+                    continue
+            elif not self.plan.same_guild:
+                continue
+            else:
+                target = o['id']
+            overwrites.append({'id': target, 'type': 0 if o['type'] == 'role' else 1, 'allow': str(o['allow']), 'deny': str(o['deny'])})
+        return overwrites
+
+    async def create_channel(self, channel):
+        options = {'name': channel['name'], 'position': channel['position'], 'permission_overwrites': self.overwrites(channel)}
+        if channel.get('category'):
+            parent = self.ids.get(('categories', channel['category']))
+            if parent is None:
+                raise RestoreError(f"category of #{channel['name']} could not be restored")
+            options['parent_id'] = parent
+        if channel['type'] == 'text':
+            options.update(topic=channel.get('topic'), nsfw=channel.get('nsfw'), rate_limit_per_user=channel.get('slowmode_delay'))
+        elif channel['type'] == 'voice':
+            bitrate = channel.get('bitrate')
+            if bitrate and self.bitrate_limit:
+                bitrate = min(bitrate, self.bitrate_limit)
+            options.update(bitrate=bitrate, user_limit=channel.get('user_limit'), nsfw=channel.get('nsfw'))
+        return await self.request(self.http.create_channel, self.guild_id, CHANNEL_TYPES[channel['type']], **options)
+
+    async def create_emoji(self, emoji):
+        data = await self.asset(emoji['file'])
+        return await self.request(self.http.create_custom_emoji, self.guild_id, emoji['name'], data_uri(data))
+
+    async def create_sticker(self, sticker):
+        data = await self.asset(sticker['file'])
+        payload = {'name': sticker['name'], 'description': sticker.get('description') or '', 'tags': sticker.get('emoji') or sticker['name']}
+        file = discord.File(io.BytesIO(data), filename=os.path.basename(sticker['file']))
+        self.requests += 1
+        return await self.http.create_guild_sticker(self.guild_id, payload, file, self.reason)
+
+    def progress(self):
+        return ", ".join(f"{kind} {self.completed[kind]}/{self.totals[kind]}" for kind in RESTORE_KINDS if self.totals[kind])
+
+async def fetch_existing(http, guild_id):
+    # Current roles, channels, emojis and stickers straight from the API, the cache may lag behind a running restore
+    roles, channels, emojis, stickers = await asyncio.gather(
+        http.get_roles(guild_id), http.get_all_guild_channels(guild_id), http.get_all_custom_emojis(guild_id), http.get_all_guild_stickers(guild_id)
+    )
+    return {'guild_id': guild_id, 'roles': roles, 'channels': channels, 'emojis': emojis, 'stickers': stickers}
+
+class RestoreCog(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.RESTORE_CONCURRENCY = int(os.getenv("RESTORE_CONCURRENCY", 4))
+        self.RESTORE_PROGRESS_INTERVAL = float(os.getenv("RESTORE_PROGRESS_INTERVAL", 5))
+        self.RESTORE_MAX_SIZE_MB = int(os.getenv("RESTORE_MAX_SIZE_MB", 4096))
+        self.RESTORE_MAX_FILES = int(os.getenv("RESTORE_MAX_FILES", 20000))
+        self.running = set()
+
+    async def initialize_relationships(self):
+        self.db_cog = self.bot.get_cog("DatabaseCog")
+        self.utils_cog = self.bot.get_cog("UtilsCog")
+        self.backup_cog = self.bot.get_cog("BackupCog")
+        self.metrics = self.bot.get_cog("MetricsCog")
+
+    async def fetch_asset(self, source, name):
+        # Archived assets come from the backup itself, incremental ones from the blob store through their manifest entry
+        data = await self.utils_cog.run_blocking(source.read, name)
+        entry = source.manifest.get(name) if data is None and name else None
+        storage_key = self.utils_cog.storage_key_from_url(entry['url']) if entry else None
+        if storage_key:
+            try:
+                data = await self.utils_cog.download_bytes(storage_key)
+            except ClientError:
+                data = None
+        return data
+
+    async def download_source(self, guild_id, path, backup=None, link=None):
+        # The attachment, the backup behind a CDN link, or else the server's newest backup still in storage
+        if backup:
+            await backup.save(path)
+            return backup.filename
+        if link:
+            storage_key = self.utils_cog.storage_key_from_url(link)
+            if not storage_key or not storage_key.startswith("backup/"):
+                raise RestoreError(f"Links must point at a backup on {self.utils_cog.CDN_BASE_URL}.")
+        else:
+            storage_key = await self.utils_cog.run_blocking(self.db_cog.get_latest_backup_key, guild_id)
+            if not storage_key:
+                raise RestoreError("No stored backup of this server was found, attach one or pass its link.")
+        try:
+            await self.utils_cog.download_file(storage_key, path)
+        except ClientError as e:
+            raise RestoreError("That backup is no longer in storage.") from e
+        return os.path.basename(storage_key)
+
+    def describe(self, plan, guild):
+        counts = plan.counts()
+        created = ", ".join(f"{n} {kind}" for kind, n in counts.items() if n) or "nothing"
+        lines = [f"Creates {created}."]
+        kept = ", ".join(f"{n} {kind}" for kind, n in plan.kept.items() if n)
+        if kept:
+            lines.append(f"Already present and kept: {kept}.")
+        free_emojis = guild.emoji_limit - len(guild.emojis)
+        if counts['emojis'] > free_emojis:
+            lines.append(f"Only {max(free_emojis, 0)} emoji slots are free, the rest will fail.")
+        free_stickers = guild.sticker_limit - len(guild.stickers)
+        if counts['stickers'] > free_stickers:
+            lines.append(f"Only {max(free_stickers, 0)} sticker slots are free, the rest will fail.")
+        return "\n".join(lines)
+
+    async def report_progress(self, interaction, engine, started):
+        # Interaction tokens last 15 minutes; a restore outliving one just stops updating the message
+        while True:
+            await asyncio.sleep(self.RESTORE_PROGRESS_INTERVAL)
+            try:
+                await interaction.edit_original_response(content=f"Restoring... {engine.progress()} ({time.monotonic() - started:.0f}s)")
+            except discord.HTTPException:
+                return
+
+    @app_commands.command(name="restore", description="Recreate roles, channels, emojis and stickers from a backup")
+    @app_commands.describe(
+        backup="A backup archive; defaults to this server's newest stored backup",
+        link="The CDN link of a backup",
+        dry_run="Only show what the restore would create"
+    )
+    @app_commands.default_permissions(administrator=True)
+    async def restore(self, interaction: discord.Interaction, backup: Optional[discord.Attachment] = None, link: Optional[str] = None, dry_run: bool = False):
+        if not interaction.guild:
+            await interaction.response.send_message("This command can only be used in a server, not in DMs.", ephemeral=True)
+            return
+
+        guild = interaction.guild
+        me = guild.me or await guild.fetch_member(self.bot.user.id)
+        perms = me.guild_permissions
+        if not dry_run and not (perms.manage_roles and perms.manage_channels and perms.manage_emojis_and_stickers):
+            await interaction.response.send_message("I need the Manage Roles, Manage Channels and Manage Expressions permissions to restore.", ephemeral=True)
+            return
+        if guild.id in self.running:
+            await interaction.response.send_message("A restore is already running in this server.", ephemeral=True)
+            return
+
+        self.running.add(guild.id)
+        await interaction.response.defer(thinking=True)
+        path = os.path.join(self.backup_cog.BACKUP_WORK_DIR, f"restore_{guild.id}")
+        os.makedirs(self.backup_cog.BACKUP_WORK_DIR, exist_ok=True)
+        source = RestoreSource(path, self.RESTORE_MAX_SIZE_MB * 1024 * 1024, self.RESTORE_MAX_FILES)
+        try:
+            filename = await self.download_source(guild.id, path, backup, link)
+            await self.utils_cog.run_blocking(source.load)
+            snapshot = source.snapshot
+            existing = await fetch_existing(self.bot.http, guild.id)
+            plan = RestorePlan(snapshot, existing, same_guild=snapshot['guild']['id'] == guild.id)
+            header = f"Backup `{filename}` of {snapshot['guild']['name']}"
+            if dry_run:
+                await interaction.followup.send(f"{header} (dry run)\n{self.describe(plan, guild)}")
+                return
+            if not plan.steps:
+                await interaction.followup.send(f"{header}: everything in it is already present.")
+                return
+
+            engine = RestoreEngine(
+                self.bot.http, guild.id, plan, lambda name: self.fetch_asset(source, name), self.RESTORE_CONCURRENCY,
+                role_icons='ROLE_ICONS' in guild.features, bitrate_limit=int(guild.bitrate_limit)
+            )
+            await interaction.followup.send(f"{header}\n{self.describe(plan, guild)}\nRestoring...")
+            started = time.monotonic()
+            reporter = asyncio.create_task(self.report_progress(interaction, engine, started))
+            try:
+                await engine.run()
+            finally:
+                reporter.cancel()
+            elapsed = time.monotonic() - started
+            for kind in RESTORE_KINDS:
+                self.metrics.inc('restore_steps_total', engine.completed[kind], kind=kind, outcome='ok')
+            for kind, _, _ in engine.failed:
+                self.metrics.inc('restore_steps_total', kind=kind, outcome='failed')
+            summary = f"Restore finished in {elapsed:.0f}s with {engine.requests} requests: {engine.progress()}."
+            if engine.failed:
+                details = "\n".join(f"- {kind} {item.get('name', '')}: {error[:100]}" for kind, item, error in engine.failed[:10])
+                summary += f"\n{len(engine.failed)} steps failed, run /restore again to retry them:\n{details}"
+            try:
+                await interaction.edit_original_response(content=summary)
+            except discord.HTTPException:
+                await interaction.channel.send(summary)
+        except RestoreError as e:
+            await interaction.followup.send(str(e))
+        except (ValueError, KeyError) as e:
+            # A damaged or hand-edited backup.json
+            await interaction.followup.send(f"This backup's contents could not be read ({type(e).__name__}: {e}).")
+        except discord.HTTPException as e:
+            await interaction.followup.send(f"Discord rejected the restore: {e.text or e.status}")
+        finally:
+            self.running.discard(guild.id)
+            source.close()
+            if os.path.exists(path):
+                os.remove(path)
+
+async def setup(bot):
+    await bot.add_cog(RestoreCog(bot))
@@ -0,0 +1,156 @@
+import asyncio
+import discord
+import os
+import pytz
+from datetime import datetime, timezone
+from discord import app_commands
+from discord.ext import commands, tasks
+from typing import Optional
+
+# Tier name -> strftime bucket; the newest backup in each of the most recent N buckets is kept
+RETENTION_TIERS = {
+    'keep_hourly': '%Y-%m-%d %H',
+    'keep_daily': '%Y-%m-%d',
+    'keep_weekly': '%G-W%V',
+    'keep_monthly': '%Y-%m'
+}
+
+def expired_objects(objects, policy, tz='UTC'):
+    # objects are dicts with 'key' and an aware 'created_at'; a policy of all zeros keeps everything
+    if not objects or not any(policy.get(k, 0) for k in ('keep_last', *RETENTION_TIERS)):
+        return []
+    zone = pytz.timezone(tz)
+    ordered = sorted(objects, key=lambda o: o['created_at'], reverse=True)
+    keep = {o['key'] for o in ordered[:max(policy.get('keep_last', 0), 1)]}
+    for tier, fmt in RETENTION_TIERS.items():
+        limit = policy.get(tier, 0)
+        buckets = set()
+        for obj in ordered:
+            if len(buckets) >= limit:
+                break
+            bucket = obj['created_at'].astimezone(zone).strftime(fmt)
+            if bucket not in buckets:
+                buckets.add(bucket)
+                keep.add(obj['key'])
+    return [o for o in ordered if o['key'] not in keep]
+
+class RetentionCog(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.RETENTION_SWEEP_INTERVAL = int(os.getenv("RETENTION_SWEEP_INTERVAL", 3600))
+        self.last_sweep = {'checked': 0, 'deleted': 0, 'bytes': 0, 'failed': 0}
+
+    async def initialize_relationships(self):
+        self.db_cog = self.bot.get_cog("DatabaseCog")
+        self.utils_cog = self.bot.get_cog("UtilsCog")
+        self.backup_cog = self.bot.get_cog("BackupCog")
+        self.leases = self.bot.get_cog("LeaseCog")
+        self.metrics = self.bot.get_cog("MetricsCog")
+        self.planner = self.bot.get_cog("PlannerCog")
+        self.sweep_loop.change_interval(seconds=self.RETENTION_SWEEP_INTERVAL)
+        self.sweep_loop.start()
+
+    async def cog_unload(self):
+        self.sweep_loop.cancel()
+
+    def record_upload(self, guild_id, storage_key, size):
+        self.db_cog.record_backup_objects([(storage_key, guild_id, datetime.now(timezone.utc).isoformat(), size)])
+        self.planner.record_cost(guild_id, size)
+
+    def import_listing(self, guild_id):
+        # Blocking; a one-off paginated listing picks up archives uploaded before they were tracked
+        rows = [
+            (obj['Key'], guild_id, obj['LastModified'].astimezone(timezone.utc).isoformat(), obj['Size'])
+            for obj in self.utils_cog.list_objects(f"backup/{guild_id}/")
+        ]
+        self.db_cog.record_backup_objects(rows).result()
+        self.db_cog.mark_guild_listed(guild_id).result()
+        return len(rows)
+
+    def plan(self, guild_id, policy):
+        job = self.backup_cog.backup_jobs.get(guild_id, {})
+        return expired_objects(self.db_cog.get_live_backup_objects(guild_id), policy, job.get('timezone', 'UTC'))
+
+    async def sweep(self):
+        summary = {'checked': 0, 'deleted': 0, 'bytes': 0, 'failed': 0}
+        policies = await self.utils_cog.run_blocking(self.db_cog.get_retention_policies)
+        expired = []
+        for guild_id, policy in policies.items():
+            if not self.leases.owns(guild_id):
+                continue
+            if not policy['listed_at']:
+                await self.utils_cog.run_blocking(self.import_listing, guild_id)
+                self.planner.forget_costs()
+            objects = await self.utils_cog.run_blocking(self.plan, guild_id, policy)
+            summary['checked'] += 1
+            expired.extend(objects)
+        if expired:
+            sizes = {o['key']: o['size'] for o in expired}
+            deleted = await self.utils_cog.run_blocking(self.utils_cog.delete_objects, list(sizes))
+            await asyncio.wrap_future(self.db_cog.mark_backup_objects_deleted(deleted))
+            summary['deleted'] = len(deleted)
+            summary['bytes'] = sum(sizes[k] for k in deleted)
+            summary['failed'] = len(sizes) - len(deleted)
+        self.metrics.inc('retention_deleted_objects_total', summary['deleted'])
+        self.metrics.inc('retention_deleted_bytes_total', summary['bytes'])
+        self.metrics.inc('retention_delete_failures_total', summary['failed'])
+        self.last_sweep = summary
+        return summary
+
+    @tasks.loop(seconds=3600)
+    async def sweep_loop(self):
+        try:
+            await self.sweep()
+        except Exception as e:
+            print(f"Retention sweep failed: {e}")
+
+    @app_commands.command(name="retention", description="Choose how many old backups are kept in storage")
+    @app_commands.describe(
+        keep_last="Always keep this many of the newest backups",
+        hourly="Keep the newest backup of this many recent hours",
+        daily="Keep the newest backup of this many recent days",
+        weekly="Keep the newest backup of this many recent weeks",
+        monthly="Keep the newest backup of this many recent months"
+    )
+    async def retention(self, interaction: discord.Interaction,
+        keep_last: Optional[app_commands.Range[int, 0, 1000]] = None,
+        hourly: Optional[app_commands.Range[int, 0, 1000]] = None,
+        daily: Optional[app_commands.Range[int, 0, 1000]] = None,
+        weekly: Optional[app_commands.Range[int, 0, 1000]] = None,
+        monthly: Optional[app_commands.Range[int, 0, 1000]] = None):
+
+        if not interaction.guild:
+            await interaction.response.send_message("This command can only be used in a server, not in DMs.", ephemeral=True)
+            return
+
+        gid = interaction.guild.id
+        if gid not in self.backup_cog.backup_jobs:
+            await interaction.response.send_message("This server is not configured. Please use `/addserver` first.", ephemeral=True)
+            return
+
+        policy = await self.utils_cog.run_blocking(self.db_cog.get_retention_policy, gid)
+        policy = policy or {'keep_last': 0, 'keep_hourly': 0, 'keep_daily': 0, 'keep_weekly': 0, 'keep_monthly': 0}
+        for key, value in (('keep_last', keep_last), ('keep_hourly', hourly), ('keep_daily', daily), ('keep_weekly', weekly), ('keep_monthly', monthly)):
+            if value is not None:
+                policy[key] = value
+        self.db_cog.set_retention_policy(gid, policy)
+
+        if not any(policy[k] for k in ('keep_last', *RETENTION_TIERS)):
+            await interaction.response.send_message("Retention: all backups are kept.")
+            return
+        await interaction.response.send_message(
+            f"Retention: keep last {policy['keep_last']}, hourly {policy['keep_hourly']}, daily {policy['keep_daily']}, "
+            f"weekly {policy['keep_weekly']}, monthly {policy['keep_monthly']}. Older backups are removed from storage."
+        )
+
+    @commands.command(name="reap", hidden=True)
+    @commands.is_owner()
+    async def reap(self, ctx):
+        summary = await self.sweep()
+        await ctx.send(
+            f"Checked {summary['checked']} servers, deleted {summary['deleted']} backups "
+            f"({summary['bytes'] / 1024 / 1024:.1f} MiB), {summary['failed']} failed."
+        )
+
+async def setup(bot):
+    await bot.add_cog(RetentionCog(bot))
@@ -2,8 +2,8 @@ import discord
 import pytz
 from discord.ext import commands
 from discord import app_commands
-from datetime import datetime, timedelta
 from typing import Optional
+from cogs.utils import TimezoneTransformer
 
 class ServerManagementCog(commands.Cog):
     def __init__(self, bot):
@@ -14,6 +14,7 @@ class ServerManagementCog(commands.Cog):
         self.db_cog = self.bot.get_cog("DatabaseCog")
         self.utils_cog = self.bot.get_cog("UtilsCog")
         self.backup_cog = self.bot.get_cog("BackupCog")
+        self.planner = self.bot.get_cog("PlannerCog")
     
     @app_commands.command(name="help", description="Display all available commands and their descriptions")
     @app_commands.describe(language="Select a language for the help message")
@@ -30,11 +31,15 @@ class ServerManagementCog(commands.Cog):
                 ("/activate","تفعيل النسخ الاحتياطي وصنع نسخة احتياطية فورية"),
                 ("/deactivate","تعطيل النسخ الاحتياطي لهذا السيرفر"),
                 ("/status","التحقق من حالة النسخ الاحتياطي والموعد التالي"),
+                ("/history","عرض سجل النسخ الاحتياطية الأخيرة مع الحجم والمدة والنتيجة"),
+                ("/restore","استعادة الرتب والقنوات والإيموجي والملصقات من نسخة احتياطية"),
                 ("/removeserver","إزالة هذا السيرفر من قائمة النسخ الاحتياطي"),
                 ("/changetimezone","تغيير المنطقة الزمنية للنسخ الاحتياطي"),
                 ("/changefrequency","تغيير تكرار النسخ الاحتياطي"),
                 ("/configurebackupcomponents","اختيار مكونات النسخ الاحتياطي"),
                 ("/separatefiles","اختيار إرسال الملفات بشكل منفصل أو كملف واحد"),
+                ("/archiveformat","اختيار صيغة ملف النسخ الاحتياطي (ZIP أو tar.zst الأسرع)"),
+                ("/retention","تحديد عدد النسخ الاحتياطية القديمة التي يتم الاحتفاظ بها في التخزين"),
                 ("/ping","اختبار استجابة البوت")
             ]
         else:
@@ -45,11 +50,15 @@ class ServerManagementCog(commands.Cog):
                 ("/activate","Activate backup scheduler and run a backup now"),
                 ("/deactivate","Deactivate backup scheduler"),
                 ("/status","Check scheduler status and when the next backup is scheduled"),
+                ("/history","Show recent backups with their size, duration and outcome"),
+                ("/restore","Recreate roles, channels, emojis and stickers from a backup"),
                 ("/removeserver","Remove this server from backups"),
                 ("/changetimezone","Change backup timezone"),
                 ("/changefrequency","Change backup frequency"),
                 ("/configurebackupcomponents","Select backup components"),
                 ("/separatefiles","Send backups as separate ZIP files or as a single ZIP file"),
+                ("/archiveformat","Choose the backup archive format (ZIP or the faster tar.zst)"),
+                ("/retention","Choose how many old backups are kept in storage"),
                 ("/ping","Test the bot's response time")
             ]
         for name, desc in cmds:
@@ -72,7 +81,7 @@ class ServerManagementCog(commands.Cog):
     ])
     async def addserver(self, interaction: discord.Interaction, 
                         log_channel: discord.TextChannel, 
-                        timezone: str = "UTC", 
+                        timezone: app_commands.Transform[str, TimezoneTransformer] = "UTC", 
                         frequency: str = "daily"):
         if not interaction.guild:
             await interaction.response.send_message("This command can only be used in a server, not in DMs.", ephemeral=True)
@@ -85,7 +94,9 @@ class ServerManagementCog(commands.Cog):
             return
             
         gid = interaction.guild.id
-        perms = log_channel.permissions_for(interaction.guild.me)
+        # The bot's own member may not be cached under the lean cache profile
+        me = interaction.guild.me or await interaction.guild.fetch_member(self.bot.user.id)
+        perms = log_channel.permissions_for(me)
         if not (perms.send_messages and perms.attach_files):
             await interaction.response.send_message("Missing permissions in that channel.", ephemeral=True)
             return
@@ -110,29 +121,23 @@ class ServerManagementCog(commands.Cog):
                 'save_role_icons': True,
                 'save_emojis': True,
                 'save_stickers': True,
-                'separate_component_files': False
+                'separate_component_files': False,
+                'archive_format': 'zip'
             }
         }
         
-        success = await self.backup_cog.save_server_data(gid)
+        success = await self.backup_cog.save_server_data(gid, force=True)
         if success:
-            next_run = self.utils_cog.calculate_next_run(timezone, frequency)
-            job = self.backup_cog.scheduler.add_job(
-                self.backup_cog.backup_wrapper, "date",
-                run_date=next_run,
-                args=[gid],
-                id=f"backup_{gid}",
-                replace_existing=True
-            )
-            self.backup_cog.backup_jobs[gid]['job'] = job
-            self.db_cog.save_server_config(self.backup_cog.backup_jobs)
+            next_run = await self.planner.first_run(gid, timezone, frequency)
+            self.backup_cog.schedule_backup(gid, next_run)
+            self.db_cog.save_server_config(self.backup_cog.backup_jobs, gid)
             self.backup_cog.update_servers_count()
             await interaction.followup.send(f"Backup completed and scheduler activated. Next backup at {next_run} ({timezone}).")
         else:
             await interaction.followup.send("Backup failed. Please check channel permissions.")
 
     @app_commands.command(name="changetimezone", description="Change the timezone for backup scheduling")
-    async def changetimezone(self, interaction: discord.Interaction, timezone: str):
+    async def changetimezone(self, interaction: discord.Interaction, timezone: app_commands.Transform[str, TimezoneTransformer]):
         if not interaction.guild:
             await interaction.response.send_message("This command can only be used in a server, not in DMs.", ephemeral=True)
             return
@@ -149,25 +154,28 @@ class ServerManagementCog(commands.Cog):
             return
             
         old = self.backup_cog.backup_jobs[gid]['timezone']
-        self.backup_cog.backup_jobs[gid]['timezone'] = timezone
-        job = self.backup_cog.backup_jobs[gid].get('job')
-        
-        if job:
-            self.backup_cog.scheduler.remove_job(job.id)
-            next_run = self.utils_cog.calculate_next_run(timezone, self.backup_cog.backup_jobs[gid]['frequency'])
-            new_job = self.backup_cog.scheduler.add_job(
-                self.backup_cog.backup_wrapper, "date",
-                run_date=next_run,
-                args=[gid],
-                id=f"backup_{gid}",
-                replace_existing=True
-            )
-            self.backup_cog.backup_jobs[gid]['job'] = new_job
-            self.db_cog.save_server_config(self.backup_cog.backup_jobs)
-            await interaction.response.send_message(f"Timezone changed from {old} to {timezone}. Next backup at {next_run}.")
-        else:
-            self.db_cog.save_server_config(self.backup_cog.backup_jobs)
+        if not self.backup_cog.backup_jobs[gid].get('job'):
+            self.backup_cog.backup_jobs[gid]['timezone'] = timezone
+            self.db_cog.save_server_config(self.backup_cog.backup_jobs, gid)
             await interaction.response.send_message(f"Timezone changed from {old} to {timezone}. Scheduler inactive.")
+            return
+        
+        # Placing the guild can take a while on a large database; the old schedule stays until the new slot is known
+        await interaction.response.defer()
+        try:
+            next_run = await self.planner.first_run(gid, timezone, self.backup_cog.backup_jobs[gid]['frequency'])
+        except Exception as e:
+            await interaction.followup.send(f"Could not reschedule the backups, the timezone is still {old}: {e}")
+            return
+        data = self.backup_cog.backup_jobs.get(gid)
+        if not data or not data.get('job'):
+            await interaction.followup.send("The scheduler was deactivated meanwhile, the timezone was not changed.")
+            return
+        data['timezone'] = timezone
+        self.backup_cog.scheduler.remove_job(data['job'].id)
+        self.backup_cog.schedule_backup(gid, next_run)
+        self.db_cog.save_server_config(self.backup_cog.backup_jobs, gid)
+        await interaction.followup.send(f"Timezone changed from {old} to {timezone}. Next backup at {next_run}.")
 
     @app_commands.command(name="changefrequency", description="Change how often server backups are created")
     @app_commands.choices(frequency=[
@@ -193,19 +201,13 @@ class ServerManagementCog(commands.Cog):
         
         if job:
             self.backup_cog.scheduler.remove_job(job.id)
-            next_run = self.utils_cog.calculate_next_run(self.backup_cog.backup_jobs[gid]['timezone'], frequency)
-            new_job = self.backup_cog.scheduler.add_job(
-                self.backup_cog.backup_wrapper, "date",
-                run_date=next_run,
-                args=[gid],
-                id=f"backup_{gid}",
-                replace_existing=True
-            )
-            self.backup_cog.backup_jobs[gid]['job'] = new_job
-            self.db_cog.save_server_config(self.backup_cog.backup_jobs)
+            # Same grid as before, so the backup keeps its time of day
+            next_run = self.utils_cog.calculate_next_run(self.backup_cog.backup_jobs[gid]['timezone'], frequency, job.anchor)
+            self.backup_cog.schedule_backup(gid, next_run)
+            self.db_cog.save_server_config(self.backup_cog.backup_jobs, gid)
             await interaction.response.send_message(f"Frequency changed from {old} to {frequency}. Next backup at {next_run}.")
         else:
-            self.db_cog.save_server_config(self.backup_cog.backup_jobs)
+            self.db_cog.save_server_config(self.backup_cog.backup_jobs, gid)
             await interaction.response.send_message(f"Frequency changed from {old} to {frequency}. Scheduler inactive.")
 
     @app_commands.command(name="configurebackupcomponents", description="Choose what gets saved in your server backups")
@@ -233,7 +235,8 @@ class ServerManagementCog(commands.Cog):
             'save_role_icons': True,
             'save_emojis': True,
             'save_stickers': True,
-            'separate_component_files': False
+            'separate_component_files': False,
+            'archive_format': 'zip'
         })
         
         changes = []
@@ -256,13 +259,13 @@ class ServerManagementCog(commands.Cog):
             prefs['save_stickers'] = stickers
             changes.append(f"Stickers: {'enabled' if stickers else 'disabled'}")
             
-        self.db_cog.save_server_config(self.backup_cog.backup_jobs)
+        self.db_cog.save_server_config(self.backup_cog.backup_jobs, gid)
         
         if changes:
             await interaction.response.send_message("Backup preferences updated:\n" + "\n".join(changes))
         else:
             status = "\n".join(f"{k.replace('save_', '').replace('_', ' ').title()}: {'enabled' if v else 'disabled'}" 
-                              for k, v in prefs.items() if k != 'separate_component_files')
+                              for k, v in prefs.items() if k.startswith('save_'))
             await interaction.response.send_message("Current backup configuration:\n" + status)
 
     @app_commands.command(name="separatefiles", description="Choose if backups should be sent as separate ZIP files or as a single ZIP file")
@@ -278,11 +281,36 @@ class ServerManagementCog(commands.Cog):
             
         prefs = self.backup_cog.backup_jobs[gid].setdefault('preferences', {})
         prefs['separate_component_files'] = separate_files
-        self.db_cog.save_server_config(self.backup_cog.backup_jobs)
+        self.db_cog.save_server_config(self.backup_cog.backup_jobs, gid)
         
         msg = "Backup components will be sent as separate zip files." if separate_files else "Backup components will be sent as a single zip file."
         await interaction.response.send_message(msg)
 
+    @app_commands.command(name="archiveformat", description="Choose the file format of your server backups")
+    @app_commands.describe(archive_format="ZIP opens everywhere; tar.zst is faster to create and smaller")
+    @app_commands.choices(archive_format=[
+        app_commands.Choice(name="ZIP", value="zip"),
+        app_commands.Choice(name="tar.zst (Zstandard)", value="tar.zst")
+    ])
+    async def archiveformat(self, interaction: discord.Interaction, archive_format: str):
+        if not interaction.guild:
+            await interaction.response.send_message("This command can only be used in a server, not in DMs.", ephemeral=True)
+            return
+            
+        gid = interaction.guild.id
+        if gid not in self.backup_cog.backup_jobs:
+            await interaction.response.send_message("This server is not configured. Please use `/addserver` first.", ephemeral=True)
+            return
+            
+        prefs = self.backup_cog.backup_jobs[gid].setdefault('preferences', {})
+        prefs['archive_format'] = archive_format
+        self.db_cog.save_server_config(self.backup_cog.backup_jobs, gid)
+        
+        if self.backup_cog.archive_format(prefs) != archive_format:
+            await interaction.response.send_message(f"Archive format set to {archive_format}, but it isn't available on this bot yet, so backups stay ZIP for now.")
+        else:
+            await interaction.response.send_message(f"Backups will be saved as {archive_format} files.")
+
     @app_commands.command(name="activate", description="Activate the backup scheduler and run a backup immediately")
     async def activate(self, interaction: discord.Interaction):
         if not interaction.guild:
@@ -300,18 +328,11 @@ class ServerManagementCog(commands.Cog):
             
         await interaction.response.send_message("Running backup and activating scheduler...", ephemeral=False)
         
-        success = await self.backup_cog.save_server_data(gid)
+        success = await self.backup_cog.save_server_data(gid, force=True)
         if success:
-            next_run = datetime.now() + timedelta(days=1)
-            job = self.backup_cog.scheduler.add_job(
-                self.backup_cog.backup_wrapper, "date",
-                run_date=next_run,
-                args=[gid],
-                id=f"backup_{gid}",
-                replace_existing=True
-            )
-            self.backup_cog.backup_jobs[gid]['job'] = job
-            self.db_cog.save_server_config(self.backup_cog.backup_jobs)
+            next_run = await self.planner.first_run(gid, self.backup_cog.backup_jobs[gid]['timezone'], self.backup_cog.backup_jobs[gid]['frequency'])
+            self.backup_cog.schedule_backup(gid, next_run)
+            self.db_cog.save_server_config(self.backup_cog.backup_jobs, gid)
             self.backup_cog.update_servers_count()
             await interaction.followup.send(f"Backup completed and scheduler activated. Next backup is at {next_run}.")
         else:
@@ -335,9 +356,10 @@ class ServerManagementCog(commands.Cog):
             
         self.backup_cog.scheduler.remove_job(job.id)
         self.backup_cog.backup_jobs[gid]['job'] = None
-        self.db_cog.save_server_config(self.backup_cog.backup_jobs)
+        self.db_cog.save_server_config(self.backup_cog.backup_jobs, gid)
         self.backup_cog.update_servers_count()
         await interaction.response.send_message("Scheduler deactivated.", ephemeral=False)
+        await self.backup_cog.discard_guild_checkpoint(gid)
 
     @app_commands.command(name="status", description="Check if the backup scheduler is active or deactivated for this server")
     async def status(self, interaction: discord.Interaction):
@@ -356,6 +378,50 @@ class ServerManagementCog(commands.Cog):
         else:
             await interaction.response.send_message(f"Scheduler is active. Next backup at {job.next_run_time}.", ephemeral=False)
 
+    @app_commands.command(name="history", description="Show this server's recent backups")
+    @app_commands.describe(page="Page of the history to show, newest first")
+    async def history(self, interaction: discord.Interaction, page: app_commands.Range[int, 1, 100000] = 1):
+        if not interaction.guild:
+            await interaction.response.send_message("This command can only be used in a server, not in DMs.", ephemeral=True)
+            return
+            
+        gid = interaction.guild.id
+        if gid not in self.backup_cog.backup_jobs:
+            await interaction.response.send_message("This server is not configured. Please use `/addserver` first.", ephemeral=True)
+            return
+            
+        per_page = 10
+        total = await self.utils_cog.run_blocking(self.db_cog.count_backup_history, gid)
+        pages = max((total + per_page - 1) // per_page, 1)
+        if page > pages:
+            await interaction.response.send_message(f"There are only {pages} pages of history.", ephemeral=True)
+            return
+        rows = await self.utils_cog.run_blocking(self.db_cog.get_backup_history, gid, per_page, (page - 1) * per_page)
+        if not rows:
+            await interaction.response.send_message("No backups recorded yet.", ephemeral=True)
+            return
+            
+        embed = discord.Embed(title=f"Backup history for {interaction.guild.name}", color=discord.Color.blue())
+        for r in rows:
+            details = []
+            if r['size'] is not None:
+                details.append(f"{r['size'] / 1024 / 1024:.1f} MiB")
+            if r['duration'] is not None:
+                details.append(f"{r['duration']:.1f}s")
+            lines = [f"{discord.utils.format_dt(r['time'], 'f')} {' • '.join(details)}"]
+            if r['components']:
+                lines.append(", ".join(f"{k.replace('_', ' ')} {v}" for k, v in r['components'].items()))
+            if r['error']:
+                lines.append(r['error'][:200])
+            embed.add_field(name=r['status'].title(), value="\n".join(lines), inline=False)
+            
+        trend = await self.utils_cog.run_blocking(self.db_cog.get_backup_trend, gid)
+        summary = f"Page {page}/{pages} • last {trend['runs']} runs: {trend['success']} saved, {trend['unchanged']} unchanged, {trend['failed']} failed"
+        if trend['avg_size'] is not None:
+            summary += f" • avg {trend['avg_size'] / 1024 / 1024:.1f} MiB in {trend['avg_duration'] or 0:.1f}s"
+        embed.set_footer(text=summary)
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
     @app_commands.command(name="removeserver", description="Remove this server from the backup list")
     async def removeserver(self, interaction: discord.Interaction):
         if not interaction.guild:
@@ -372,9 +438,10 @@ class ServerManagementCog(commands.Cog):
             self.backup_cog.scheduler.remove_job(job.id)
             
         del self.backup_cog.backup_jobs[gid]
-        self.db_cog.save_server_config(self.backup_cog.backup_jobs)
+        self.db_cog.save_server_config(self.backup_cog.backup_jobs, gid)
         self.backup_cog.update_servers_count()
         await interaction.response.send_message("Server removed from backup list.", ephemeral=False)
+        await self.backup_cog.discard_guild_checkpoint(gid)
 
 async def setup(bot):
     await bot.add_cog(ServerManagementCog(bot))
\ No newline at end of file
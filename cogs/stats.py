@@ -0,0 +1,123 @@
+import asyncio
+import os
+import json
+import subprocess
+from collections import defaultdict
+from datetime import datetime
+from discord.ext import commands, tasks
+
+class FileStatsSink:
+    def __init__(self, path):
+        self.path = path
+
+    def publish(self, stats):
+        # Write to a temp file first so readers never see a half-written file
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(stats, f)
+        os.replace(tmp, self.path)
+
+class GitStatsSink:
+    def __init__(self, repo_dir, remote, branch='main', filename='stats.json'):
+        self.repo_dir = os.path.expanduser(repo_dir)
+        self.remote = remote
+        self.branch = branch
+        self.filename = filename
+
+    def git(self, *args):
+        return subprocess.run(['git', *args], cwd=self.repo_dir, check=True, capture_output=True, timeout=120)
+
+    def publish(self, stats):
+        if not os.path.exists(self.repo_dir):
+            subprocess.run(['git', 'clone', self.remote, self.repo_dir], check=True, capture_output=True, timeout=300)
+        else:
+            self.git('checkout', '-f', self.branch)
+            self.git('fetch', 'origin')
+            self.git('reset', '--hard', f'origin/{self.branch}')
+        FileStatsSink(os.path.join(self.repo_dir, self.filename)).publish(stats)
+        self.git('config', 'user.name', 'BackupBot')
+        self.git('config', 'user.email', 'backupbot@example.com')
+        self.git('add', self.filename)
+        if subprocess.run(['git', 'diff', '--cached', '--quiet'], cwd=self.repo_dir).returncode == 0:
+            return
+        self.git('commit', '-m', f'Update stats - {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}')
+        self.git('push', 'origin', self.branch)
+
+class StatsCog(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.increments = defaultdict(float)
+        self.values = {}
+        self.last_published = None
+        self.STATS_FLUSH_INTERVAL = int(os.getenv("STATS_FLUSH_INTERVAL", 300))
+        self.sink = self.create_sink()
+
+    def create_sink(self):
+        # STATS_SINK picks the publish target: git, file or none
+        repo_path = os.getenv("GITHUB_REPO_PATH")
+        token = os.getenv("GITHUB_TOKEN")
+        kind = os.getenv("STATS_SINK", "git" if repo_path and token else "file").lower()
+        if kind == "git" and repo_path:
+            parts = repo_path.rstrip('/').split('/')
+            remote = os.getenv("STATS_GIT_REMOTE") or (f'https://{token}@github.com/{parts[-2]}/{parts[-1]}.git' if token else None)
+            # Without a token or an explicit remote every push would fail, so nothing is published
+            return GitStatsSink(repo_path, remote, branch=os.getenv("STATS_GIT_BRANCH", "main")) if remote else None
+        if kind == "file":
+            return FileStatsSink(os.getenv("STATS_FILE", "stats.json"))
+        return None
+
+    async def initialize_relationships(self):
+        self.db_cog = self.bot.get_cog("DatabaseCog")
+        self.utils_cog = self.bot.get_cog("UtilsCog")
+        self.flush_loop.change_interval(seconds=self.STATS_FLUSH_INTERVAL)
+        self.flush_loop.start()
+
+    async def cog_unload(self):
+        self.flush_loop.cancel()
+        await self.flush()
+
+    def increment(self, name, inc=1):
+        self.increments[name] += inc
+
+    def set(self, name, val):
+        self.values[name] = val
+        self.increments.pop(name, None)
+
+    def publish(self):
+        stats = self.db_cog.get_stats()
+        stats = {
+            'servers_protected': int(stats.get('servers_protected', 0)),
+            'backups_created': int(stats.get('backups_created', 0)),
+            'data_saved_bytes': int(stats.get('data_saved_bytes', 0))
+        }
+        if self.sink is None or stats == self.last_published:
+            return
+        self.sink.publish(stats)
+        self.last_published = stats
+
+    async def flush(self):
+        # Pending counters are taken on the loop, the DB writer and publish run off it
+        if self.increments or self.values:
+            increments, values = dict(self.increments), dict(self.values)
+            self.increments.clear()
+            self.values.clear()
+            try:
+                await asyncio.wrap_future(self.db_cog.apply_stats(increments, values))
+            except Exception as e:
+                for name, inc in increments.items():
+                    self.increments[name] += inc
+                for name, val in values.items():
+                    self.values.setdefault(name, val)
+                print(f"Failed to flush stats: {e}")
+                return
+        try:
+            await self.utils_cog.run_blocking(self.publish)
+        except Exception as e:
+            print(f"Failed to publish stats: {e}")
+
+    @tasks.loop(seconds=300)
+    async def flush_loop(self):
+        await self.flush()
+
+async def setup(bot):
+    await bot.add_cog(StatsCog(bot))
@@ -8,12 +8,105 @@ import os
 import boto3
 import concurrent.futures
 import asyncio
+import time
+import io
+from boto3.s3.transfer import TransferConfig
 from botocore.config import Config
+from botocore.exceptions import ClientError
 from discord.ext import commands
 from discord import app_commands
-from typing import Optional, List
-from datetime import datetime, timedelta
-from urllib.parse import urlparse, quote
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote, unquote
+
+class TimezoneIndex:
+    # Prefix index over every IANA zone and alias, built once so each autocomplete keystroke is a dict lookup
+    def __init__(self, popular=(), limit=25):
+        self.popular = {tz: i for i, tz in enumerate(popular)}
+        self.limit = limit
+        self.rebuilding = False
+        self.build()
+
+    def build(self):
+        # Blocking (~0.2s); everything is built into locals and swapped in at the end so lookups never see half an index
+        now = datetime.now(timezone.utc)
+        offsets = {}
+        matches = {}
+        countries = {}
+        for code, zones in pytz.country_timezones.items():
+            for tz in zones:
+                countries.setdefault(tz, []).append(pytz.country_names.get(code, '').lower())
+        for tz in pytz.all_timezones:
+            offset = now.astimezone(pytz.timezone(tz)).utcoffset()
+            offsets[tz] = self.format_offset(offset)
+            keys = {}
+            name = tz.lower()
+            # 0: the full name, 1: the city or any whole component, 2: a word inside one or the country, 3: the current UTC offset
+            for i in range(1, len(name) + 1):
+                keys[name[:i]] = 0
+            tokens = []
+            for part in name.split('/'):
+                tokens.append((part, 1))
+                tokens += [(w, 2) for w in re.split(r'[_\-]', part) if w != part]
+            for country in countries.get(tz, []):
+                tokens.append((country.replace(' ', '_'), 2))
+                tokens += [(w, 2) for w in country.split(' ')]
+            for token, quality in tokens:
+                for i in range(1, len(token) + 1):
+                    # A whole word matches as well as a city
+                    keys[token[:i]] = min(keys.get(token[:i], 3), quality if i < len(token) else min(quality, 1))
+            for key in self.offset_keys(offset):
+                keys.setdefault(key, 3)
+            rank = self.popular.get(tz, len(self.popular))
+            for key, quality in keys.items():
+                matches.setdefault(key, []).append((quality, rank, tz))
+        # Lists are sorted once here, a lookup only slices
+        self.index = {key: [tz for _, _, tz in sorted(entries)] for key, entries in matches.items()}
+        self.scores = {key: {tz: quality for quality, _, tz in entries} for key, entries in matches.items()}
+        self.offsets = offsets
+        self.built_at = time.monotonic()
+
+    def stale(self):
+        # Offsets drift with DST, rebuild twice a day
+        return time.monotonic() - self.built_at > 12 * 3600
+
+    @staticmethod
+    def format_offset(offset):
+        minutes = int(offset.total_seconds() // 60)
+        sign = '+' if minutes >= 0 else '-'
+        return f"UTC{sign}{abs(minutes) // 60:02d}:{abs(minutes) % 60:02d}"
+
+    @staticmethod
+    def offset_keys(offset):
+        minutes = int(offset.total_seconds() // 60)
+        sign = '+' if minutes >= 0 else '-'
+        hours, mins = divmod(abs(minutes), 60)
+        forms = [f"{sign}{hours}", f"{sign}{hours:02d}"]
+        if mins:
+            forms = [f"{sign}{hours}:{mins:02d}", f"{sign}{hours:02d}:{mins:02d}", f"{sign}{hours}{mins:02d}", f"{sign}{hours:02d}{mins:02d}"]
+        else:
+            forms += [f"{sign}{hours}:00", f"{sign}{hours:02d}:00"]
+        keys = set()
+        for form in forms:
+            for prefix in ('', 'utc', 'gmt', 'utc ', 'gmt '):
+                keys.add(prefix + form)
+        return keys
+
+    def search(self, query):
+        query = query.strip().lower()
+        if not query:
+            return list(self.popular)[:self.limit]
+        key = query.replace(' ', '_')
+        if key in self.index:
+            return self.index[key][:self.limit]
+        if query in self.index:
+            return self.index[query][:self.limit]
+        # Several words ("new york", "america york"): zones matching every word, best worst-match first
+        words = [w for w in re.split(r'[\s/_\-]+', query) if w]
+        if len(words) > 1 and all(w in self.index for w in words):
+            candidates = set(self.index[words[0]]).intersection(*(self.index[w] for w in words[1:]))
+            ranked = sorted(candidates, key=lambda tz: (max(self.scores[w][tz] for w in words), self.popular.get(tz, len(self.popular)), tz))
+            return ranked[:self.limit]
+        return [tz for tz in self.offsets if query in tz.lower()][:self.limit]
 
 class TimezoneTransformer(app_commands.Transformer):
     async def transform(self, interaction, value:str) -> str:
@@ -23,9 +116,156 @@ class TimezoneTransformer(app_commands.Transformer):
         utils_cog = interaction.client.get_cog("UtilsCog")
         if not utils_cog:
             return []
-        return [app_commands.Choice(name=tz, value=tz) 
-                for tz in utils_cog.COMMON_TIMEZONES 
-                if current.lower() in tz.lower()][:25]  # Discord limit
+        index = utils_cog.timezone_index
+        if index.stale() and not index.rebuilding:
+            utils_cog.rebuild_task = asyncio.create_task(utils_cog.rebuild_timezone_index())
+        return [app_commands.Choice(name=f"{tz} ({index.offsets[tz]})", value=tz)
+                for tz in index.search(current)]  # Discord allows 25 choices
+
+MESSAGES_ROUTE = re.compile(r'/channels/\d+/messages$')
+
+class FileRange(io.RawIOBase):
+    # Read-only view over a byte range of a file, so parts can be sent without copying them to disk
+    def __init__(self, path, start, length):
+        self.f = open(path, 'rb')
+        self.start = start
+        self.length = length
+        self.pos = 0
+        self.f.seek(start)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), self.length - self.pos)
+        if n <= 0:
+            return 0
+        data = self.f.read(n)
+        b[:len(data)] = data
+        self.pos += len(data)
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += self.length
+        self.pos = max(0, min(offset, self.length))
+        self.f.seek(self.start + self.pos)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        self.f.close()
+        super().close()
+
+class RateBudget:
+    # Process-wide token bucket shared by every backup. rate is requests per second (0 starts uncapped) with bursts of
+    # up to `burst`. A 429 halves the rate and pauses every caller for its Retry-After; the rate then climbs back by
+    # `recovery` of the cut rate per second, up to `ceiling`. With shared_buckets an X-RateLimit bucket that reports
+    # nothing remaining pauses the budget until it resets; otherwise only global 429s pause it and per-route buckets
+    # are left to discord.py.
+    def __init__(self, rate=0.0, burst=None, min_rate=1.0, recovery=0.1, shared_buckets=False):
+        self.ceiling = rate
+        self.rate = rate
+        self.burst = burst or max(rate, 1.0)
+        self.min_rate = min_rate
+        self.recovery = recovery
+        self.shared_buckets = shared_buckets
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.cut = None
+        self.lock = asyncio.Lock()
+        self.window = [self.updated, 0]
+        self.observed_rate = 0.0
+        self.stats = {'acquired': 0, 'delayed': 0, 'wait_seconds': 0.0, 'throttled': 0, 'pauses': 0, 'paused_seconds': 0.0}
+
+    def current_rate(self, now):
+        if self.cut is None:
+            return self.rate
+        cut_rate, cut_at = self.cut
+        rate = cut_rate * (1 + self.recovery * (now - cut_at))
+        if self.ceiling and rate >= self.ceiling:
+            self.cut = None
+            return self.ceiling
+        return rate
+
+    async def acquire(self):
+        start = time.monotonic()
+        # Waiters queue on the lock, so they are served in arrival order
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                rate = self.current_rate(now)
+                if not rate:
+                    break
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    break
+                await asyncio.sleep((1 - self.tokens) / rate)
+        now = time.monotonic()
+        if now - self.window[0] >= 1.0:
+            self.observed_rate = self.window[1] / (now - self.window[0])
+            self.window = [now, 0]
+        self.window[1] += 1
+        wait = now - start
+        self.stats['acquired'] += 1
+        self.stats['wait_seconds'] += wait
+        if wait > 0.001:
+            self.stats['delayed'] += 1
+
+    def pause(self, seconds):
+        until = time.monotonic() + seconds
+        if until > self.paused_until:
+            self.stats['pauses'] += 1
+            self.stats['paused_seconds'] += until - max(self.paused_until, time.monotonic())
+            self.paused_until = until
+
+    def update(self, status, headers):
+        # Feeds one response back into the budget
+        reset_after = headers.get('Retry-After') or headers.get('X-RateLimit-Reset-After')
+        try:
+            reset_after = float(reset_after) if reset_after else None
+        except ValueError:
+            reset_after = None
+        if status == 429:
+            self.stats['throttled'] += 1
+            now = time.monotonic()
+            # Requests that were already in flight come back limited too, one burst only cuts the rate once
+            if self.cut is None or now - self.cut[1] >= 1.0:
+                # An uncapped budget starts from what it was actually doing when the 429 came
+                rate = self.current_rate(now) or max(self.observed_rate, self.window[1] / max(now - self.window[0], 1.0))
+                self.cut = (max(self.min_rate, rate / 2), now)
+                self.tokens = min(self.tokens, 1.0)
+                self.updated = now
+            if reset_after and (self.shared_buckets or headers.get('X-RateLimit-Global', '').lower() == 'true'):
+                self.pause(reset_after)
+        elif self.shared_buckets and headers.get('X-RateLimit-Remaining') == '0' and reset_after:
+            self.pause(reset_after)
+
+    def snapshot(self):
+        now = time.monotonic()
+        acquired = self.stats['acquired']
+        return {
+            'rate': self.current_rate(now),
+            'ceiling': self.ceiling,
+            'tokens': self.tokens,
+            'paused_for': max(0.0, self.paused_until - now),
+            'observed_rate': self.observed_rate,
+            'avg_wait': self.stats['wait_seconds'] / acquired if acquired else 0.0,
+            **self.stats
+        }
 
 class UtilsCog(commands.Cog):
     def __init__(self, bot):
@@ -35,6 +275,9 @@ class UtilsCog(commands.Cog):
         self.R2_SECRET_KEY = os.getenv("R2_SECRET_KEY")
         self.R2_ENDPOINT = os.getenv("R2_ENDPOINT")
         self.R2_BUCKET_NAME = os.getenv("R2_BUCKET_NAME")
+        self.R2_PART_SIZE = int(os.getenv("R2_PART_SIZE_MB", 8)) * 1024 * 1024
+        self.R2_UPLOAD_CONCURRENCY = int(os.getenv("R2_UPLOAD_CONCURRENCY", 4))
+        self.CDN_BASE_URL = os.getenv("CDN_BASE_URL", "https://cdn.backupbot.net").rstrip('/')
         self.MAX_DISCORD_FILE_SIZE = 10 * 1024 * 1024
         self.CHUNK_SIZE = 10 * 1024 * 1024
         
@@ -55,93 +298,293 @@ class UtilsCog(commands.Cog):
             "Pacific/Auckland", "Pacific/Fiji", "Pacific/Honolulu",
             "Africa/Cairo", "Africa/Johannesburg", "Africa/Lagos", "Africa/Nairobi", "Africa/Casablanca"
         ]
+        # Every IANA zone is searchable, the common ones above rank first
+        self.timezone_index = TimezoneIndex(self.COMMON_TIMEZONES)
+        self.rebuild_task = None
+        
+        # Bounded executor shared by every cog for blocking work
+        self.EXECUTOR_WORKERS = int(os.getenv("EXECUTOR_WORKERS", 8))
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.EXECUTOR_WORKERS,
+            thread_name_prefix="backupbot"
+        )
+        
+        # Storage client is created once at cog load and reused for every upload
+        self.s3 = None
+        self.transfer_config = TransferConfig(
+            multipart_threshold=self.R2_PART_SIZE,
+            multipart_chunksize=self.R2_PART_SIZE,
+            max_concurrency=self.R2_UPLOAD_CONCURRENCY,
+            use_threads=True
+        )
+        self.upload_stats = {'uploads': 0, 'failures': 0, 'bytes': 0, 'seconds': 0.0, 'last_mbps': 0.0}
+        
+        # Request budgets shared by every backup: asset downloads from the Discord CDN and log channel sends
+        self.cdn_budget = RateBudget(rate=float(os.getenv("CDN_RATE_LIMIT", 0)), shared_buckets=True)
+        self.send_budget = RateBudget(rate=float(os.getenv("SEND_RATE_LIMIT", 10)), burst=float(os.getenv("SEND_BURST", 5)))
+    
+    async def cog_load(self):
+        self.s3 = await self.run_blocking(self.create_s3_client)
+    
+    async def cog_unload(self):
+        self.executor.shutdown(wait=False)
     
     async def initialize_relationships(self):
         # This cog doesn't need references to others
         pass
     
+    async def run_blocking(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+    
+    def create_s3_client(self):
+        return boto3.client(
+            's3',
+            endpoint_url=self.R2_ENDPOINT,
+            aws_access_key_id=self.R2_ACCESS_KEY,
+            aws_secret_access_key=self.R2_SECRET_KEY,
+            config=Config(
+                signature_version='s3v4',
+                max_pool_connections=self.EXECUTOR_WORKERS * self.R2_UPLOAD_CONCURRENCY
+            )
+        )
+    
+    async def rebuild_timezone_index(self):
+        self.timezone_index.rebuilding = True
+        try:
+            await self.run_blocking(self.timezone_index.build)
+        finally:
+            self.timezone_index.rebuilding = False
+    
+    async def send_message(self, channel, *args, **kwargs):
+        # Log channel sends go through the shared send budget, the responses feed it through observe_response
+        await self.send_budget.acquire()
+        return await channel.send(*args, **kwargs)
+    
+    def observe_response(self, method, path, status, headers):
+        # Called for every Discord REST response, discord.py's own retries included
+        if method == 'POST' and MESSAGES_ROUTE.search(path):
+            self.send_budget.update(status, headers)
+        elif status == 429 and headers.get('X-RateLimit-Global', '').lower() == 'true':
+            # A global limit stops every route, sends included
+            self.send_budget.update(status, headers)
+    
+    def get_upload_stats(self):
+        stats = dict(self.upload_stats)
+        stats['avg_mbps'] = stats['bytes'] / 1024 / 1024 / stats['seconds'] if stats['seconds'] else 0.0
+        return stats
+    
     def sanitize_filename(self, name: str) -> str:
         name = re.sub(r'[\\/*?:"<>|]', '_', name)
         return name.replace(' ', '-')
     
-    async def upload_to_cdn(self, file_path, guild_id):
-        return await self.upload_to_cloudflare_r2(file_path, guild_id)
-    
-    async def upload_to_cloudflare_r2(self, file_path, guild_id):
+    def backup_storage_key(self, file_path, guild_id):
         unique_id = ''.join(random.choices(string.ascii_letters + string.digits, k=16))
-        def upload_to_r2():
-            s3 = boto3.client(
-                's3',
-                endpoint_url=self.R2_ENDPOINT,
-                aws_access_key_id=self.R2_ACCESS_KEY,
-                aws_secret_access_key=self.R2_SECRET_KEY,
-                config=Config(signature_version='s3v4')
-            )
-            server_folder = str(guild_id)
-            original_filename = os.path.basename(file_path)
-            storage_key = f"backup/{server_folder}/{unique_id}/{original_filename}"
-            s3.upload_file(file_path, self.R2_BUCKET_NAME, storage_key)
-            encoded_filename = quote(original_filename)
-            return f"https://cdn.backupbot.net/backup/{server_folder}/{unique_id}/{encoded_filename}"
-        with concurrent.futures.ThreadPoolExecutor() as pool:
-            return await asyncio.get_event_loop().run_in_executor(pool, upload_to_r2)
-    
-    def split_file(self, path, chunk_size=None):
+        return f"backup/{guild_id}/{unique_id}/{os.path.basename(file_path)}"
+    
+    async def upload_file(self, file_path, storage_key):
+        if self.s3 is None:
+            self.s3 = await self.run_blocking(self.create_s3_client)
+        size = os.path.getsize(file_path)
+        start = time.perf_counter()
+        try:
+            # Archives above the part size go up as parallel multipart uploads
+            await self.run_blocking(lambda: self.s3.upload_file(file_path, self.R2_BUCKET_NAME, storage_key, Config=self.transfer_config))
+        except Exception:
+            self.upload_stats['failures'] += 1
+            raise
+        elapsed = time.perf_counter() - start
+        self.upload_stats['uploads'] += 1
+        self.upload_stats['bytes'] += size
+        self.upload_stats['seconds'] += elapsed
+        self.upload_stats['last_mbps'] = size / 1024 / 1024 / elapsed if elapsed else 0.0
+        return storage_key
+    
+    async def upload_fileobj(self, f, storage_key):
+        if self.s3 is None:
+            self.s3 = await self.run_blocking(self.create_s3_client)
+        await self.run_blocking(lambda: self.s3.upload_fileobj(f, self.R2_BUCKET_NAME, storage_key, Config=self.transfer_config))
+        return storage_key
+    
+    async def upload_resumable(self, file_path, storage_key, upload_id=None, part_size=None, on_start=None):
+        # Multipart upload that picks up where an interrupted one stopped: parts R2 already acknowledged under upload_id
+        # are kept. A new upload id goes to on_start before any part is sent, so the caller can persist it.
+        if self.s3 is None:
+            self.s3 = await self.run_blocking(self.create_s3_client)
+        size = os.path.getsize(file_path)
+        if not upload_id and size <= self.R2_PART_SIZE:
+            return await self.upload_file(file_path, storage_key)
+        part_size = part_size or self.R2_PART_SIZE
+        start = time.perf_counter()
+        sent = 0
+        try:
+            acknowledged = {}
+            if upload_id:
+                try:
+                    acknowledged = await self.run_blocking(self.list_parts, storage_key, upload_id)
+                except ClientError as e:
+                    # Aborted or expired on the R2 side, start over
+                    if e.response.get('Error', {}).get('Code') != 'NoSuchUpload':
+                        raise
+                    upload_id = None
+            if not upload_id:
+                upload_id = (await self.run_blocking(lambda: self.s3.create_multipart_upload(Bucket=self.R2_BUCKET_NAME, Key=storage_key)))['UploadId']
+                if on_start:
+                    await on_start(upload_id, part_size)
+            parts = [(number, offset, min(part_size, size - offset)) for number, offset in enumerate(range(0, size, part_size), 1)]
+            etags = {number: acknowledged[number]['ETag'] for number, _, length in parts if acknowledged.get(number, {}).get('Size') == length}
+            semaphore = asyncio.Semaphore(self.R2_UPLOAD_CONCURRENCY)
+            
+            async def send(number, offset, length):
+                nonlocal sent
+                async with semaphore:
+                    etags[number] = await self.run_blocking(self.upload_part, file_path, storage_key, upload_id, number, offset, length)
+                sent += length
+            
+            tasks = [asyncio.ensure_future(send(*part)) for part in parts if part[0] not in etags]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                # Parts still waiting for a turn are left for the retry
+                for task in tasks:
+                    task.cancel()
+                raise
+            await self.run_blocking(lambda: self.s3.complete_multipart_upload(
+                Bucket=self.R2_BUCKET_NAME, Key=storage_key, UploadId=upload_id,
+                MultipartUpload={'Parts': [{'PartNumber': number, 'ETag': etags[number]} for number, _, _ in parts]}
+            ))
+        except Exception:
+            self.upload_stats['failures'] += 1
+            raise
+        elapsed = time.perf_counter() - start
+        self.upload_stats['uploads'] += 1
+        self.upload_stats['bytes'] += sent
+        self.upload_stats['seconds'] += elapsed
+        self.upload_stats['last_mbps'] = sent / 1024 / 1024 / elapsed if elapsed else 0.0
+        return storage_key
+    
+    def upload_part(self, file_path, storage_key, upload_id, number, offset, length):
+        # Blocking; sends one part straight from the file and returns its ETag
+        with FileRange(file_path, offset, length) as body:
+            resp = self.s3.upload_part(Bucket=self.R2_BUCKET_NAME, Key=storage_key, UploadId=upload_id, PartNumber=number, Body=body, ContentLength=length)
+        return resp['ETag']
+    
+    def list_parts(self, storage_key, upload_id):
+        # Blocking; every part R2 acknowledged for the upload, by part number
+        paginator = self.s3.get_paginator('list_parts')
+        parts = {}
+        for page in paginator.paginate(Bucket=self.R2_BUCKET_NAME, Key=storage_key, UploadId=upload_id):
+            for part in page.get('Parts', []):
+                parts[part['PartNumber']] = part
+        return parts
+    
+    def abort_upload(self, storage_key, upload_id):
+        # Blocking; frees the parts of an upload that will never complete
+        try:
+            self.s3.abort_multipart_upload(Bucket=self.R2_BUCKET_NAME, Key=storage_key, UploadId=upload_id)
+        except ClientError:
+            pass
+    
+    def list_objects(self, prefix):
+        # Blocking; pages through ListObjectsV2 so prefixes of any size can be listed
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.R2_BUCKET_NAME, Prefix=prefix, PaginationConfig={'PageSize': 1000}):
+            for obj in page.get('Contents', []):
+                yield obj
+    
+    def delete_objects(self, storage_keys):
+        # Blocking; one multi-object delete request per 1000 keys, returns the keys that are gone
+        deleted = []
+        for i in range(0, len(storage_keys), 1000):
+            batch = storage_keys[i:i + 1000]
+            resp = self.s3.delete_objects(Bucket=self.R2_BUCKET_NAME, Delete={'Objects': [{'Key': k} for k in batch], 'Quiet': True})
+            failed = {e['Key'] for e in resp.get('Errors', []) if e.get('Code') != 'NoSuchKey'}
+            deleted.extend(k for k in batch if k not in failed)
+        return deleted
+    
+    def blob_url(self, storage_key):
+        return f"{self.CDN_BASE_URL}/{quote(storage_key)}"
+    
+    def storage_key_from_url(self, url):
+        # Inverse of blob_url; None for links that aren't on our CDN
+        if not url.startswith(self.CDN_BASE_URL + '/'):
+            return None
+        return unquote(url[len(self.CDN_BASE_URL) + 1:].split('?')[0])
+    
+    async def download_file(self, storage_key, file_path):
+        if self.s3 is None:
+            self.s3 = await self.run_blocking(self.create_s3_client)
+        await self.run_blocking(lambda: self.s3.download_file(self.R2_BUCKET_NAME, storage_key, file_path, Config=self.transfer_config))
+        return file_path
+    
+    async def download_bytes(self, storage_key):
+        if self.s3 is None:
+            self.s3 = await self.run_blocking(self.create_s3_client)
+        return await self.run_blocking(lambda: self.s3.get_object(Bucket=self.R2_BUCKET_NAME, Key=storage_key)['Body'].read())
+    
+    def upload_limit(self, guild):
+        # Boosted guilds accept larger attachments, use the tier's limit
+        return max(getattr(guild, 'filesize_limit', 0) or 0, self.MAX_DISCORD_FILE_SIZE)
+    
+    def plan_parts(self, path, chunk_size=None):
         if chunk_size is None:
             chunk_size = self.CHUNK_SIZE
+        # Leave headroom for the multipart envelope of the upload request
+        chunk_size = max(chunk_size - 64 * 1024, 1024 * 1024)
         size = os.path.getsize(path)
-        base = os.path.splitext(path)[0]
-        chunks = []
-        with open(path,'rb') as f:
-            idx = 0
-            while True:
-                data = f.read(chunk_size)
-                if not data:
-                    break
-                part = f"{base}_part{idx:03d}.zip"
-                with open(part,'wb') as pf:
-                    pf.write(data)
-                chunks.append(part)
-                idx += 1
-        return chunks
-    
-    async def send_chunked_backup(self, channel, name, zip_name):
-        chunks = self.split_file(zip_name)
-        total = len(chunks)
+        return [(start, min(chunk_size, size - start)) for start in range(0, size, chunk_size)]
+    
+    async def send_chunked_backup(self, channel, name, zip_name, chunk_size=None):
+        parts = self.plan_parts(zip_name, chunk_size)
+        total = len(parts)
         if total == 0:
-            await channel.send("Error: Failed to create backup chunks.")
+            await self.send_message(channel, "Error: Failed to create backup chunks.")
             return False
-        await channel.send(f"Server backup for {name} (Total parts: {total}):")
+        await self.send_message(channel, f"Server backup for {name} (Total parts: {total}):")
+        filename = os.path.basename(zip_name)
+        base, ext = (filename[:-len('.tar.zst')], '.tar.zst') if filename.endswith('.tar.zst') else os.path.splitext(filename)
         try:
-            for i, part in enumerate(chunks):
-                with open(part,'rb') as f:
-                    await channel.send(f"Backup part {i+1}/{total}:", file=discord.File(f, filename=os.path.basename(part)))
-                os.remove(part)
+            # Parts go out in order; discord.py paces each send against the channel's rate-limit bucket
+            for i, (start, length) in enumerate(parts):
+                with FileRange(zip_name, start, length) as part:
+                    await self.send_message(channel, f"Backup part {i+1}/{total}:", file=discord.File(io.BufferedReader(part), filename=f"{base}_part{i:03d}{ext}"))
             return True
-        except:
-            for c in chunks:
-                if os.path.exists(c):
-                    os.remove(c)
+        except (discord.HTTPException, OSError):
             return False
     
-    def calculate_next_run(self, tz_str, freq):
+    def calculate_next_run(self, tz_str, freq, anchor=None, after=None):
+        # First slot after `after` (default now) on the grid anchor + k * period (k may be negative), in the guild's
+        # local wall-clock time. Without an anchor the grid starts now, so the first run is one period away.
         tz = pytz.timezone(tz_str)
-        now = datetime.now(tz=tz)
-        if freq=="hourly":
-            return now+timedelta(hours=1)
-        if freq=="daily":
-            return now+timedelta(days=1)
-        if freq=="weekly":
-            return now+timedelta(days=7)
-        if freq=="monthly":
-            ny = now.year+(1 if now.month==12 else 0)
-            nm = 1 if now.month==12 else now.month+1
-            ld = calendar.monthrange(ny,nm)[1]
-            day = min(now.day, ld)
-            return now.replace(year=ny, month=nm, day=day)
-        if freq=="yearly":
-            return now.replace(year=now.year+1)
-        return now+timedelta(days=1)
+        now = (after or datetime.now(tz=tz)).astimezone(tz)
+        local = (anchor or now).astimezone(tz)
+        if freq == "hourly":
+            # Hours are uniform in absolute time, step there so DST changes don't skip or repeat a run
+            periods = int((now - local).total_seconds() // 3600) + 1
+            return (local + timedelta(hours=periods)).astimezone(tz)
+        if freq in ("monthly", "yearly"):
+            step = 1 if freq == "monthly" else 12
+            elapsed = (now.year - local.year) * 12 + now.month - local.month
+            n = elapsed // step
+            while True:
+                total = local.month - 1 + n * step
+                year, month = local.year + total // 12, total % 12 + 1
+                day = min(local.day, calendar.monthrange(year, month)[1])
+                slot = self.localize(tz, datetime.combine(datetime(year, month, day).date(), local.time().replace(tzinfo=None)))
+                if slot > now:
+                    return slot
+                n += 1
+        step = 7 if freq == "weekly" else 1
+        n = (now.date() - local.date()).days // step
+        while True:
+            slot = self.localize(tz, datetime.combine(local.date() + timedelta(days=n * step), local.time().replace(tzinfo=None)))
+            if slot > now:
+                return slot
+            n += 1
+    
+    @staticmethod
+    def localize(tz, naive):
+        # Wall-clock times that fall in a DST gap move forward instead of raising
+        return tz.normalize(tz.localize(naive))
     
     @commands.hybrid_command(name="ping", description="Test the bot's response time")
     async def ping(self, ctx):